@@ -0,0 +1,5 @@
+"""Benchmark suite for the SquishFile compression engines.
+
+Run with ``python -m benchmarks.run``; compare two result files with
+``python -m benchmarks.compare``.
+"""
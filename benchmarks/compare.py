@@ -0,0 +1,101 @@
+"""Compare two benchmark reports produced by ``benchmarks.run``.
+
+Usage:
+    python -m benchmarks.compare base.json new.json [--threshold 0.1]
+
+Prints the relative change of every engine metric and every throughput
+measurement. Exits with status 1 if any metric regressed by more than
+the threshold, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+# Metric name -> True if a higher value is better
+ENGINE_METRICS = {
+    "wall_time_s_mean": False,
+    "wall_time_s_p95": False,
+    "iterations_mean": False,
+    "peak_rss_growth_mb": False,
+    "mean_abs_size_error": False,
+    "within_tolerance_ratio": True,
+    "ssim_mean": True,
+    "input_mb_per_s": True,
+}
+
+
+def _delta(base: float | None, new: float | None) -> float | None:
+    if base is None or new is None or base == 0:
+        return None
+    return (new - base) / abs(base)
+
+
+def _is_regression(delta: float | None, higher_is_better: bool, threshold: float) -> bool:
+    if delta is None:
+        return False
+    return -delta > threshold if higher_is_better else delta > threshold
+
+
+def compare(base: dict, new: dict, threshold: float) -> tuple[list[dict], bool]:
+    """Return per-metric comparison rows and whether anything regressed."""
+    rows = []
+    regressed = False
+
+    for kind in sorted(set(base["engines"]) & set(new["engines"])):
+        for metric, higher_is_better in ENGINE_METRICS.items():
+            b = base["engines"][kind].get(metric)
+            n = new["engines"][kind].get(metric)
+            delta = _delta(b, n)
+            bad = _is_regression(delta, higher_is_better, threshold)
+            regressed |= bad
+            rows.append({"scope": kind, "metric": metric, "base": b, "new": n,
+                         "delta": delta, "regression": bad})
+
+    base_tp = {t["workers"]: t for t in base.get("throughput", [])}
+    for t in new.get("throughput", []):
+        if t["workers"] not in base_tp:
+            continue
+        b = base_tp[t["workers"]]["files_per_sec"]
+        n = t["files_per_sec"]
+        delta = _delta(b, n)
+        bad = _is_regression(delta, True, threshold)
+        regressed |= bad
+        rows.append({"scope": f"throughput@{t['workers']}", "metric": "files_per_sec",
+                     "base": b, "new": n, "delta": delta, "regression": bad})
+
+    return rows, regressed
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.4g}"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change that counts as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows, regressed = compare(base, new, args.threshold)
+
+    print(f"{'scope':<20} {'metric':<24} {'base':>10} {'new':>10} {'change':>9}")
+    for row in rows:
+        change = "-" if row["delta"] is None else f"{row['delta']:+.1%}"
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['scope']:<20} {row['metric']:<24} {_fmt(row['base']):>10} "
+              f"{_fmt(row['new']):>10} {change:>9}{flag}")
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
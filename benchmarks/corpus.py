@@ -0,0 +1,249 @@
+"""Deterministic generated corpora for the benchmark suite.
+
+Every item is rebuilt from fixed seeds on each run, so two result files
+produced on different machines or commits measure the same inputs.
+"""
+import io
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg
+
+KINDS = [
+    "photo-jpeg", "photo-webp", "screenshot-png", "alpha-png", "pdf",
+    "video-short", "video-long", "audio-short", "audio-long",
+]
+
+# Corpus presets: "quick" keeps a full run under a minute on a laptop,
+# "full" uses realistic sizes and long media.
+PRESETS = {
+    "quick": {
+        "photo_size": (1024, 768),
+        "screenshot_size": (1280, 800),
+        "alpha_size": (640, 640),
+        "pdf_pages": 4,
+        "video_size": (640, 360),
+        "video_short_s": 2,
+        "video_long_s": 8,
+        "audio_short_s": 5,
+        "audio_long_s": 30,
+    },
+    "full": {
+        "photo_size": (3000, 2000),
+        "screenshot_size": (2560, 1440),
+        "alpha_size": (1200, 1200),
+        "pdf_pages": 20,
+        "video_size": (1280, 720),
+        "video_short_s": 5,
+        "video_long_s": 60,
+        "audio_short_s": 15,
+        "audio_long_s": 300,
+    },
+}
+
+
+def _photo_array(width: int, height: int, seed: int) -> np.ndarray:
+    """Photo-like content: smooth lighting, soft blobs and sensor noise."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    xs /= width
+    ys /= height
+
+    img = np.zeros((height, width, 3), dtype=np.float32)
+    base = rng.uniform(40, 200, size=3)
+    for c in range(3):
+        img[..., c] = base[c] + 50 * np.sin(xs * rng.uniform(1, 4) + ys * rng.uniform(1, 4))
+
+    for _ in range(12):
+        cx, cy = rng.uniform(0, 1, size=2)
+        radius = rng.uniform(0.05, 0.3)
+        color = rng.uniform(-80, 80, size=3)
+        blob = np.exp(-((xs - cx) ** 2 + (ys - cy) ** 2) / (2 * radius ** 2))
+        img += blob[..., None] * color
+
+    img += rng.normal(0, 6, size=img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _screenshot_image(width: int, height: int, seed: int) -> Image.Image:
+    """Screenshot-like content: flat panels, borders and lines of text."""
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (width, height), (245, 246, 248))
+    draw = ImageDraw.Draw(img)
+
+    draw.rectangle([0, 0, width, 48], fill=(38, 50, 72))
+    draw.rectangle([0, 48, 240, height], fill=(230, 233, 238))
+    for i in range(int(rng.integers(20, 30))):
+        y = 70 + i * 28
+        draw.text((16, y), f"Sidebar item {i}", fill=(60, 60, 60))
+
+    for row in range(6):
+        for col in range(3):
+            x0 = 270 + col * (width - 300) // 3
+            y0 = 70 + row * (height - 90) // 6
+            x1 = x0 + (width - 300) // 3 - 20
+            y1 = y0 + (height - 90) // 6 - 20
+            fill = tuple(int(v) for v in rng.integers(200, 255, size=3))
+            draw.rectangle([x0, y0, x1, y1], fill=fill, outline=(200, 200, 205))
+            for line in range(4):
+                draw.text(
+                    (x0 + 10, y0 + 10 + line * 14),
+                    f"Card {row}.{col} value {int(rng.integers(0, 10_000))}",
+                    fill=(30, 30, 30),
+                )
+    return img
+
+
+def _alpha_image(width: int, height: int, seed: int) -> Image.Image:
+    """RGBA artwork: shapes with soft alpha edges on a transparent canvas."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    rgb = _photo_array(width, height, seed + 1)
+    alpha = np.zeros((height, width), dtype=np.float32)
+    for _ in range(6):
+        cx, cy = rng.uniform(0.2, 0.8, size=2) * (width, height)
+        radius = rng.uniform(0.1, 0.25) * min(width, height)
+        dist = np.sqrt((xs - cx) ** 2 + (ys - cy) ** 2)
+        alpha = np.maximum(alpha, np.clip((radius - dist) / 8, 0, 1))
+    rgba = np.dstack([rgb, (alpha * 255).astype(np.uint8)])
+    return Image.fromarray(rgba, "RGBA")
+
+
+def _encode(img: Image.Image, fmt: str, **params) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return buf.getvalue()
+
+
+def _make_pdf(pages: int, seed: int) -> bytes:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 72), f"Benchmark document page {i + 1}", fontsize=18)
+        for line in range(20):
+            page.insert_text(
+                (72, 110 + line * 14),
+                "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+                fontsize=10,
+            )
+        photo = Image.fromarray(_photo_array(1200, 800, seed + i), "RGB")
+        page.insert_image(fitz.Rect(72, 420, 540, 732), stream=_encode(photo, "JPEG", quality=95))
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def _run_ffmpeg(args: list[str], suffix: str) -> bytes:
+    out_fd, out_path = tempfile.mkstemp(suffix=suffix)
+    os.close(out_fd)
+    try:
+        subprocess.run(
+            [get_ffmpeg(), "-y", *args, out_path],
+            capture_output=True, timeout=600, check=True,
+        )
+        with open(out_path, "rb") as f:
+            return f.read()
+    finally:
+        if os.path.exists(out_path):
+            os.unlink(out_path)
+
+
+def _make_video(duration: int, size: tuple[int, int]) -> bytes:
+    w, h = size
+    return _run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc2=duration={duration}:size={w}x{h}:rate=30",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "14",
+        "-c:a", "aac", "-b:a", "192k",
+        "-shortest",
+    ], ".mp4")
+
+
+def _make_audio(duration: int) -> bytes:
+    return _run_ffmpeg([
+        "-f", "lavfi", "-i",
+        f"sine=frequency=330:duration={duration},"
+        f"volume=0.5[a];anoisesrc=duration={duration}:amplitude=0.05:seed=7[b];"
+        f"[a][b]amix=inputs=2",
+        "-ac", "2", "-ar", "44100",
+        "-c:a", "pcm_s16le",
+    ], ".wav")
+
+
+def build_corpus(preset: str = "quick", kinds: set[str] | None = None) -> list[dict]:
+    """Generate the benchmark corpus.
+
+    Args:
+        preset: Name of a PRESETS entry.
+        kinds: Optional subset of item kinds to build (e.g. {"photo-jpeg"}).
+
+    Returns:
+        List of dicts with keys: name, kind, mime, category, data, width, height.
+    """
+    cfg = PRESETS[preset]
+    items = []
+
+    def want(kind: str) -> bool:
+        return kinds is None or kind in kinds
+
+    def add(name, kind, mime, category, data, width=0, height=0):
+        items.append({
+            "name": name,
+            "kind": kind,
+            "mime": mime,
+            "category": category,
+            "data": data,
+            "width": width,
+            "height": height,
+        })
+
+    pw, ph = cfg["photo_size"]
+    if want("photo-jpeg") or want("photo-webp"):
+        for seed in (1, 2, 3):
+            photo = Image.fromarray(_photo_array(pw, ph, seed), "RGB")
+            if want("photo-jpeg"):
+                add(f"photo{seed}.jpg", "photo-jpeg", "image/jpeg", "image",
+                    _encode(photo, "JPEG", quality=95), pw, ph)
+            if want("photo-webp"):
+                add(f"photo{seed}.webp", "photo-webp", "image/webp", "image",
+                    _encode(photo, "WEBP", quality=95), pw, ph)
+
+    if want("screenshot-png"):
+        sw, sh = cfg["screenshot_size"]
+        for seed in (1, 2):
+            shot = _screenshot_image(sw, sh, seed)
+            add(f"screenshot{seed}.png", "screenshot-png", "image/png", "image",
+                _encode(shot, "PNG"), sw, sh)
+
+    if want("alpha-png"):
+        aw, ah = cfg["alpha_size"]
+        for seed in (1, 2):
+            art = _alpha_image(aw, ah, seed)
+            add(f"alpha{seed}.png", "alpha-png", "image/png", "image",
+                _encode(art, "PNG"), aw, ah)
+
+    if want("pdf"):
+        add("document.pdf", "pdf", "application/pdf", "pdf",
+            _make_pdf(cfg["pdf_pages"], seed=10))
+
+    if want("video-short"):
+        add("short.mp4", "video-short", "video/mp4", "video",
+            _make_video(cfg["video_short_s"], cfg["video_size"]))
+    if want("video-long"):
+        add("long.mp4", "video-long", "video/mp4", "video",
+            _make_video(cfg["video_long_s"], cfg["video_size"]))
+
+    if want("audio-short"):
+        add("short.wav", "audio-short", "audio/wav", "audio",
+            _make_audio(cfg["audio_short_s"]))
+    if want("audio-long"):
+        add("long.wav", "audio-long", "audio/wav", "audio",
+            _make_audio(cfg["audio_long_s"]))
+
+    return items
@@ -0,0 +1,289 @@
+"""Run the compression benchmark suite and write a JSON report.
+
+Usage:
+    python -m benchmarks.run --preset quick --workers 1,2,4 --output base.json
+
+Each engine (corpus kind) runs in its own fresh process, which builds
+its own corpus, so that its peak RSS is measured in isolation; the
+report gives it both as measured and as growth over the process's
+baseline (imports and corpus), which compares between runs. Throughput is measured separately by
+pushing the whole corpus through a process pool at each worker count.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import KINDS, build_corpus
+
+# Result sizes within this factor of the target count as "on target",
+# matching the tolerance used by squishfile.compressor.engine.
+TOLERANCE = 1.05
+
+
+def _proc_status_mb(field: str) -> float | None:
+    """A memory figure (VmRSS, VmHWM) of /proc/self/status in MB (None
+    if unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> float | None:
+    """Start a new peak RSS measurement; returns the current RSS in MB.
+
+    On Linux the peak (VmHWM) is reset to the current RSS. Elsewhere the
+    peak is read from getrusage, whose high-water mark a spawned process
+    may inherit from its parent, so peaks there are only upper bounds.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return _peak_rss_mb()
+    return _proc_status_mb("VmRSS")
+
+
+def _peak_rss_mb() -> float | None:
+    """Peak resident set size of this process in MB (None if unsupported)."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _warm_up():
+    """Pool initializer: import the engine before any timing starts."""
+    import squishfile.compressor.engine  # noqa: F401
+
+
+def _compress_once(item: dict, target_size: int) -> dict:
+    from squishfile.compressor.engine import compress_file
+
+    start = time.perf_counter()
+    result = compress_file(
+        data=item["data"],
+        mime=item["mime"],
+        category=item["category"],
+        target_size=target_size,
+        width=item["width"],
+        height=item["height"],
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "wall_time_s": elapsed,
+        "result_size": result["size"],
+        "skipped": result["skipped"],
+        "iterations": result.get("iterations", 0),
+        "ssim": result.get("ssim"),
+    }
+
+
+def _bench_kind(preset: str, kind: str, targets: list[float], repeat: int) -> dict:
+    """Benchmark every item of one kind. Runs inside a dedicated process,
+    which builds the kind's corpus itself: items sent from the parent
+    would count towards the peak RSS."""
+    _warm_up()
+    items = build_corpus(preset, {kind})
+    rss_baseline = _reset_peak_rss()
+
+    cases = []
+    for item in items:
+        original_size = len(item["data"])
+        for fraction in targets:
+            target_size = max(1, int(original_size * fraction))
+            runs = [_compress_once(item, target_size) for _ in range(repeat)]
+            last = runs[-1]
+            cases.append({
+                "name": item["name"],
+                "kind": item["kind"],
+                "original_size": original_size,
+                "target_fraction": fraction,
+                "target_size": target_size,
+                "result_size": last["result_size"],
+                "size_error": last["result_size"] / target_size - 1,
+                "within_tolerance": last["result_size"] <= target_size * TOLERANCE,
+                "skipped": last["skipped"],
+                "iterations": last["iterations"],
+                "ssim": last["ssim"],
+                "wall_time_s": statistics.median(r["wall_time_s"] for r in runs),
+            })
+
+    peak = _peak_rss_mb()
+    return {
+        "cases": cases,
+        "rss_baseline_mb": rss_baseline,
+        "peak_rss_mb": peak,
+        # Memory the compressions took, comparable between runs
+        "peak_rss_growth_mb": (
+            peak - rss_baseline if peak is not None and rss_baseline is not None else None
+        ),
+    }
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(kind_result: dict) -> dict:
+    """Aggregate per-case measurements of one engine into summary stats."""
+    cases = kind_result["cases"]
+    times = [c["wall_time_s"] for c in cases]
+    total_in = sum(c["original_size"] for c in cases)
+    scores = [c["ssim"] for c in cases if c.get("ssim") is not None]
+    return {
+        "cases": len(cases),
+        "wall_time_s_total": sum(times),
+        "wall_time_s_mean": statistics.fmean(times),
+        "wall_time_s_p50": _percentile(times, 50),
+        "wall_time_s_p95": _percentile(times, 95),
+        "input_mb_per_s": total_in / (1024 * 1024) / sum(times) if sum(times) else 0.0,
+        "iterations_mean": statistics.fmean(c["iterations"] for c in cases),
+        "mean_abs_size_error": statistics.fmean(abs(c["size_error"]) for c in cases),
+        "within_tolerance_ratio": sum(c["within_tolerance"] for c in cases) / len(cases),
+        "ssim_mean": statistics.fmean(scores) if scores else None,
+        "rss_baseline_mb": kind_result["rss_baseline_mb"],
+        "peak_rss_mb": kind_result["peak_rss_mb"],
+        "peak_rss_growth_mb": kind_result["peak_rss_growth_mb"],
+    }
+
+
+def _compress_job(item: dict, target_size: int) -> int:
+    return _compress_once(item, target_size)["result_size"]
+
+
+def measure_throughput(items: list[dict], fraction: float, workers: int) -> dict:
+    """Compress the whole corpus at one target with a pool of N workers."""
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_warm_up) as pool:
+        # Make sure every worker has started before the clock runs
+        list(pool.map(time.sleep, [0.05] * workers))
+        start = time.perf_counter()
+        futures = [
+            pool.submit(_compress_job, item, max(1, int(len(item["data"]) * fraction)))
+            for item in items
+        ]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "files": len(items),
+        "target_fraction": fraction,
+        "wall_time_s": elapsed,
+        "files_per_sec": len(items) / elapsed if elapsed else 0.0,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def _parse_list(value: str, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="SquishFile compression benchmarks")
+    parser.add_argument("--preset", choices=["quick", "full"], default="quick")
+    parser.add_argument("--kinds", default=",".join(KINDS),
+                        help="Comma-separated corpus kinds to run")
+    parser.add_argument("--targets", default="0.5,0.25",
+                        help="Comma-separated target sizes as fractions of the original")
+    parser.add_argument("--workers", default="1",
+                        help="Comma-separated worker counts for the throughput run")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per case; the median wall time is reported")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    from squishfile import __version__
+
+    kinds = _parse_list(args.kinds, str)
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        parser.error(f"Unknown kinds: {', '.join(sorted(unknown))}")
+    targets = _parse_list(args.targets, float)
+    worker_counts = _parse_list(args.workers, int)
+
+    print(f"Building '{args.preset}' corpus...", file=sys.stderr)
+    items = build_corpus(args.preset, set(kinds))
+
+    ctx = multiprocessing.get_context("spawn")
+    engines = {}
+    cases = []
+    for kind in kinds:
+        kind_items = [i for i in items if i["kind"] == kind]
+        if not kind_items:
+            continue
+        print(f"  {kind}: {len(kind_items)} file(s)", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            kind_result = pool.submit(
+                _bench_kind, args.preset, kind, targets, args.repeat
+            ).result()
+        engines[kind] = summarize(kind_result)
+        cases.extend(kind_result["cases"])
+
+    throughput = []
+    for workers in worker_counts:
+        print(f"  throughput @ {workers} worker(s)", file=sys.stderr)
+        throughput.append(measure_throughput(items, targets[0], workers))
+
+    report = {
+        "meta": {
+            "squishfile_version": __version__,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "preset": args.preset,
+            "targets": targets,
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "engines": engines,
+        "throughput": throughput,
+        "cases": cases,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,84 +1,304 @@
 """
-Generate training data and train quality prediction model.
-Run once: python scripts/train_model.py
-Outputs: squishfile/models/quality_model.pkl
+Train the per-format quality prediction models.
+
+Run: python scripts/train_model.py [--samples 200] [--log training.jsonl]
+Outputs: squishfile/models/quality_model.json
+Requires: pip install squishfile[train]
+
+Training pairs are (content features -> final quality) from real encodes:
+  * synthetic images (photos, UI screenshots, gradients, textures) whose
+    label is the highest quality that still fits the target, found by
+    bisecting actual encodes with the engine's settings;
+  * optionally, pairs recorded from production compressions via the
+    opt-in SQUISHFILE_TRAINING_LOG JSONL file (--log).
+
+One model is trained per output format (jpeg, webp, png_to_jpeg). The
+report includes held-out accuracy and the encode iterations the image
+engine needs when seeded with the model versus the size-ratio heuristic.
+
+The fitted scikit-learn pipelines are exported as plain coefficients
+(standardization, linear and quadratic terms) so the server evaluates
+them with NumPy and never imports scikit-learn.
 """
+import argparse
 import io
+import json
+import os
 import random
+import sys
+
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw
 from sklearn.linear_model import Ridge
-import joblib
-import os
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from squishfile.compressor.features import (  # noqa: E402
+    FEATURE_NAMES, extract_features, feature_vector, size_features,
+)
+from squishfile.compressor.image import compress_image  # noqa: E402
+from squishfile.compressor.predictor import MODEL_KEYS  # noqa: E402
+
+MODEL_PATH = os.path.join(ROOT, "squishfile", "models", "quality_model.json")
 
+SOURCE_MIMES = {"jpeg": "image/jpeg", "webp": "image/webp", "png_to_jpeg": "image/png"}
+
+rng = np.random.default_rng(42)
 random.seed(42)
-np.random.seed(42)
 
 
-def generate_training_data(n_samples=500):
-    X = []
-    y = []
+# --- Synthetic content -----------------------------------------------------
 
-    widths = [640, 800, 1024, 1280, 1920, 2560, 3840]
-    heights = [480, 600, 768, 720, 1080, 1440, 2160]
+def _photo(width, height):
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    xs /= width
+    ys /= height
+    img = np.zeros((height, width, 3), dtype=np.float32)
+    img += rng.uniform(40, 200, size=3)
+    for _ in range(int(rng.integers(4, 16))):
+        cx, cy = rng.uniform(0, 1, size=2)
+        radius = rng.uniform(0.03, 0.3)
+        blob = np.exp(-((xs - cx) ** 2 + (ys - cy) ** 2) / (2 * radius ** 2))
+        img += blob[..., None] * rng.uniform(-90, 90, size=3)
+    img += rng.normal(0, rng.uniform(0, 14), size=img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8), "RGB")
 
-    for i in range(n_samples):
-        width = random.choice(widths)
-        height = random.choice(heights)
-        quality = random.randint(10, 95)
 
-        # Use numpy for fast image generation instead of pixel-by-pixel
-        seed_val = random.randint(0, 1000)
-        rows = np.arange(height).reshape(-1, 1)
-        cols = np.arange(width).reshape(1, -1)
+def _screenshot(width, height):
+    img = Image.new("RGB", (width, height), tuple(int(v) for v in rng.integers(220, 256, 3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(int(rng.integers(5, 40))):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = x0 + int(rng.integers(20, width // 2)), y0 + int(rng.integers(10, height // 3))
+        draw.rectangle([x0, y0, x1, y1], fill=tuple(int(v) for v in rng.integers(0, 256, 3)))
+    for i in range(int(rng.integers(10, 60))):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        draw.text((x, y), f"Label {i} {int(rng.integers(0, 99999))}", fill=(20, 20, 20))
+    return img
 
-        r = ((cols * 7 + rows * 3 + seed_val) % 256).astype(np.uint8)
-        g = ((cols * 3 + rows * 7 + seed_val) % 256).astype(np.uint8)
-        b = ((cols * 5 + rows * 5 + seed_val) % 256).astype(np.uint8)
 
-        img_array = np.stack([r, g, b], axis=-1)
-        img = Image.fromarray(img_array, "RGB")
+def _gradient(width, height):
+    seed_val = int(rng.integers(0, 1000))
+    rows = np.arange(height).reshape(-1, 1)
+    cols = np.arange(width).reshape(1, -1)
+    r = ((cols * 7 + rows * 3 + seed_val) % 256).astype(np.uint8)
+    g = ((cols * 3 + rows * 7 + seed_val) % 256).astype(np.uint8)
+    b = ((cols * 5 + rows * 5 + seed_val) % 256).astype(np.uint8)
+    return Image.fromarray(np.stack([r, g, b], axis=-1), "RGB")
 
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        result_size = buf.tell()
 
-        # Also get original (q=95) size for ratio
-        buf95 = io.BytesIO()
-        img.save(buf95, format="JPEG", quality=95, optimize=True)
-        original_size = buf95.tell()
+def _texture(width, height):
+    small = rng.integers(0, 256, size=(height // 4 + 1, width // 4 + 1, 3), dtype=np.uint8)
+    return Image.fromarray(small, "RGB").resize((width, height), Image.BICUBIC)
 
-        pixel_count = width * height
-        size_ratio = result_size / original_size if original_size > 0 else 1.0
 
-        X.append([
-            original_size,
-            result_size,  # this is the "target"
-            pixel_count,
-            size_ratio,
-        ])
-        y.append(quality)
+GENERATORS = [_photo, _photo, _screenshot, _gradient, _texture]
 
-        if (i + 1) % 100 == 0:
-            print(f"  Generated {i + 1}/{n_samples} samples...")
 
-    return np.array(X), np.array(y)
+def _encode(img, fmt, **params) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return buf.getvalue()
 
 
-def main():
-    print("Generating training data...")
-    X, y = generate_training_data(500)
+def _make_source(model_key):
+    """Random source image encoded the way uploads typically arrive."""
+    width = int(rng.integers(320, 1600))
+    height = int(rng.integers(240, 1200))
+    img = random.choice(GENERATORS)(width, height)
+    if model_key == "jpeg":
+        return _encode(img, "JPEG", quality=int(rng.integers(60, 99)),
+                       subsampling=int(rng.choice([0, 1, 2])))
+    if model_key == "webp":
+        return _encode(img, "WEBP", quality=int(rng.integers(60, 99)))
+    if rng.random() < 0.3:
+        img = img.convert("RGBA")
+        img.putalpha(Image.fromarray(rng.integers(128, 256, (height, width), dtype=np.uint8)))
+    return _encode(img, "PNG")
+
+
+def _search_image(data, model_key):
+    """Decode a source the way the image engine does before its search."""
+    img = Image.open(io.BytesIO(data))
+    if model_key == "png_to_jpeg":
+        if img.mode == "RGBA":
+            bg = Image.new("RGB", img.size, (255, 255, 255))
+            bg.paste(img, mask=img.split()[3])
+            img = bg
+        img = Image.open(io.BytesIO(_encode(img.convert("RGB"), "JPEG", quality=95)))
+    elif model_key == "jpeg" and img.mode == "RGBA":
+        img = img.convert("RGB")
+    img.load()
+    return img
+
+
+def _best_quality(img, fmt, target_size) -> int | None:
+    """Highest quality whose encode fits target_size (exact bisection)."""
+    lo, hi, best = 5, 95, None
+    while lo <= hi:
+        q = (lo + hi) // 2
+        if len(_encode(img, fmt, quality=q, optimize=True)) <= target_size:
+            best, lo = q, q + 1
+        else:
+            hi = q - 1
+    return best
+
+
+def generate_samples(model_key, n_samples):
+    """Synthetic (features, label, source, target) tuples for one model."""
+    fmt = "WEBP" if model_key == "webp" else "JPEG"
+    samples = []
+    while len(samples) < n_samples:
+        data = _make_source(model_key)
+        target = int(len(data) * rng.uniform(0.05, 0.8))
+        img = _search_image(data, model_key)
+        label = _best_quality(img, fmt, target)
+        if label is None:
+            continue  # Needs a resize; not a quality-prediction sample
+        feats = extract_features(data, SOURCE_MIMES[model_key])
+        feats.update(size_features(len(data), target, img.width, img.height))
+        samples.append({"features": feats, "quality": label, "data": data, "target": target})
+        if len(samples) % 50 == 0:
+            print(f"  [{model_key}] generated {len(samples)}/{n_samples} samples...")
+    return samples
+
 
-    print(f"Training on {len(X)} samples...")
-    model = Ridge(alpha=1.0)
+def load_log(path):
+    """Production pairs recorded via SQUISHFILE_TRAINING_LOG."""
+    by_model = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            by_model.setdefault(record["model"], []).append(
+                {"features": record["features"], "quality": record["quality"]}
+            )
+    return by_model
+
+
+# --- Training and evaluation ----------------------------------------------
+
+def train(samples):
+    means = {
+        name: float(np.mean([s["features"][name] for s in samples if name in s["features"]]))
+        for name in FEATURE_NAMES
+        if any(name in s["features"] for s in samples)
+    }
+    X = np.array([feature_vector(s["features"], means) for s in samples])
+    y = np.array([s["quality"] for s in samples])
+    # Quadratic terms capture the curvature of quality vs bits-per-pixel
+    model = make_pipeline(StandardScaler(), PolynomialFeatures(degree=2), Ridge(alpha=10.0))
     model.fit(X, y)
+    return model, means
+
+
+def export_model(model) -> dict:
+    """Flatten a StandardScaler -> PolynomialFeatures(2) -> Ridge pipeline.
+
+    The prediction becomes ``intercept + z @ linear + z @ quadratic @ z``
+    with ``z = (x - mean) / scale``, where `quadratic` is upper-triangular.
+    """
+    scaler, poly, ridge = (step for _, step in model.steps)
+    n = len(scaler.mean_)
+    intercept = float(ridge.intercept_)
+    linear = np.zeros(n)
+    quadratic = np.zeros((n, n))
+    for powers, coef in zip(poly.powers_, ridge.coef_):
+        idx = [i for i, p in enumerate(powers) for _ in range(p)]
+        if not idx:
+            intercept += float(coef)
+        elif len(idx) == 1:
+            linear[idx[0]] += coef
+        else:
+            quadratic[idx[0], idx[1]] += coef
+    return {
+        "mean": scaler.mean_.tolist(),
+        "scale": scaler.scale_.tolist(),
+        "intercept": intercept,
+        "linear": linear.tolist(),
+        "quadratic": quadratic.tolist(),
+    }
+
+
+def _predict(model, means, features):
+    q = float(model.predict(np.array([feature_vector(features, means)]))[0])
+    return max(5, min(95, int(round(q))))
+
+
+def evaluate(model_key, model, means, held_out, replay):
+    """Accuracy vs the size-ratio heuristic, and engine iterations saved."""
+    errors, heuristic_errors = [], []
+    for s in held_out:
+        errors.append(abs(_predict(model, means, s["features"]) - s["quality"]))
+        ratio = s["features"]["size_ratio"]
+        heuristic_errors.append(abs(max(5, min(95, int(ratio * 85))) - s["quality"]))
+
+    report = {
+        "samples": len(held_out),
+        "mae": float(np.mean(errors)) if errors else None,
+        "heuristic_mae": float(np.mean(heuristic_errors)) if heuristic_errors else None,
+    }
+
+    replayable = [s for s in held_out if "data" in s][:replay]
+    if replayable:
+        mime = SOURCE_MIMES[model_key]
+        with_model, with_heuristic = [], []
+        for s in replayable:
+            hint = _predict(model, means, s["features"])
+            with_model.append(compress_image(s["data"], mime, s["target"], quality_hint=hint)["iterations"])
+            with_heuristic.append(compress_image(s["data"], mime, s["target"])["iterations"])
+        report["iterations_model"] = float(np.mean(with_model))
+        report["iterations_heuristic"] = float(np.mean(with_heuristic))
+        report["iterations_saved_pct"] = 100 * (1 - report["iterations_model"] / report["iterations_heuristic"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train SquishFile quality models")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="Synthetic samples per format (0 to use only --log)")
+    parser.add_argument("--log", help="JSONL training log recorded via SQUISHFILE_TRAINING_LOG")
+    parser.add_argument("--replay", type=int, default=40,
+                        help="Held-out samples to re-run through the engine for iteration savings")
+    parser.add_argument("--output", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    logged = load_log(args.log) if args.log else {}
+    models = {}
+
+    for model_key in sorted(set(MODEL_KEYS.values())):
+        print(f"Model '{model_key}':")
+        samples = generate_samples(model_key, args.samples) if args.samples else []
+        samples += logged.get(model_key, [])
+        if len(samples) < 10:
+            print("  not enough samples, skipping")
+            continue
+
+        random.shuffle(samples)
+        split = int(len(samples) * 0.8)
+        model, means = train(samples[:split])
+        report = evaluate(model_key, model, means, samples[split:], args.replay)
 
-    score = model.score(X, y)
-    print(f"R² score: {score:.4f}")
+        # Refit on everything for the shipped model
+        model, means = train(samples)
+        models[model_key] = {
+            **export_model(model),
+            "feature_means": means,
+            "n_samples": len(samples),
+            "report": report,
+        }
+        print("  " + json.dumps(report))
 
-    os.makedirs("squishfile/models", exist_ok=True)
-    joblib.dump(model, "squishfile/models/quality_model.pkl")
-    print("Model saved to squishfile/models/quality_model.pkl")
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"version": 3, "feature_names": FEATURE_NAMES, "models": models}, f, indent=1)
+        f.write("\n")
+    print(f"Model saved to {args.output}")
 
 
 if __name__ == "__main__":
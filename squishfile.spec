@@ -18,15 +18,33 @@ a = Analysis(
         'squishfile.main',
         'squishfile.cli',
         'squishfile.detector',
+        'squishfile.config',
+        'squishfile.metrics',
+        'squishfile.workers',
+        'squishfile.store',
+        'squishfile.jobs',
+        'squishfile.cancel',
+        'squishfile.governor',
+        'squishfile.scheduler',
+        'squishfile.uploads',
+        'squishfile.precompute',
         'squishfile.routes.upload',
         'squishfile.routes.compress',
         'squishfile.compressor.engine',
+        'squishfile.compressor.registry',
         'squishfile.compressor.image',
         'squishfile.compressor.pdf',
         'squishfile.compressor.video',
         'squishfile.compressor.audio',
         'squishfile.compressor.ffmpeg_utils',
         'squishfile.compressor.predictor',
+        'squishfile.compressor.features',
+        'squishfile.compressor.gif',
+        'squishfile.compressor.quality',
+        'squishfile.compressor.curves',
+        'squishfile.compressor.passlogs',
+        'squishfile.compressor.svg',
+        'squishfile.compressor.metadata',
         'uvicorn.logging',
         'uvicorn.loops',
         'uvicorn.loops.auto',
@@ -37,9 +55,6 @@ a = Analysis(
         'uvicorn.protocols.websockets.auto',
         'uvicorn.lifespan',
         'uvicorn.lifespan.on',
-        'sklearn',
-        'sklearn.tree',
-        'sklearn.ensemble',
         'PIL',
         'fitz',
         'magic',
@@ -47,7 +62,9 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # The quality model ships as plain JSON coefficients; keep the
+    # training-only stack out of the bundle.
+    excludes=['sklearn', 'scipy', 'joblib'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
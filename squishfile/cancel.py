@@ -0,0 +1,66 @@
+"""Cooperative cancellation of compression jobs.
+
+A job is cancelled by creating a flag file named after it, which works
+the same whether the job runs on this server's threadpool, in a worker
+process, or in another server process sharing SQUISHFILE_STORE_DIR. The
+thread running a job makes it current with `current_job`; engines call
+`check` between encode iterations, and FFmpeg commands run through
+`ffmpeg_utils.run_ffmpeg`, which polls it and kills FFmpeg's process
+group once the job is cancelled.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from squishfile.config import TEMP_PREFIX, env_str
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that has been cancelled."""
+
+
+_local = threading.local()
+
+
+def _flag_path(job_id: str) -> str:
+    root = env_str("SQUISHFILE_STORE_DIR")
+    directory = os.path.join(root, "cancel") if root else tempfile.gettempdir()
+    return os.path.join(directory, f"{TEMP_PREFIX}cancel-{job_id}")
+
+
+def cancel_job(job_id: str) -> None:
+    """Ask the job `job_id` to stop at its next check."""
+    path = _flag_path(job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a"):
+        pass
+
+
+def clear(job_id: str) -> None:
+    try:
+        os.unlink(_flag_path(job_id))
+    except FileNotFoundError:
+        pass
+
+
+def is_cancelled(job_id: str) -> bool:
+    return os.path.exists(_flag_path(job_id))
+
+
+@contextmanager
+def current_job(job_id: str | None):
+    """Make `job_id` the job that `check` looks at in this thread."""
+    previous = getattr(_local, "job_id", None)
+    _local.job_id = job_id
+    try:
+        yield
+    finally:
+        _local.job_id = previous
+
+
+def check() -> None:
+    """Raise JobCancelled if this thread's current job has been cancelled."""
+    job_id = getattr(_local, "job_id", None)
+    if job_id is not None and is_cancelled(job_id):
+        raise JobCancelled(job_id)
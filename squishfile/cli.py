@@ -1,3 +1,4 @@
+import multiprocessing
 import socket
 import webbrowser
 import uvicorn
@@ -20,4 +21,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Needed for SQUISHFILE_WORKERS process pools in the frozen EXE
+    multiprocessing.freeze_support()
     main()
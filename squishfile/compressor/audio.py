@@ -3,7 +3,10 @@ import os
 import subprocess
 import tempfile
 
-from squishfile.compressor.ffmpeg_utils import get_ffmpeg, probe_media
+from squishfile.compressor import registry
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg, probe_media, run_ffmpeg
+from squishfile.config import TEMP_PREFIX
+from squishfile.metrics import span
 
 
 def compress_audio(data: bytes, mime: str, target_size: int) -> dict:
@@ -33,13 +36,11 @@ def compress_audio(data: bytes, mime: str, target_size: int) -> dict:
         return {"data": data, "size": original_size, "skipped": True,
                 "message": "Could not determine audio duration"}
 
-    # Calculate target bitrate in kbps
-    target_bitrate_kbps = int((target_size * 8) / duration / 1000)
-    target_bitrate_kbps = max(32, min(320, target_bitrate_kbps))
+    target_bitrate_kbps = _bitrate_kbps(duration, target_size)
 
     # Write input to temp file, encode to output temp file
-    in_fd, in_path = tempfile.mkstemp(suffix=_ext_for_mime(mime))
-    out_fd, out_path = tempfile.mkstemp(suffix=".mp3")
+    in_fd, in_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=registry.extension_for(mime))
+    out_fd, out_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp3")
     try:
         os.write(in_fd, data)
         os.close(in_fd)
@@ -52,9 +53,8 @@ def compress_audio(data: bytes, mime: str, target_size: int) -> dict:
             out_path,
         ]
 
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=120,
-        )
+        with span("audio.encode"):
+            result = run_ffmpeg(cmd, timeout=120)
 
         if result.returncode != 0:
             return {"data": data, "size": original_size, "skipped": True,
@@ -69,6 +69,7 @@ def compress_audio(data: bytes, mime: str, target_size: int) -> dict:
             "skipped": False,
             "output_mime": "audio/mpeg",
             "output_ext": ".mp3",
+            "iterations": 1,
         }
     except subprocess.TimeoutExpired:
         return {"data": data, "size": original_size, "skipped": True,
@@ -79,10 +80,78 @@ def compress_audio(data: bytes, mime: str, target_size: int) -> dict:
                 os.unlink(p)
 
 
-def _ext_for_mime(mime: str) -> str:
-    """Return file extension for a given audio MIME type."""
-    return {
-        "audio/mpeg": ".mp3",
-        "audio/wav": ".wav",
-        "audio/x-wav": ".wav",
-    }.get(mime, ".bin")
+def _bitrate_kbps(duration: float, target_size: int) -> int:
+    """MP3 bitrate filling target_size bytes over duration seconds."""
+    target_bitrate_kbps = int((target_size * 8) / duration / 1000)
+    return max(32, min(320, target_bitrate_kbps))
+
+
+def compress_audio_ladder(data: bytes, mime: str, target_sizes: list[int]) -> list[dict]:
+    """Compress audio data to several target sizes with one FFmpeg
+    process, which decodes the source once for all of its outputs.
+
+    Returns:
+        One result dict per target, in the order of target_sizes.
+    """
+    original_size = len(data)
+    results = [{"data": data, "size": original_size, "skipped": True}
+               for _ in target_sizes]
+    pending = [i for i, target in enumerate(target_sizes) if original_size > target]
+    if not pending:
+        return results
+
+    info = probe_media(data)
+    duration = float(info["format"].get("duration", 0)) if info else 0
+    if duration <= 0:
+        message = "Could not probe audio file" if info is None else "Could not determine audio duration"
+        for i in pending:
+            results[i]["message"] = message
+        return results
+
+    in_fd, in_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=registry.extension_for(mime))
+    out_paths = {}
+    try:
+        os.write(in_fd, data)
+        os.close(in_fd)
+
+        cmd = [get_ffmpeg(), "-y", "-i", in_path]
+        outputs = []
+        for i in pending:
+            out_fd, out_paths[i] = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp3")
+            os.close(out_fd)
+            cmd += [
+                "-map", "0:a:0",
+                "-c:a", "libmp3lame",
+                "-b:a", f"{_bitrate_kbps(duration, target_sizes[i])}k",
+                out_paths[i],
+            ]
+            outputs.append(len(cmd) - 1)
+
+        with span("audio.encode"):
+            result = run_ffmpeg(cmd, timeout=120 * len(pending), outputs=outputs)
+
+        if result.returncode != 0:
+            for i in pending:
+                results[i]["message"] = "FFmpeg encoding failed"
+            return results
+
+        for i in pending:
+            with open(out_paths[i], "rb") as f:
+                compressed = f.read()
+            results[i] = {
+                "data": compressed,
+                "size": len(compressed),
+                "skipped": False,
+                "output_mime": "audio/mpeg",
+                "output_ext": ".mp3",
+                "iterations": 1,
+            }
+        return results
+    except subprocess.TimeoutExpired:
+        for i in pending:
+            results[i]["message"] = "Audio compression timed out"
+        return results
+    finally:
+        for p in (in_path, *out_paths.values()):
+            if os.path.exists(p):
+                os.unlink(p)
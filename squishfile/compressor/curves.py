@@ -0,0 +1,165 @@
+"""Coarse quality -> size curves, computed ahead of compression.
+
+A curve is a few (quality, size, ssim) points: for JPEG/WebP images,
+full-size encodes at CURVE_QUALITIES with their SSIM against the
+source; for videos, sizes at CURVE_CRFS extrapolated from a sample
+encode of a few short clips (ssim is None). Curves are plain dicts and
+lists, stored with the upload's entry.
+
+Given a target, `start_quality` interpolates the quality the image
+search should start from, which usually lands within the size
+tolerance on the first encode, and `estimate` predicts the size and
+SSIM of the result before anything is compressed.
+"""
+import math
+import os
+import subprocess
+import tempfile
+
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg, run_ffmpeg
+from squishfile.config import TEMP_PREFIX
+from squishfile.metrics import span
+
+# Qualities encoded for an image's curve
+CURVE_QUALITIES = (10, 25, 40, 55, 70, 85, 95)
+
+# Videos: clips of SAMPLE_CLIP_SECONDS at up to SAMPLE_CLIPS evenly spaced
+# positions are encoded at SAMPLE_CRF with SAMPLE_PRESET
+SAMPLE_CLIPS = 3
+SAMPLE_CLIP_SECONDS = 2
+SAMPLE_CRF = 23
+SAMPLE_PRESET = "veryfast"
+# CRF values reported in a video's curve; x264's bitrate roughly halves
+# with every CRF_HALVING steps up
+CURVE_CRFS = (18, 23, 28, 33, 38)
+CRF_HALVING = 6
+
+
+def image_curve(data: bytes, mime: str) -> dict | None:
+    """Curve of a JPEG or WebP image in its own format (None for others)."""
+    from squishfile.compressor.image import (
+        QUALITY_FORMATS, _Encoder, _encoded_ssim, _open_image,
+    )
+    from squishfile.compressor.quality import luma
+
+    if mime not in QUALITY_FORMATS:
+        return None
+    fmt = "JPEG" if mime == "image/jpeg" else "WEBP"
+    img = _open_image(data)
+    if img.mode == "RGBA" and fmt == "JPEG":
+        img = img.convert("RGB")
+
+    with span("curve", category="image"):
+        encoder = _Encoder(img, fmt)
+        reference = luma(img)
+        points = []
+        for quality in CURVE_QUALITIES:
+            encoded = encoder.final(quality)
+            points.append([quality, encoded.tell(), round(_encoded_ssim(reference, encoded), 4)])
+    return {"kind": "quality", "points": points}
+
+
+def video_curve(path: str, duration: float) -> dict | None:
+    """Curve of the video at `path`, from a sample encode (None on failure)."""
+    if duration <= 0:
+        return None
+    starts, clip_seconds = sample_clips(duration)
+    clips = len(starts)
+
+    sampled = 0
+    out_fd, out_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp4")
+    os.close(out_fd)
+    try:
+        with span("curve", category="video"):
+            for start in starts:
+                result = run_ffmpeg(
+                    [get_ffmpeg(), "-y", "-ss", f"{start:.2f}", "-t", str(clip_seconds),
+                     "-i", path, "-an", "-c:v", "libx264", "-preset", SAMPLE_PRESET,
+                     "-crf", str(SAMPLE_CRF), out_path],
+                    timeout=120,
+                )
+                if result.returncode != 0:
+                    return None
+                sampled += os.path.getsize(out_path)
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    finally:
+        os.unlink(out_path)
+
+    # Bytes per second at SAMPLE_CRF, scaled to the whole video
+    size = sampled / (clips * clip_seconds) * duration
+    points = [[crf, round(size * 2 ** ((SAMPLE_CRF - crf) / CRF_HALVING)), None]
+              for crf in CURVE_CRFS]
+    return {"kind": "crf", "points": points}
+
+
+def sample_clips(duration: float) -> tuple[list[float], float]:
+    """Start times and length of the clips sampled from a video."""
+    clips = min(SAMPLE_CLIPS, max(1, int(duration // SAMPLE_CLIP_SECONDS)))
+    clip_seconds = min(SAMPLE_CLIP_SECONDS, duration)
+    # Clip starts spread over the video, away from its very end
+    starts = [(duration - clip_seconds) * (i + 0.5) / clips for i in range(clips)]
+    return starts, clip_seconds
+
+
+def start_quality(curve: dict, target_size: int | None,
+                  target_ssim: float | None = None) -> int | None:
+    """Image quality whose encode should be close to the target (None
+    if the target is outside the sampled range, where the search needs
+    lower qualities or a resize)."""
+    if curve.get("kind") != "quality":
+        return None
+    points = curve["points"]
+    if target_ssim is not None:
+        x, value = 2, target_ssim
+    elif target_size:
+        x, value = 1, target_size
+    else:
+        return None
+    if not min(p[x] for p in points) <= value <= max(p[x] for p in points):
+        return None
+    return round(_interpolate(points, x, 0, value, log=x == 1))
+
+
+def estimate(curve: dict, target_size: int | None = None,
+             target_ssim: float | None = None) -> dict:
+    """Predicted quality (or CRF), size and SSIM of compressing to a target.
+
+    An image search cannot grow past its best quality, so larger size
+    targets are reported at that size; videos are encoded at the bitrate
+    that reaches the target, so their size is the target.
+    """
+    points = curve["points"]
+    if target_ssim is not None:
+        if curve["kind"] != "quality":
+            return {}
+        quality = _interpolate(points, 2, 0, target_ssim)
+        size = _interpolate(points, 0, 1, quality, log_y=True)
+        return {"quality": round(quality), "size": round(size), "ssim": target_ssim}
+    if not target_size:
+        return {}
+
+    quality = _interpolate(points, 1, 0, target_size, log=True)
+    if curve["kind"] != "quality":
+        return {"quality": round(quality), "size": target_size}
+    size = _interpolate(points, 0, 1, quality, log_y=True)
+    return {"quality": round(quality), "size": round(min(target_size, size)),
+            "ssim": round(_interpolate(points, 0, 2, quality), 4)}
+
+
+def _interpolate(points: list, x: int, y: int, value: float,
+                 log: bool = False, log_y: bool = False) -> float:
+    """Piecewise-linear y at `value` of x (clamped to the sampled range),
+    optionally on a log scale for x or y."""
+    pairs = sorted((p[x], p[y]) for p in points)
+    fx = math.log if log else float
+    fy, inv = (math.log, math.exp) if log_y else (float, float)
+    if value <= pairs[0][0]:
+        return pairs[0][1]
+    for (x0, y0), (x1, y1) in zip(pairs, pairs[1:]):
+        if value <= x1:
+            if x1 == x0:
+                return y1
+            t = (fx(value) - fx(x0)) / (fx(x1) - fx(x0))
+            return inv(fy(y0) + t * (fy(y1) - fy(y0)))
+    return pairs[-1][1]
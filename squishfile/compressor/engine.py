@@ -1,63 +1,413 @@
 # squishfile/compressor/engine.py
-from squishfile.compressor.image import compress_image
-from squishfile.compressor.pdf import compress_pdf
-from squishfile.compressor.video import compress_video
-from squishfile.compressor.audio import compress_audio
-from squishfile.compressor.predictor import predict_quality
+import importlib
+import logging
+
+from squishfile import cancel
+from squishfile.compressor import registry
+from squishfile.config import env_bool
+from squishfile.metrics import record_compression, span
+
+logger = logging.getLogger(__name__)
+
+# Compress functions by category, imported from the registry's entry
+# points on first use so that starting the server never pays for Pillow,
+# PyMuPDF, NumPy or imageio-ffmpeg.
+_loaded: dict = {}
+_loaded_ladders: dict = {}
+
+# Categories whose metadata the lossless pre-pass strips
+METADATA_CATEGORIES = ("image", "pdf")
+
+# A lossless JPEG re-pack (optimized Huffman tables) is only tried when the
+# target is at least this fraction of the file: it rarely saves more.
+JPEG_REPACK_MIN_RATIO = 0.7
+
+
+def load_engine(category: str):
+    """Import and return the compress function for a category."""
+    spec = registry.get(category)
+    func = _loaded.get(category)
+    if func is None or func[0] is not spec:
+        func = _loaded[category] = (spec, spec.load())
+    return func[1]
+
+
+def load_ladder(category: str):
+    """Import and return the ladder function for a category (None if
+    its engine has none)."""
+    spec = registry.get(category)
+    func = _loaded_ladders.get(category)
+    if func is None or func[0] is not spec:
+        func = _loaded_ladders[category] = (spec, spec.load_ladder())
+    return func[1]
+
+
+def warm_up(categories=None) -> None:
+    """Import the engines for `categories` (default: all) ahead of first use."""
+    engines = registry.engines()
+    for category in categories or list(engines):
+        spec = engines.get(category)
+        if spec is None:
+            continue
+        load_engine(category)
+        for module_name in spec.support:
+            importlib.import_module(module_name)
+    if categories is None or "image" in categories:
+        from squishfile.compressor.predictor import _load_model
+
+        _load_model()
 
 
 def compress_file(
     data: bytes,
     mime: str,
     category: str,
-    target_size: int,
+    target_size: int | None,
     width: int = 0,
     height: int = 0,
+    animation_format: str = "gif",
+    best_format: bool = False,
+    target_ssim: float | None = None,
+    measure_quality: bool | None = None,
+    size_curve: dict | None = None,
 ) -> dict:
+    """Compress `data` to target_size bytes (or to target_ssim for images).
+
+    Images and PDFs first lose their metadata (unless
+    SQUISHFILE_STRIP_METADATA=0); when that, or a lossless re-pack of a
+    baseline JPEG, already meets target_size, nothing is re-encoded.
+    An image's precomputed size_curve (see `curves`) gives the search
+    its starting quality; otherwise the predictor does.
+    Unless disabled (measure_quality=False, or SQUISHFILE_QUALITY_METRICS=0
+    by default), the result also carries the output's ssim and psnr
+    against the original.
+    """
     original_size = len(data)
+    spec = registry.get(category)
 
-    if original_size <= target_size:
+    if spec is None:
         return {
             "data": data,
             "size": original_size,
             "original_size": original_size,
             "skipped": True,
-            "message": "File is already smaller than target!",
+            "message": "Unsupported file type",
         }
 
-    # Get ML-predicted quality for logging/future use
-    if category == "image":
-        predicted_q = predict_quality(
-            file_type=mime,
-            original_size=original_size,
-            target_size=target_size,
-            width=width or 1920,
-            height=height or 1080,
-        )
+    if target_ssim is not None and "ssim" not in spec.targets:
+        return {
+            "data": data,
+            "size": original_size,
+            "original_size": original_size,
+            "skipped": True,
+            "message": f"Quality targets are not supported for {category} files",
+        }
 
-    if category == "image":
-        result = compress_image(data, mime, target_size)
-    elif category == "pdf":
-        result = compress_pdf(data, target_size)
-    elif category == "video":
-        result = compress_video(data, mime, target_size)
-    elif category == "audio":
-        result = compress_audio(data, mime, target_size)
-    else:
+    if target_ssim is None and original_size <= target_size:
         return {
             "data": data,
             "size": original_size,
             "original_size": original_size,
             "skipped": True,
-            "message": "Unsupported file type",
+            "message": "File is already smaller than target!",
+        }
+
+    # Lossless pre-pass: often the metadata alone is over the target
+    data, (result,) = _lossless_prepass(
+        data, mime, category, [target_size if target_ssim is None else None]
+    )
+
+    # Starting quality for the image search: read off the precomputed
+    # curve (which is for the source's own codec), or ML-predicted
+    predicted_q = None
+    features = {}
+    if result is None and category == "image":
+        if size_curve is not None and not best_format:
+            from squishfile.compressor.curves import start_quality
+
+            predicted_q = start_quality(size_curve, target_size, target_ssim)
+        if predicted_q is None and target_ssim is None:
+            predicted_q, features = _predict_start_quality(
+                data, mime, target_size, width, height
+            )
+
+    if result is None:
+        cancel.check()
+        options = {
+            "quality_hint": predicted_q,
+            "animation_format": animation_format,
+            "best_format": best_format,
+            "target_ssim": target_ssim,
+        }
+        options = {key: value for key, value in options.items() if key in spec.options}
+        args = (data, mime, target_size) if spec.takes_mime else (data, target_size)
+        with span("compress", category=category):
+            result = load_engine(category)(*args, **options)
+
+    # The predictor's models are per codec, so only log same-codec searches
+    if features and result.get("quality") is not None and not best_format:
+        from squishfile.compressor.predictor import log_training_sample
+
+        log_training_sample(
+            mime,
+            features,
+            quality=result["quality"],
+            iterations=result["iterations"],
+            predicted=predicted_q,
+        )
+
+    return _finish(result, data, mime, category, original_size, target_size,
+                   target_ssim, measure_quality)
+
+
+def compress_ladder(
+    data: bytes,
+    mime: str,
+    category: str,
+    target_sizes: list[int],
+    width: int = 0,
+    height: int = 0,
+    animation_format: str = "gif",
+    best_format: bool = False,
+    measure_quality: bool | None = None,
+    size_curve: dict | None = None,
+) -> list[dict]:
+    """Compress `data` to each of target_sizes, like compress_file per
+    target but decoding the source once.
+
+    The lossless pre-pass (see `compress_file`) runs once for all
+    targets; the targets it does not meet go to the
+    engine's ladder function (see `registry.EngineSpec`), or to its
+    compress function one target at a time if it has none.
+
+    Returns:
+        One result dict per target, in the order of target_sizes.
+    """
+    original_size = len(data)
+    spec = registry.get(category)
+    if spec is None:
+        return [{"data": data, "size": original_size, "original_size": original_size,
+                 "skipped": True, "message": "Unsupported file type"}
+                for _ in target_sizes]
+
+    results: list[dict | None] = [None] * len(target_sizes)
+    for i, target_size in enumerate(target_sizes):
+        if original_size <= target_size:
+            results[i] = {"data": data, "size": original_size, "original_size": original_size,
+                          "skipped": True, "message": "File is already smaller than target!"}
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    data, prepassed = _lossless_prepass(data, mime, category, [target_sizes[i] for i in pending])
+    encode = []
+    for i, result in zip(pending, prepassed):
+        if result is not None:
+            results[i] = result
+        else:
+            encode.append(i)
+
+    if encode:
+        cancel.check()
+        targets = [target_sizes[i] for i in encode]
+        options = {
+            "animation_format": animation_format,
+            "best_format": best_format,
         }
+        options = {key: value for key, value in options.items() if key in spec.options}
+        if category == "image":
+            options["quality_hints"] = _ladder_hints(
+                data, mime, targets, width, height, best_format, size_curve
+            )
+        ladder = load_ladder(category)
+        with span("compress", category=category):
+            if ladder is not None:
+                args = (data, mime, targets) if spec.takes_mime else (data, targets)
+                outputs = ladder(*args, **options)
+            else:
+                compress = load_engine(category)
+                options.pop("quality_hints", None)
+                outputs = []
+                for target_size in targets:
+                    cancel.check()
+                    args = (data, mime, target_size) if spec.takes_mime else (data, target_size)
+                    outputs.append(compress(*args, **options))
+        for i, result in zip(encode, outputs):
+            results[i] = result
+
+    for i in pending:
+        results[i] = _finish(results[i], data, mime, category, original_size,
+                             target_sizes[i], None, measure_quality)
+    return results
+
+
+def _finish(
+    result: dict,
+    data: bytes,
+    mime: str,
+    category: str,
+    original_size: int,
+    target_size: int | None,
+    target_ssim: float | None,
+    measure_quality: bool | None,
+) -> dict:
+    """Measure, record and explain an engine's result for one target."""
+    if target_ssim is not None and not result["skipped"] and result["size"] >= len(data):
+        # Nothing smaller reaches the target: keep the original, less its metadata
+        result = {
+            "data": data,
+            "size": len(data),
+            "skipped": len(data) == original_size,
+            "ssim": 1.0,
+            "message": "File is already as small as it can be at this quality",
+        }
+
+    if measure_quality is None:
+        measure_quality = env_bool("SQUISHFILE_QUALITY_METRICS", True)
+    if measure_quality and not result["skipped"]:
+        for key, value in _measure_quality(data, mime, category, result).items():
+            # Keep the score an SSIM-targeted search already measured
+            result.setdefault(key, value)
 
     result["original_size"] = original_size
+    record_compression(category, original_size, result)
 
-    if result["size"] > target_size * 1.05 and not result["skipped"]:
+    if target_ssim is not None:
+        if not result["skipped"] and result.get("ssim", 1.0) < target_ssim:
+            result["message"] = (
+                f"Best we could do: SSIM {result['ssim']:.3f} "
+                f"(target was {target_ssim:.3f})"
+            )
+    elif result["size"] > target_size * 1.05 and not result["skipped"]:
         result["message"] = (
             f"Best we could do: {result['size'] // 1024}KB "
             f"(target was {target_size // 1024}KB)"
         )
 
     return result
+
+
+def _ladder_hints(
+    data: bytes,
+    mime: str,
+    targets: list[int],
+    width: int,
+    height: int,
+    best_format: bool,
+    size_curve: dict | None,
+) -> list[int | None]:
+    """Starting qualities of an image ladder's searches: off the curve
+    where it covers a target, and predicted for the largest target
+    otherwise (the image ladder starts each smaller target where the
+    previous one ended)."""
+    hints: list[int | None] = [None] * len(targets)
+    if size_curve is not None and not best_format:
+        from squishfile.compressor.curves import start_quality
+
+        hints = [start_quality(size_curve, target) for target in targets]
+    largest = max(range(len(targets)), key=lambda i: targets[i])
+    if hints[largest] is None:
+        hints[largest], _ = _predict_start_quality(
+            data, mime, targets[largest], width, height
+        )
+    return hints
+
+
+def _lossless_prepass(
+    data: bytes, mime: str, category: str, target_sizes: list[int | None]
+) -> tuple[bytes, list[dict | None]]:
+    """Strip metadata, and re-pack baseline JPEGs for the targets that
+    re-pack reaches.
+
+    Returns the data to compress from and, per target (None: a quality
+    target), the finished result if the pre-pass already meets it.
+    """
+    results = [None] * len(target_sizes)
+    if category not in METADATA_CATEGORIES or not env_bool("SQUISHFILE_STRIP_METADATA", True):
+        return data, results
+
+    from squishfile.compressor.metadata import optimize_jpeg, strip_metadata
+
+    keep_icc = env_bool("SQUISHFILE_KEEP_ICC", False)
+    repacked = None
+    with span("metadata"):
+        try:
+            data = strip_metadata(data, mime, keep_icc) or data
+            for i, target_size in enumerate(target_sizes):
+                if target_size is None:
+                    continue
+                candidate, iterations = data, 1
+                if (
+                    mime == "image/jpeg"
+                    and len(data) > target_size * 1.05
+                    and target_size >= len(data) * JPEG_REPACK_MIN_RATIO
+                ):
+                    if repacked is None:
+                        repacked = optimize_jpeg(data, keep_icc) or data
+                    candidate, iterations = repacked, 2
+                if len(candidate) <= target_size * 1.05:
+                    results[i] = {"data": candidate, "size": len(candidate),
+                                  "skipped": False, "iterations": iterations}
+        except Exception:
+            logger.warning("Could not strip %s metadata", mime, exc_info=True)
+            return data, [None] * len(target_sizes)
+
+    return data, results
+
+
+def _measure_quality(data: bytes, mime: str, category: str, result: dict) -> dict:
+    """SSIM/PSNR of a compressed result against its original ({} if n/a)."""
+    from squishfile.compressor import quality
+
+    output_mime = result.get("output_mime", mime)
+    if mime == "image/svg+xml":
+        return {}
+    if output_mime.startswith("video/") or category == "video":
+        measure = quality.measure_video
+    elif category == "image":
+        measure = quality.measure_image
+    elif category == "pdf":
+        measure = quality.measure_pdf
+    else:
+        return {}
+
+    with span("quality", category=category):
+        try:
+            return measure(data, result["data"])
+        except cancel.JobCancelled:
+            raise
+        except Exception:
+            logger.warning("Could not measure %s output quality", category, exc_info=True)
+            return {}
+
+
+def _predict_start_quality(
+    data: bytes, mime: str, target_size: int, width: int, height: int
+) -> tuple[int | None, dict]:
+    """Predict the image search's starting quality from content features.
+
+    Returns the prediction (None if no model covers the format) and the
+    full feature dict used, for the opt-in training log.
+    """
+    from squishfile.compressor.predictor import MODEL_KEYS, predict_quality
+
+    if mime not in MODEL_KEYS:
+        return None, {}
+
+    from squishfile.compressor.features import extract_features, size_features
+
+    with span("image.features"):
+        features = extract_features(data, mime)
+    width = width or features.get("width", 1920)
+    height = height or features.get("height", 1080)
+    features.update(size_features(len(data), target_size, width, height))
+
+    predicted_q = predict_quality(
+        file_type=mime,
+        original_size=len(data),
+        target_size=target_size,
+        width=width,
+        height=height,
+        features=features,
+    )
+    return predicted_q, features
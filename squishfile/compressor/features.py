@@ -0,0 +1,122 @@
+"""Cheap image content features for the quality predictor.
+
+Features are computed on a small luma thumbnail (JPEG sources are decoded
+at reduced scale via `Image.draft`), so extraction costs a fraction of a
+single full encode.
+"""
+import io
+import math
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+# Order of the model input vector. Size-derived features are always
+# available; content features may be missing and are then imputed with
+# the training means stored alongside the model.
+FEATURE_NAMES = [
+    "log_original_size",
+    "log_target_size",
+    "size_ratio",
+    "log_pixels",
+    "log_bits_per_pixel",
+    "log_target_bits_per_pixel",
+    "entropy",
+    "edge_density",
+    "source_quality",
+    "subsampling",
+    "has_alpha",
+]
+
+THUMBNAIL_SIZE = (256, 256)
+
+# Gradient magnitude (0-255 scale) above which a thumbnail pixel is an edge
+EDGE_THRESHOLD = 24
+
+# IJG standard luminance quantization table (quality 50), used to
+# estimate the quality setting a JPEG was last saved with.
+_STD_LUMA_TABLE_SUM = sum([
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+])
+
+
+def size_features(original_size: int, target_size: int, width: int, height: int) -> dict:
+    """Features derived from sizes and dimensions alone."""
+    pixels = max(1, width * height)
+    return {
+        "log_original_size": math.log(max(1, original_size)),
+        "log_target_size": math.log(max(1, target_size)),
+        "size_ratio": target_size / original_size if original_size > 0 else 1.0,
+        "log_pixels": math.log(pixels),
+        "log_bits_per_pixel": math.log(max(1, original_size) * 8 / pixels),
+        "log_target_bits_per_pixel": math.log(max(1, target_size) * 8 / pixels),
+    }
+
+
+def estimate_jpeg_quality(quantization: dict) -> float | None:
+    """Estimate the IJG quality setting from a JPEG's luma quantization table."""
+    table = quantization.get(0) if quantization else None
+    if not table:
+        return None
+    scale = sum(table) * 100 / _STD_LUMA_TABLE_SUM
+    if scale <= 100:
+        quality = (200 - scale) / 2
+    else:
+        quality = 5000 / scale
+    return max(1.0, min(100.0, quality))
+
+
+def luma_features(luma: np.ndarray) -> dict:
+    """Entropy and edge density of a 2-D uint8 luma array."""
+    hist = np.bincount(luma.ravel(), minlength=256).astype(np.float64)
+    p = hist[hist > 0] / luma.size
+    entropy = float(-(p * np.log2(p)).sum())
+
+    plane = luma.astype(np.int16)
+    gx = np.abs(np.diff(plane, axis=1))[:-1, :]
+    gy = np.abs(np.diff(plane, axis=0))[:, :-1]
+    if gx.size:
+        edge_density = float(((gx + gy) > EDGE_THRESHOLD).mean())
+    else:
+        edge_density = 0.0
+    return {"entropy": entropy, "edge_density": edge_density}
+
+
+def extract_features(data: bytes, mime: str) -> dict:
+    """Extract content features from encoded image bytes.
+
+    Returns:
+        Dict with width, height and the content features in FEATURE_NAMES
+        (entropy, edge_density, source_quality, subsampling, has_alpha).
+        Returns an empty dict if the image cannot be decoded.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        width, height = img.size
+        features = {"width": width, "height": height}
+
+        if isinstance(img, JpegImagePlugin.JpegImageFile):
+            quality = estimate_jpeg_quality(getattr(img, "quantization", None))
+            features["source_quality"] = quality if quality is not None else 0.0
+            features["subsampling"] = float(JpegImagePlugin.get_sampling(img))
+            img.draft("L", THUMBNAIL_SIZE)
+        else:
+            features["source_quality"] = 0.0
+            features["subsampling"] = -1.0
+
+        features["has_alpha"] = 1.0 if "A" in img.getbands() or "transparency" in img.info else 0.0
+
+        thumb = img.convert("L")
+        thumb.thumbnail(THUMBNAIL_SIZE)
+        features.update(luma_features(np.asarray(thumb)))
+        return features
+    except Exception:
+        return {}
+
+
+def feature_vector(features: dict, fill: dict | None = None) -> list[float]:
+    """Build the model input vector, imputing missing features from `fill`."""
+    fill = fill or {}
+    return [float(features.get(name, fill.get(name, 0.0))) for name in FEATURE_NAMES]
@@ -1,14 +1,26 @@
 """FFmpeg utility functions using imageio-ffmpeg bundled binary."""
 import json
 import os
+import signal
 import subprocess
 import tempfile
+import time
 
-import imageio_ffmpeg
+from squishfile import cancel, governor
+from squishfile.config import TEMP_PREFIX
+from squishfile.metrics import span
+
+# How often a running FFmpeg command checks whether its job was cancelled
+CANCEL_POLL_SECONDS = 0.25
+
+# Grace period between asking FFmpeg to stop and killing it
+KILL_GRACE_SECONDS = 2
 
 
 def get_ffmpeg() -> str:
     """Return path to the FFmpeg binary (bundled via imageio-ffmpeg)."""
+    import imageio_ffmpeg
+
     return imageio_ffmpeg.get_ffmpeg_exe()
 
 
@@ -42,13 +54,85 @@ def check_ffmpeg() -> bool:
         return False
 
 
+def run_ffmpeg(cmd: list[str], timeout: float, cwd: str | None = None,
+               outputs: list[int] | None = None) -> subprocess.CompletedProcess:
+    """Like subprocess.run(cmd, capture_output=True, text=True, timeout=...,
+    cwd=...), but cancellable.
+
+    FFmpeg runs with the job's thread budget from the governor, given to
+    every input and every output (the items of `cmd` at the positions
+    `outputs`; by default its last item), in its own process group,
+    which is terminated on timeout (raising subprocess.TimeoutExpired)
+    or once the current job is cancelled (raising cancel.JobCancelled).
+    """
+    cmd = governor.ffmpeg_command(cmd, outputs)
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=cwd,
+        start_new_session=os.name == "posix",
+    )
+    niceness = governor.ffmpeg_niceness()
+    if niceness and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, proc.pid, niceness)
+        except OSError:
+            pass  # Already exited
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=CANCEL_POLL_SECONDS)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                if time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout) from None
+                cancel.check()
+    finally:
+        if proc.poll() is None:
+            _terminate(proc)
+
+
+def _terminate(proc: subprocess.Popen) -> None:
+    """Stop a process started by run_ffmpeg, with any children it spawned."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+        try:
+            proc.communicate(timeout=KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            proc.communicate()
+    except ProcessLookupError:
+        pass
+
+
 def probe_media(data: bytes) -> dict | None:
     """Probe media file bytes. Returns dict with duration, streams info, or None on failure."""
-    tmp_fd, tmp_path = tempfile.mkstemp()
-    try:
-        os.write(tmp_fd, data)
-        os.close(tmp_fd)
+    with span("probe"):
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX)
+        try:
+            os.write(tmp_fd, data)
+            os.close(tmp_fd)
+            return _probe_path(tmp_path)
+        except OSError:
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def probe_media_file(path: str) -> dict | None:
+    """Like probe_media, for a file on disk."""
+    with span("probe"):
+        return _probe_path(path)
 
+
+def _probe_path(path: str) -> dict | None:
+    try:
         ffprobe = get_ffprobe()
         if ffprobe:
             result = subprocess.run(
@@ -56,7 +140,7 @@ def probe_media(data: bytes) -> dict | None:
                     ffprobe, "-v", "quiet",
                     "-print_format", "json",
                     "-show_format", "-show_streams",
-                    tmp_path,
+                    path,
                 ],
                 capture_output=True,
                 text=True,
@@ -65,25 +149,46 @@ def probe_media(data: bytes) -> dict | None:
             if result.returncode == 0:
                 return json.loads(result.stdout)
 
-        # Fallback: parse duration from ffmpeg stderr
+        # Fallback: parse duration and streams from ffmpeg stderr
         ffmpeg = get_ffmpeg()
         result = subprocess.run(
-            [ffmpeg, "-i", tmp_path],
+            [ffmpeg, "-i", path],
             capture_output=True,
             text=True,
             timeout=30,
         )
         # ffmpeg -i exits with error but prints info to stderr
-        import re
-        stderr = result.stderr
-        duration_match = re.search(r"Duration:\s*(\d+):(\d+):(\d+)\.(\d+)", stderr)
-        if duration_match:
-            h, m, s, _ = duration_match.groups()
-            duration = int(h) * 3600 + int(m) * 60 + int(s)
-            return {"format": {"duration": str(duration)}, "streams": []}
-        return None
+        return _parse_ffmpeg_info(result.stderr)
     except (subprocess.TimeoutExpired, json.JSONDecodeError, OSError):
         return None
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+
+
+def _parse_ffmpeg_info(stderr: str) -> dict | None:
+    """The parts of ffprobe's output that `ffmpeg -i` also prints: the
+    duration, and each stream's type (plus frame size, rate and
+    rotation for video)."""
+    import re
+
+    duration_match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not duration_match:
+        return None
+    h, m, s = duration_match.groups()
+    duration = int(h) * 3600 + int(m) * 60 + float(s)
+
+    streams = []
+    for line in stderr.splitlines():
+        stream_match = re.search(r"Stream #\d+:\d+\S*: (Video|Audio): (.*)", line)
+        if stream_match:
+            kind, details = stream_match.groups()
+            stream = {"codec_type": kind.lower()}
+            size_match = re.search(r"\b(\d{2,5})x(\d{2,5})\b", details)
+            if kind == "Video" and size_match:
+                stream["width"], stream["height"] = map(int, size_match.groups())
+            fps_match = re.search(r"([\d.]+) fps", details)
+            if kind == "Video" and fps_match:
+                stream["r_frame_rate"] = fps_match.group(1)
+            streams.append(stream)
+        rotation_match = re.search(r"rotation of (-?[\d.]+) degrees", line)
+        if rotation_match and streams and streams[-1]["codec_type"] == "video":
+            streams[-1]["side_data_list"] = [{"rotation": float(rotation_match.group(1))}]
+    return {"format": {"duration": str(duration)}, "streams": streams}
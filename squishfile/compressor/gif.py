@@ -0,0 +1,348 @@
+"""Animated GIF compression.
+
+Frames are decoded, reduced and written one at a time, so memory use is
+bounded by a few frames no matter how long the animation is. The GIF
+encoder stores only the changed region of each frame (with unchanged
+pixels inside it made transparent), and searches a ladder of palette
+size, scale and frame decimation settings for the best one that fits the
+target. Animations can also be transcoded with FFmpeg to animated WebP
+or to a short MP4, which are usually far smaller than any GIF.
+"""
+import io
+import os
+import tempfile
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence
+
+from squishfile import cancel
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg, run_ffmpeg
+from squishfile.config import TEMP_PREFIX
+from squishfile.metrics import span
+
+ANIMATION_FORMATS = ("gif", "webp", "mp4")
+
+# GIF settings from best to smallest: (colors, scale, keep every Nth frame)
+GIF_LADDER = [
+    (256, 1.0, 1),
+    (128, 1.0, 1),
+    (64, 1.0, 1),
+    (64, 0.85, 1),
+    (64, 0.85, 2),
+    (32, 0.7, 2),
+    (32, 0.5, 2),
+    (32, 0.5, 3),
+    (16, 0.35, 3),
+    (16, 0.25, 4),
+]
+
+# Animated WebP settings from best to smallest: (quality, scale)
+WEBP_LADDER = [
+    (90, 1.0),
+    (75, 1.0),
+    (60, 1.0),
+    (45, 1.0),
+    (30, 1.0),
+    (30, 0.75),
+    (20, 0.75),
+    (20, 0.5),
+    (10, 0.5),
+    (10, 0.35),
+]
+
+# A pixel whose channels all differ from what is already on screen by at
+# most this much is treated as unchanged and left transparent.
+DIFF_TOLERANCE = 6
+
+# Frame delay used when a GIF frame does not specify one (ms)
+DEFAULT_FRAME_DURATION = 100
+
+# MP4 bitrate corrections tried after the first encode
+MP4_MAX_ATTEMPTS = 4
+MIN_MP4_BITRATE_KBPS = 16
+
+
+def compress_animation(data: bytes, target_size: int, animation_format: str = "gif") -> dict:
+    """Compress an animated GIF to target_size, keeping the animation.
+
+    Args:
+        data: Animated GIF bytes.
+        target_size: Target file size in bytes.
+        animation_format: "gif" to stay a GIF, or "webp" / "mp4" to
+            transcode with FFmpeg.
+
+    Returns:
+        Dict with keys: data, size, skipped, iterations, plus output_mime
+        and output_ext when the format changes.
+    """
+    if animation_format == "webp":
+        return _compress_to_webp(data, target_size)
+    if animation_format == "mp4":
+        return _compress_to_mp4(data, target_size)
+
+    with span("gif.encode"):
+        encoded, iterations = _search_ladder(
+            lambda step: _encode_gif(data, *step), GIF_LADDER, target_size
+        )
+    return {"data": encoded, "size": len(encoded), "skipped": False,
+            "iterations": iterations}
+
+
+def _search_ladder(encode, ladder: list, target_size: int) -> tuple[bytes, int]:
+    """Bisect a best-to-smallest settings ladder for the first step that fits.
+
+    Returns the chosen encode (the smallest step's if none fits) and the
+    number of encodes performed.
+    """
+    limit = target_size * 1.05
+    lo, hi = 0, len(ladder) - 1
+    best = smallest = None
+    iterations = 0
+    while lo <= hi:
+        cancel.check()
+        mid = (lo + hi) // 2
+        encoded = encode(ladder[mid])
+        iterations += 1
+        if len(encoded) <= limit:
+            best = encoded
+            hi = mid - 1
+        else:
+            if smallest is None or len(encoded) < len(smallest):
+                smallest = encoded
+            lo = mid + 1
+    # Bisection ends on the last step when nothing fits
+    return (best if best is not None else smallest), iterations
+
+
+# --- GIF -------------------------------------------------------------------
+
+def _source_frames(img: Image.Image, scale: float, frame_step: int):
+    """Yield (RGBA frame, duration in ms), keeping every Nth frame.
+
+    Dropped frames' durations are added to the kept frame before them so
+    the animation's total length does not change.
+    """
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    kept = None
+    duration = 0
+    for index, frame in enumerate(ImageSequence.Iterator(img)):
+        frame_duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+        if index % frame_step == 0:
+            if kept is not None:
+                yield kept, duration
+            kept = frame.convert("RGBA")
+            if kept.size != size:
+                kept = kept.resize(size, Image.LANCZOS)
+            duration = 0
+        duration += frame_duration
+    if kept is not None:
+        yield kept, duration
+
+
+def _quantize(rgb: np.ndarray, colors: int) -> tuple[np.ndarray, np.ndarray]:
+    """Quantize an RGB array to palette indices and an (n, 3) palette."""
+    quantized = Image.fromarray(rgb, "RGB").quantize(
+        colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE
+    )
+    palette = np.frombuffer(bytes(quantized.getpalette()), dtype=np.uint8).reshape(-1, 3)
+    return np.asarray(quantized), palette
+
+
+def _palette_image(indices: np.ndarray, palette: np.ndarray) -> Image.Image:
+    frame = Image.fromarray(indices.astype(np.uint8), "P")
+    frame.putpalette(palette.tobytes())
+    return frame
+
+
+class _GifWriter:
+    """Write GIF frames as they are produced.
+
+    The last frame is held back so that following frames with no visible
+    change can be merged into its duration.
+    """
+
+    def __init__(self, loop: int | None):
+        self.out = io.BytesIO()
+        self.loop = loop
+        self.pending = None
+
+    def add(self, frame: Image.Image, offset: tuple[int, int], params: dict) -> None:
+        self._flush()
+        self.pending = (frame, offset, params)
+
+    def extend(self, duration: int) -> None:
+        self.pending[2]["duration"] += duration
+
+    def close(self) -> bytes:
+        self._flush()
+        self.out.write(b";")
+        return self.out.getvalue()
+
+    def _flush(self) -> None:
+        if self.pending is None:
+            return
+        frame, offset, params = self.pending
+        self.pending = None
+        if self.out.tell() == 0:
+            # The first frame's palette becomes the global color table
+            info = {"duration": params["duration"]}
+            if self.loop is not None:
+                info["loop"] = self.loop
+            header, _ = GifImagePlugin.getheader(frame, info=info)
+            self.out.write(b"".join(header))
+            chunks = GifImagePlugin.getdata(frame, offset, **params)
+        else:
+            chunks = GifImagePlugin.getdata(frame, offset, include_color_table=True, **params)
+        self.out.write(b"".join(chunks))
+
+
+def _encode_gif(data: bytes, colors: int, scale: float, frame_step: int) -> bytes:
+    """Re-encode an animated GIF frame by frame with the given settings.
+
+    Opaque animations keep every frame on screen (disposal 1) and store
+    only the bounding box of the pixels that visibly changed, with the
+    unchanged pixels inside it transparent. Frames with no visible change
+    are merged into the previous frame's duration. Animations with
+    transparency are written as full frames cleared between each other
+    (disposal 2).
+    """
+    img = Image.open(io.BytesIO(data))
+    transparent = None
+    writer = _GifWriter(img.info.get("loop"))
+    canvas = None  # What a viewer shows after the frames written so far
+
+    for frame, duration in _source_frames(img, scale, frame_step):
+        cancel.check()
+        pixels = np.asarray(frame)
+        rgb, alpha = pixels[..., :3], pixels[..., 3]
+        if transparent is None:
+            # Pillow decodes later frames with alpha only if the first has it
+            transparent = bool(alpha.min() < 128)
+
+        if transparent:
+            indices, palette = _quantize(np.ascontiguousarray(rgb), colors - 1)
+            key = len(palette)
+            indices = np.where(alpha < 128, key, indices)
+            writer.add(_palette_image(indices, _with_key(palette)), (0, 0),
+                       {"duration": duration, "disposal": 2, "transparency": key})
+            continue
+
+        if canvas is None:
+            indices, palette = _quantize(np.ascontiguousarray(rgb), colors)
+            canvas = palette[indices]
+            writer.add(_palette_image(indices, palette), (0, 0),
+                       {"duration": duration, "disposal": 1})
+            continue
+
+        changed = np.abs(rgb.astype(np.int16) - canvas).max(axis=2) > DIFF_TOLERANCE
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not rows.size:
+            writer.extend(duration)
+            continue
+        cols = np.flatnonzero(changed.any(axis=0))
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        left, right = int(cols[0]), int(cols[-1]) + 1
+
+        mask = changed[top:bottom, left:right]
+        indices, palette = _quantize(np.ascontiguousarray(rgb[top:bottom, left:right]), colors - 1)
+        canvas[top:bottom, left:right][mask] = palette[indices][mask]
+        key = len(palette)
+        indices = np.where(mask, indices, key)
+        writer.add(_palette_image(indices, _with_key(palette)), (left, top),
+                   {"duration": duration, "disposal": 1, "transparency": key})
+
+    return writer.close()
+
+
+def _with_key(palette: np.ndarray) -> np.ndarray:
+    """Append the palette entry used as the transparent color."""
+    return np.vstack([palette, np.zeros((1, 3), dtype=np.uint8)])
+
+
+# --- FFmpeg transcodes -----------------------------------------------------
+
+def _run_ffmpeg(data: bytes, out_suffix: str, args: list[str]) -> bytes | None:
+    """Run FFmpeg on a GIF with `args` between input and output."""
+    in_fd, in_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".gif")
+    out_fd, out_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=out_suffix)
+    try:
+        os.write(in_fd, data)
+        os.close(in_fd)
+        os.close(out_fd)
+        result = run_ffmpeg(
+            [get_ffmpeg(), "-y", "-i", in_path, *args, out_path], timeout=300,
+        )
+        if result.returncode != 0:
+            return None
+        with open(out_path, "rb") as f:
+            return f.read()
+    finally:
+        for p in (in_path, out_path):
+            if os.path.exists(p):
+                os.unlink(p)
+
+
+def _closer_fit(candidate: bytes, best: bytes, target_size: int) -> bool:
+    """Prefer the largest encode within tolerance, else the smallest one."""
+    limit = target_size * 1.05
+    if len(candidate) <= limit:
+        return len(best) > limit or len(candidate) > len(best)
+    return len(best) > limit and len(candidate) < len(best)
+
+
+def _compress_to_webp(data: bytes, target_size: int) -> dict:
+    def encode(step):
+        quality, scale = step
+        args = ["-c:v", "libwebp_anim", "-lossless", "0", "-quality", str(quality),
+                "-loop", "0", "-an"]
+        if scale < 1.0:
+            args += ["-vf", f"scale=trunc(iw*{scale}):trunc(ih*{scale})"]
+        return _run_ffmpeg(data, ".webp", args) or b""
+
+    with span("gif.transcode", format="webp"):
+        encoded, iterations = _search_ladder(encode, WEBP_LADDER, target_size)
+    if not encoded:
+        return {"data": data, "size": len(data), "skipped": True,
+                "message": "FFmpeg could not convert the GIF to WebP"}
+    return {"data": encoded, "size": len(encoded), "skipped": False,
+            "iterations": iterations, "output_mime": "image/webp", "output_ext": ".webp"}
+
+
+def _compress_to_mp4(data: bytes, target_size: int) -> dict:
+    duration_ms = sum(
+        frame.info.get("duration") or DEFAULT_FRAME_DURATION
+        for frame in ImageSequence.Iterator(Image.open(io.BytesIO(data)))
+    )
+    # Leave room for the container overhead
+    bitrate_kbps = max(MIN_MP4_BITRATE_KBPS, int(target_size * 8 * 0.95 / duration_ms))
+    best = None
+    iterations = 0
+
+    with span("gif.transcode", format="mp4"):
+        for _ in range(MP4_MAX_ATTEMPTS):
+            encoded = _run_ffmpeg(data, ".mp4", [
+                "-an", "-c:v", "libx264", "-preset", "medium",
+                "-b:v", f"{bitrate_kbps}k",
+                "-maxrate", f"{bitrate_kbps * 3 // 2}k", "-bufsize", f"{bitrate_kbps * 2}k",
+                # H.264 4:2:0 needs even dimensions
+                "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+                "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+            ])
+            iterations += 1
+            if encoded is None:
+                break
+            if best is None or _closer_fit(encoded, best, target_size):
+                best = encoded
+            if abs(len(encoded) - target_size) / target_size <= 0.05:
+                break
+            new_bitrate = max(MIN_MP4_BITRATE_KBPS,
+                              int(bitrate_kbps * target_size * 0.97 / len(encoded)))
+            if new_bitrate == bitrate_kbps:
+                break
+            bitrate_kbps = new_bitrate
+
+    if best is None:
+        return {"data": data, "size": len(data), "skipped": True,
+                "message": "FFmpeg could not convert the GIF to MP4"}
+    return {"data": best, "size": len(best), "skipped": False,
+            "iterations": iterations, "output_mime": "video/mp4", "output_ext": ".mp4"}
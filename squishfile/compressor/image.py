@@ -1,128 +1,885 @@
 import io
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageOps
+from PIL import features as pil_features
+
+from squishfile import cancel, governor
+from squishfile.compressor.metadata import EXIF_ORIENTATION
+from squishfile.compressor.quality import luma, ssim
+from squishfile.config import env_bool
+from squishfile.metrics import span, traced
 
 QUALITY_FORMATS = {"image/jpeg", "image/webp"}
 
+# First step (in quality points) when galloping away from the starting
+# guess; doubles on every probe until the target size is bracketed.
+GALLOP_STEP = 4
+
+# zlib strategies tried for lossless PNG re-encodes:
+# Z_DEFAULT_STRATEGY, Z_FILTERED, Z_RLE
+PNG_ZLIB_STRATEGIES = (0, 1, 3)
+
+# Palette quantization never goes below this many colors; past that
+# point a lossy JPEG/WebP conversion looks better at the same size.
+MIN_PALETTE_COLORS = 32
+
+# Images with at most this many distinct colors (UI, screenshots) are
+# quantized without dithering, which only adds noise to flat areas.
+DITHER_COLOR_THRESHOLD = 4096
+
+# Codecs considered in best-format mode: Pillow format -> (MIME, extension)
+FORMAT_OUTPUTS = {
+    "JPEG": ("image/jpeg", ".jpg"),
+    "WEBP": ("image/webp", ".webp"),
+    "AVIF": ("image/avif", ".avif"),
+}
+
+# Longest side of the thumbnail used for best-format proxy encodes
+PROXY_SIZE = 384
+
+# Reference quality for the proxy encodes when no prediction is available
+DEFAULT_REFERENCE_QUALITY = 75
+
+# Pillow's JPEG subsampling values
+SUBSAMPLING_444, SUBSAMPLING_422, SUBSAMPLING_420 = 0, 1, 2
+
+# Chroma detail is measured on a centered crop of at most this size
+CHROMA_SAMPLE_SIZE = 256
+
+# A 2x2 block whose chroma values span more than CHROMA_EDGE loses
+# visible color detail when subsampled; 4:2:0 is kept while fewer than
+# CHROMA_DETAIL_FRACTION of the blocks do.
+CHROMA_EDGE = 32
+CHROMA_DETAIL_FRACTION = 0.02
+
+# Below this many bits per pixel, chroma resolution costs more luma
+# quality than it is worth, so byte-targeted searches keep 4:2:0.
+CHROMA_MIN_BPP = 1.5
+
+# Progressive JPEG scans are smaller than optimized baseline ones above
+# roughly this many bits per pixel, and larger below it.
+PROGRESSIVE_MIN_BPP = 1.0
+
+# The size saved by Huffman optimization varies with quality, so a probe
+# further than this (in quality points) from the last final encode is
+# calibrated with a new one.
+RECALIBRATE_DISTANCE = 12
+
 
 def compress_image(
     data: bytes,
     mime: str,
-    target_size: int,
+    target_size: int | None,
+    quality_hint: int | None = None,
+    animation_format: str = "gif",
+    best_format: bool = False,
+    target_ssim: float | None = None,
 ) -> dict:
+    """Compress an image to target_size, or to the smallest size at target_ssim.
+
+    Args:
+        data: Image bytes.
+        mime: MIME type of the image.
+        target_size: Target file size in bytes (ignored with target_ssim).
+        quality_hint: Predicted starting quality for the search.
+        animation_format: Output for animated GIFs ("gif", "webp" or "mp4").
+        best_format: Encode lossy output with whichever of JPEG, WebP and
+            AVIF (if Pillow supports it) is smallest at equal quality.
+        target_ssim: If set, return the smallest encode whose SSIM against
+            the source (see `quality.ssim`) is at least this value.
+
+    Returns:
+        Dict with keys: data, size, skipped, plus output_mime and
+        output_ext when the format changes, and ssim in SSIM mode.
+    """
     original_size = len(data)
 
+    if target_ssim is not None:
+        return _compress_to_ssim(data, mime, target_ssim, best_format, quality_hint)
+
     if original_size <= target_size:
         return {"data": data, "size": original_size, "skipped": True}
 
     if mime in QUALITY_FORMATS:
-        return _compress_with_quality(data, mime, target_size)
+        if best_format:
+            return _compress_best_format(_open_image(data), mime, target_size, quality_hint)
+        return _compress_with_quality(data, mime, target_size, quality_hint)
 
     if mime == "image/png":
-        return _compress_png(data, target_size)
+        return _compress_png(data, target_size, quality_hint, best_format)
 
     if mime == "image/gif":
-        return _compress_gif(data, target_size)
+        return _compress_gif(data, target_size, quality_hint, animation_format, best_format)
+
+    if mime == "image/svg+xml":
+        from squishfile.compressor.svg import compress_svg
+
+        return compress_svg(data, target_size)
 
     # Fallback: return original
     return {"data": data, "size": original_size, "skipped": True}
 
 
+def compress_image_ladder(
+    data: bytes,
+    mime: str,
+    target_sizes: list[int],
+    quality_hints: list[int | None] | None = None,
+    animation_format: str = "gif",
+    best_format: bool = False,
+) -> list[dict]:
+    """Compress an image to several target sizes.
+
+    The source is decoded once, and every target is compressed from that
+    same image: a PNG's lossless encodes and palettes are shared by all
+    targets, an SVG is minified and rasterized once, and lossy searches
+    (in best_format mode, with the codec chosen once for all targets)
+    run largest target first, each starting from its quality hint or the
+    quality the previous target ended at. Animated GIFs, whose encoders
+    read the frames anew for every attempt, are compressed target by
+    target.
+
+    Returns:
+        One result dict per target (see `compress_image`), in the order
+        of target_sizes.
+    """
+    original_size = len(data)
+    hints = quality_hints or [None] * len(target_sizes)
+    results = [{"data": data, "size": original_size, "skipped": True}
+               for _ in target_sizes]
+    pending = [i for i, target in enumerate(target_sizes) if original_size > target]
+    if not pending:
+        return results
+    targets = [target_sizes[i] for i in pending]
+
+    if mime == "image/svg+xml":
+        from squishfile.compressor.svg import compress_svg_ladder
+
+        outputs = compress_svg_ladder(data, targets)
+    elif mime == "image/png":
+        outputs = _compress_png_ladder(_open_image(data), targets,
+                                       [hints[i] for i in pending], best_format)
+    elif mime in QUALITY_FORMATS or mime == "image/gif":
+        img = _open_image(data)
+        if getattr(img, "is_animated", False):
+            from squishfile.compressor.gif import compress_animation
+
+            outputs = []
+            for target_size in targets:
+                cancel.check()
+                outputs.append(compress_animation(data, target_size, animation_format))
+        else:
+            outputs = _quality_ladder(img, mime, original_size, targets,
+                                      [hints[i] for i in pending], best_format)
+    else:
+        return results
+
+    for i, result in zip(pending, outputs):
+        results[i] = result
+    return results
+
+
+def _quality_ladder(
+    img: Image.Image,
+    mime: str,
+    original_size: int,
+    target_sizes: list[int],
+    quality_hints: list[int | None],
+    best_format: bool,
+) -> list[dict]:
+    """Quality searches of a decoded JPEG, WebP or still GIF for every
+    target, largest first."""
+    order = sorted(range(len(target_sizes)), key=lambda i: -target_sizes[i])
+    hints = list(quality_hints)
+    output = {}
+    if best_format:
+        img = _normalize_png_mode(img)
+        fmt, start_quality = _choose_format(img, _start_quality(hints[order[0]]))
+        hints = [None] * len(target_sizes)
+    elif mime == "image/gif":
+        # A still GIF is converted to JPEG
+        img = img.convert("RGB")
+        fmt, start_quality = "JPEG", _start_quality(hints[order[0]])
+    else:
+        fmt = "JPEG" if mime == "image/jpeg" else "WEBP"
+        if img.mode == "RGBA" and fmt == "JPEG":
+            img = img.convert("RGB")
+        start_quality = int(target_sizes[order[0]] / original_size * 85)
+    out_mime, out_ext = FORMAT_OUTPUTS[fmt]
+    if out_mime != mime:
+        output = {"output_mime": out_mime, "output_ext": out_ext}
+    img.load()
+
+    results = [None] * len(target_sizes)
+    for i in order:
+        cancel.check()
+        if hints[i] is not None:
+            start_quality = hints[i]
+        results[i] = {**_search_quality(img, fmt, target_sizes[i], start_quality), **output}
+        start_quality = results[i].get("quality") or start_quality
+    return results
+
+
+def _open_image(data: bytes) -> Image.Image:
+    """Open an image for re-encoding: upright (EXIF orientation applied),
+    and with its ICC profile only if SQUISHFILE_KEEP_ICC is set."""
+    img = Image.open(io.BytesIO(data))
+    if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    if not env_bool("SQUISHFILE_KEEP_ICC", False):
+        img.info.pop("icc_profile", None)
+    return img
+
+
 def _compress_with_quality(
-    data: bytes, mime: str, target_size: int
+    data: bytes, mime: str, target_size: int, start_quality: int | None = None
 ) -> dict:
     fmt = "JPEG" if mime == "image/jpeg" else "WEBP"
-    img = Image.open(io.BytesIO(data))
+    img = _open_image(data)
 
     if img.mode == "RGBA" and fmt == "JPEG":
         img = img.convert("RGB")
 
-    # Estimate starting quality from size ratio
-    ratio = target_size / len(data)
-    quality = max(5, min(95, int(ratio * 85)))
+    if start_quality is None:
+        # Estimate starting quality from size ratio
+        ratio = target_size / len(data)
+        start_quality = int(ratio * 85)
+    return _search_quality(img, fmt, target_size, start_quality)
 
-    lo, hi = 5, 95
-    best_data = None
+
+def _start_quality(quality_hint: int | None) -> int:
+    """Search start for a decoded image, whose encoded size at any quality
+    is unknown until the first probe."""
+    return quality_hint if quality_hint is not None else DEFAULT_REFERENCE_QUALITY
+
+
+class _Bracket:
+    """Quality search state: gallop outward from a starting guess until
+    the answer is bracketed, then bisect."""
+
+    def __init__(self, start_quality: int):
+        self.quality = max(5, min(95, start_quality))
+        self.lo, self.hi = 5, 95
+        self.seen_low = self.seen_high = False
+        self.step = GALLOP_STEP
+
+    def update(self, go_up: bool) -> bool:
+        """Record whether the answer is above the current quality and move
+        to the next probe. Returns False once the range is exhausted."""
+        if go_up:
+            self.lo = self.quality + 1
+            self.seen_low = True
+        else:
+            self.hi = self.quality - 1
+            self.seen_high = True
+
+        if self.lo > self.hi:
+            return False
+        if self.seen_low and self.seen_high:
+            self.quality = (self.lo + self.hi) // 2
+        else:
+            step = self.step if self.seen_low else -self.step
+            self.quality = max(self.lo, min(self.hi, self.quality + step))
+            self.step *= 2
+        return True
+
+
+class _Encoder:
+    """Encodes one image at varying quality for the quality searches.
+
+    JPEG probes skip Huffman table optimization, which costs 50-200% more
+    time without changing the decoded pixels. `estimate` scales a probe's
+    size by the ratio of final to probe size at the nearest quality that
+    had a final encode, and only `final` encodes with the full settings:
+    content-chosen chroma subsampling, optimize, and progressive scans
+    at high bit rates.
+    """
+
+    def __init__(self, img: Image.Image, fmt: str, target_size: int | None = None):
+        self.img = img
+        self.fmt = fmt
+        self.target_size = target_size
+        self.probe_params = {}
+        self.final_params = {}
+        self.probes = {}  # quality -> probe size
+        self.finals = {}  # quality -> final size
+        icc = img.info.get("icc_profile")
+        self.icc = {"icc_profile": icc} if icc else {}
+        if fmt == "JPEG":
+            subsampling = SUBSAMPLING_420
+            if target_size is None or self.bits_per_pixel(target_size) >= CHROMA_MIN_BPP:
+                subsampling = _jpeg_subsampling(img)
+            self.probe_params = {"subsampling": subsampling}
+            self.final_params = dict(self.probe_params, optimize=True)
+
+    def bits_per_pixel(self, size: int) -> float:
+        return 8 * size / (self.img.width * self.img.height)
+
+    def encode(self, quality: int, params: dict) -> io.BytesIO:
+        cancel.check()
+        buf = io.BytesIO()
+        try:
+            self.img.save(buf, format=self.fmt, quality=quality, **params, **self.icc,
+                          **_thread_params(self.fmt))
+        except OSError:
+            # Optimized and progressive JPEGs are written from a buffer of
+            # one byte per pixel below q95, which detailed 4:4:4 encodes
+            # outgrow; plain scans are streamed, whatever their size
+            if not {"optimize", "progressive"} & params.keys():
+                raise
+            params = {k: v for k, v in params.items() if k not in ("optimize", "progressive")}
+            buf = io.BytesIO()
+            self.img.save(buf, format=self.fmt, quality=quality, **params, **self.icc,
+                          **_thread_params(self.fmt))
+        return buf
+
+    def probe(self, quality: int) -> io.BytesIO:
+        encoded = self.encode(quality, self.probe_params)
+        self.probes[quality] = encoded.tell()
+        return encoded
+
+    def estimate(self, quality: int) -> tuple[int, io.BytesIO | None]:
+        """Estimated final size at `quality`, plus the final encode when
+        one was made instead (to calibrate, or when probes are finals)."""
+        if not self.final_params:
+            probe = self.probe(quality)
+            return probe.tell(), probe
+        nearest = min(self.finals, key=lambda q: abs(q - quality), default=None)
+        if nearest is None or abs(nearest - quality) > RECALIBRATE_DISTANCE:
+            final = self.final(quality)
+            return final.tell(), final
+        if nearest not in self.probes:
+            self.probe(nearest)
+        ratio = self.finals[nearest] / self.probes[nearest]
+        return round(self.probe(quality).tell() * ratio), None
+
+    def final(self, quality: int) -> io.BytesIO:
+        if not self.final_params:
+            return self.probe(quality)
+        params = self.final_params
+        size = self.target_size or self.probes.get(quality, 0)
+        if self.bits_per_pixel(size) >= PROGRESSIVE_MIN_BPP:
+            params = dict(params, progressive=True)
+        encoded = self.encode(quality, params)
+        self.finals[quality] = encoded.tell()
+        return encoded
+
+
+def _jpeg_subsampling(img: Image.Image) -> int:
+    """Chroma subsampling for a JPEG of `img`, chosen by its color detail.
+
+    Photos lose nothing visible at 4:2:0. Sharp colored edges (UI, colored
+    text, charts) keep 4:2:2 when halving only the horizontal chroma
+    resolution is enough, and 4:4:4 otherwise.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        return SUBSAMPLING_420
+    left = max(0, (img.width - CHROMA_SAMPLE_SIZE) // 2)
+    top = max(0, (img.height - CHROMA_SAMPLE_SIZE) // 2)
+    crop = img.crop((left, top, min(img.width, left + CHROMA_SAMPLE_SIZE),
+                     min(img.height, top + CHROMA_SAMPLE_SIZE)))
+    chroma = np.asarray(crop.convert("RGB").convert("YCbCr"), dtype=np.int16)[..., 1:]
+    tl, tr = chroma[0:-1:2, 0:-1:2], chroma[0:-1:2, 1::2]
+    bl, br = chroma[1::2, 0:-1:2], chroma[1::2, 1::2]
+    if tl.size == 0:
+        return SUBSAMPLING_420
+
+    # Chroma range within each 2x2 block, and within its horizontal pairs
+    loss_422 = np.maximum(np.abs(tl - tr), np.abs(bl - br)).max(axis=-1)
+    loss_420 = (np.maximum(np.maximum(tl, tr), np.maximum(bl, br))
+                - np.minimum(np.minimum(tl, tr), np.minimum(bl, br))).max(axis=-1)
+
+    detail_420 = float((loss_420 > CHROMA_EDGE).mean())
+    if detail_420 < CHROMA_DETAIL_FRACTION:
+        return SUBSAMPLING_420
+    if float((loss_422 > CHROMA_EDGE).mean()) < detail_420 / 2:
+        return SUBSAMPLING_422
+    return SUBSAMPLING_444
+
+
+@traced("image.search")
+def _search_quality(
+    img: Image.Image, fmt: str, target_size: int, start_quality: int
+) -> dict:
+    encoder = _Encoder(img, fmt, target_size)
+    limit = target_size * 1.05
+    bracket = _Bracket(start_quality)
+    best_buf = None  # Only the best candidate's encode is kept
     best_size = float("inf")
+    best_quality = None
+    iterations = 0
 
-    # Binary search for optimal quality (max 10 iterations)
+    # Search for optimal quality (max 10 iterations) on estimated sizes;
+    # an estimate within tolerance is checked with the final encode.
     for _ in range(10):
-        buf = io.BytesIO()
-        img.save(buf, format=fmt, quality=quality, optimize=True)
-        result_size = buf.tell()
+        quality = bracket.quality
+        result_size, encoded = encoder.estimate(quality)
+        iterations += 1
+        if encoded is None and abs(result_size - target_size) / target_size <= 0.05:
+            encoded = encoder.final(quality)
+            result_size = encoded.tell()
 
         if abs(result_size - target_size) / target_size <= 0.05:
-            return {"data": buf.getvalue(), "size": result_size, "skipped": False}
+            return {"data": encoded.getvalue(), "size": result_size, "skipped": False,
+                    "iterations": iterations, "quality": quality}
 
         if result_size <= target_size and (
-            best_data is None or result_size > best_size
+            best_quality is None or result_size > best_size
         ):
-            best_data = buf.getvalue()
+            best_buf = encoded
             best_size = result_size
+            best_quality = quality
 
-        if result_size > target_size:
-            hi = quality - 1
-        else:
-            lo = quality + 1
-
-        if lo > hi:
+        if not bracket.update(go_up=result_size <= target_size):
             break
-        quality = (lo + hi) // 2
 
     # Fallback: reduce resolution if quality alone isn't enough
-    if best_data is None or best_size > target_size * 1.05:
-        return _compress_with_resize(img, fmt, target_size)
+    if best_quality is None:
+        result = _compress_with_resize(img, fmt, target_size)
+        result["iterations"] += iterations
+        return result
+
+    if best_buf is None:
+        best_buf = encoder.final(best_quality)
+    # The estimate was off: step down until the final encode fits
+    while best_buf.tell() > limit and best_quality > 5:
+        best_quality -= 1
+        best_buf = encoder.final(best_quality)
+        iterations += 1
+
+    return {"data": best_buf.getvalue(), "size": best_buf.tell(), "skipped": False,
+            "iterations": iterations, "quality": best_quality}
+
+
+@traced("image.search")
+def _search_ssim(
+    img: Image.Image, fmt: str, target_ssim: float, start_quality: int
+) -> dict:
+    """Find the lowest quality (smallest encode) whose SSIM reaches target_ssim.
+
+    If no quality does, the encode with the highest SSIM is returned.
+    Probes are scored without entropy optimization, which does not change
+    the decoded image; only the chosen quality gets the final encode.
+    """
+    encoder = _Encoder(img, fmt)
+    reference = luma(img)
+    bracket = _Bracket(start_quality)
+    best = fallback = None  # (quality, score)
+    iterations = 0
+
+    for _ in range(10):
+        quality = bracket.quality
+        encoded = encoder.probe(quality)
+        iterations += 1
+        score = _encoded_ssim(reference, encoded)
+
+        passes = score >= target_ssim
+        if passes and (best is None or quality < best[0]):
+            best = (quality, score)
+        elif not passes and (fallback is None or score > fallback[1]):
+            fallback = (quality, score)
+
+        if not bracket.update(go_up=not passes):
+            break
 
-    return {"data": best_data, "size": best_size, "skipped": False}
+    quality, score = best or fallback
+    data = encoder.final(quality).getvalue()
+    return {"data": data, "size": len(data), "skipped": False,
+            "iterations": iterations + 1, "quality": quality, "ssim": score}
 
 
+@traced("image.resize")
 def _compress_with_resize(
     img: Image.Image, fmt: str, target_size: int
 ) -> dict:
     scale = 0.9
+    iterations = 0
     for _ in range(10):
+        cancel.check()
         new_w = max(1, int(img.width * scale))
         new_h = max(1, int(img.height * scale))
         resized = img.resize((new_w, new_h), Image.LANCZOS)
         buf = io.BytesIO()
-        resized.save(buf, format=fmt, quality=60, optimize=True)
+        resized.save(buf, format=fmt, quality=60, optimize=True,
+                     icc_profile=img.info.get("icc_profile"))
+        iterations += 1
         result_size = buf.tell()
 
         if result_size <= target_size * 1.05:
-            return {"data": buf.getvalue(), "size": result_size, "skipped": False}
+            return {"data": buf.getvalue(), "size": result_size, "skipped": False,
+                    "iterations": iterations}
 
         scale *= 0.8
 
     # Return best effort
-    return {"data": buf.getvalue(), "size": buf.tell(), "skipped": False}
+    return {"data": buf.getvalue(), "size": buf.tell(), "skipped": False,
+            "iterations": iterations}
 
 
-def _compress_png(data: bytes, target_size: int) -> dict:
-    img = Image.open(io.BytesIO(data))
-
-    # Try converting to JPEG (lossy) to hit target
-    if img.mode == "RGBA":
-        bg = Image.new("RGB", img.size, (255, 255, 255))
-        bg.paste(img, mask=img.split()[3])
-        img = bg
-    else:
+def _compress_png(
+    data: bytes,
+    target_size: int,
+    quality_hint: int | None = None,
+    best_format: bool = False,
+) -> dict:
+    return _compress_png_ladder(_open_image(data), [target_size], [quality_hint], best_format)[0]
+
+
+def _compress_png_ladder(
+    img: Image.Image,
+    target_sizes: list[int],
+    quality_hints: list[int | None],
+    best_format: bool = False,
+) -> list[dict]:
+    """Compress a PNG to each target with the cheapest step that meets it.
+
+    In order of cost: lossless re-encode (exact palette when the image
+    has at most 256 colors, best zlib strategy), lossy palette
+    quantization with a search over the color count, then conversion to
+    WebP (if the image has transparency) or JPEG. Targets are taken
+    largest first; encodes are shared between them, and each lossy
+    search starts where the previous one ended.
+    """
+    img.load()
+    img = _normalize_png_mode(img)
+    lossless_img = None
+    lossless: list[bytes] = []  # By zlib strategy
+    palettes: dict[int, bytes] = {}  # By color count
+    fmt = start_quality = None
+
+    results = [None] * len(target_sizes)
+    for i in sorted(range(len(target_sizes)), key=lambda i: -target_sizes[i]):
+        target_size = target_sizes[i]
+        limit = target_size * 1.05
+        iterations = 0
+
+        with span("image.png_lossless"):
+            for k, strategy in enumerate(PNG_ZLIB_STRATEGIES):
+                if k == len(lossless):
+                    if lossless_img is None:
+                        lossless_img = _exact_palette(img) or img
+                    lossless.append(_encode_png(lossless_img, strategy))
+                iterations += 1
+                if len(lossless[k]) <= limit:
+                    results[i] = {"data": lossless[k], "size": len(lossless[k]),
+                                  "skipped": False, "iterations": iterations}
+                    break
+        if results[i] is not None:
+            continue
+
+        with span("image.png_palette"):
+            encoded, probes = _search_palette(img, target_size, palettes)
+            iterations += probes
+            if encoded is not None:
+                results[i] = {"data": encoded, "size": len(encoded), "skipped": False,
+                              "iterations": iterations}
+                continue
+
+        # Lossy conversion: keep transparency with WebP, otherwise JPEG
+        cancel.check()
+        if fmt is None:
+            if best_format:
+                reference_quality = quality_hints[i]
+                if reference_quality is None:
+                    reference_quality = DEFAULT_REFERENCE_QUALITY
+                fmt, start_quality = _choose_format(img, reference_quality)
+            else:
+                fmt = "WEBP" if _has_alpha(img) else "JPEG"
+                start_quality = _start_quality(quality_hints[i])
+        elif quality_hints[i] is not None and not best_format:
+            start_quality = quality_hints[i]
+        result = _search_quality(img, fmt, target_size, start_quality)
+        result.update(zip(("output_mime", "output_ext"), FORMAT_OUTPUTS[fmt]))
+        result["iterations"] += iterations
+        start_quality = result.get("quality") or start_quality
+        results[i] = result
+    return results
+
+
+def _normalize_png_mode(img: Image.Image) -> Image.Image:
+    """Convert to RGB/RGBA, dropping an alpha channel that is fully opaque."""
+    if img.mode not in ("RGB", "RGBA"):
+        has_transparency = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if has_transparency else "RGB")
+    if img.mode == "RGBA" and img.getchannel("A").getextrema() == (255, 255):
         img = img.convert("RGB")
+    return img
 
-    return _compress_with_quality(
-        _image_to_bytes(img, "JPEG", 95), "image/jpeg", target_size
-    )
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode == "RGBA"
+
+
+def _encode_png(img: Image.Image, strategy: int = 0) -> bytes:
+    cancel.check()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True, compress_type=strategy)
+    return buf.getvalue()
+
+
+def _exact_palette(img: Image.Image) -> Image.Image | None:
+    """Lossless palette version of an image with at most 256 colors."""
+    if img.getcolors(256) is None:
+        return None
+    arr = np.asarray(img)
+    channels = arr.shape[2]
+    packed = np.zeros(arr.shape[:2], dtype=np.uint32)
+    for c in range(channels):
+        packed |= arr[..., c].astype(np.uint32) << (8 * c)
+    colors, indices = np.unique(packed.ravel(), return_inverse=True)
+
+    pal = Image.fromarray(indices.reshape(arr.shape[:2]).astype(np.uint8), "P")
+    rgb = [(int(v) >> (8 * c)) & 0xFF for v in colors for c in range(3)]
+    pal.putpalette(rgb)
+    if channels == 4:
+        pal.info["transparency"] = bytes((int(v) >> 24) & 0xFF for v in colors)
+    return pal
+
+
+def _quantize(img: Image.Image, colors: int, dither) -> Image.Image:
+    # Median cut gives better palettes but only supports RGB
+    method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+    return img.quantize(colors=colors, method=method, dither=dither)
+
+
+def _search_palette(
+    img: Image.Image, target_size: int, encodes: dict[int, bytes] | None = None
+) -> tuple[bytes | None, int]:
+    """Find the most colors (>= MIN_PALETTE_COLORS) whose PNG meets target.
+
+    `encodes` keeps the PNGs by color count, for searches of the same
+    image at other targets.
+
+    Returns the encoded PNG (None if even the smallest palette is too
+    big) and the number of encodes tried.
+    """
+    limit = target_size * 1.05
+    if encodes is None:
+        encodes = {}
+    dither = None
+
+    def encode(colors: int) -> bytes:
+        nonlocal dither
+        if colors not in encodes:
+            if dither is None:
+                if img.getcolors(DITHER_COLOR_THRESHOLD) is None:
+                    dither = Image.Dither.FLOYDSTEINBERG
+                else:
+                    dither = Image.Dither.NONE
+            encodes[colors] = _encode_png(_quantize(img, colors, dither))
+        return encodes[colors]
+
+    # Try the full palette first (the common case), then the floor
+    encoded = encode(256)
+    if len(encoded) <= limit:
+        return encoded, 1
+    encoded = encode(MIN_PALETTE_COLORS)
+    probes = 2
+    if len(encoded) > limit:
+        return None, probes
+    best = encoded
+
+    lo, hi = MIN_PALETTE_COLORS + 1, 255
+    while lo <= hi and probes < 8:
+        colors = (lo + hi) // 2
+        encoded = encode(colors)
+        probes += 1
+        if len(encoded) <= limit:
+            best = encoded
+            lo = colors + 1
+        else:
+            hi = colors - 1
+    return best, probes
 
 
-def _compress_gif(data: bytes, target_size: int) -> dict:
+def _compress_gif(
+    data: bytes,
+    target_size: int,
+    quality_hint: int | None = None,
+    animation_format: str = "gif",
+    best_format: bool = False,
+) -> dict:
     img = Image.open(io.BytesIO(data))
-    # Convert first frame to JPEG
-    rgb = img.convert("RGB")
-    return _compress_with_quality(
-        _image_to_bytes(rgb, "JPEG", 95), "image/jpeg", target_size
+    if getattr(img, "is_animated", False):
+        from squishfile.compressor.gif import compress_animation
+
+        return compress_animation(data, target_size, animation_format)
+
+    if best_format:
+        return _compress_best_format(img, "image/gif", target_size, quality_hint)
+
+    # A still GIF is converted to JPEG
+    result = _search_quality(
+        img.convert("RGB"), "JPEG", target_size, _start_quality(quality_hint)
     )
+    result.update(output_mime="image/jpeg", output_ext=".jpg")
+    return result
 
 
-def _image_to_bytes(img: Image.Image, fmt: str, quality: int) -> bytes:
+def _compress_to_ssim(
+    data: bytes, mime: str, target_ssim: float, best_format: bool,
+    quality_hint: int | None = None,
+) -> dict:
+    img = _open_image(data)
+    if getattr(img, "is_animated", False):
+        return {"data": data, "size": len(data), "skipped": True,
+                "message": "Quality targets are not supported for animated images"}
+
+    if mime == "image/png":
+        return _compress_png_ssim(img, target_ssim, best_format)
+    if best_format:
+        return _compress_best_format(img, mime, None, target_ssim=target_ssim)
+    if mime in QUALITY_FORMATS:
+        fmt = "JPEG" if mime == "image/jpeg" else "WEBP"
+        if img.mode == "RGBA" and fmt == "JPEG":
+            img = img.convert("RGB")
+        return _search_ssim(img, fmt, target_ssim, _start_quality(quality_hint))
+    if mime == "image/gif":
+        result = _search_ssim(img.convert("RGB"), "JPEG", target_ssim, DEFAULT_REFERENCE_QUALITY)
+        result.update(output_mime="image/jpeg", output_ext=".jpg")
+        return result
+
+    return {"data": data, "size": len(data), "skipped": True}
+
+
+def _compress_png_ssim(img: Image.Image, target_ssim: float, best_format: bool) -> dict:
+    """Smallest of a lossless re-encode, a 256-color palette and a lossy
+    encode that reaches target_ssim."""
+    img.load()
+    img = _normalize_png_mode(img)
+    reference = luma(img)
+
+    lossless = _encode_png(_exact_palette(img) or img)
+    candidates = [{"data": lossless, "size": len(lossless), "skipped": False, "ssim": 1.0}]
+    iterations = 1
+
+    if img.getcolors(256) is None:
+        dither = (Image.Dither.FLOYDSTEINBERG if img.getcolors(DITHER_COLOR_THRESHOLD) is None
+                  else Image.Dither.NONE)
+        palette = _encode_png(_quantize(img, 256, dither))
+        iterations += 1
+        score = _encoded_ssim(reference, palette)
+        if score >= target_ssim:
+            candidates.append({"data": palette, "size": len(palette), "skipped": False,
+                               "ssim": score})
+
+    if best_format:
+        lossy = _compress_best_format(img, "image/png", None, target_ssim=target_ssim)
+    elif _has_alpha(img):
+        lossy = _search_ssim(img, "WEBP", target_ssim, DEFAULT_REFERENCE_QUALITY)
+        lossy.update(output_mime="image/webp", output_ext=".webp")
+    else:
+        lossy = _search_ssim(img, "JPEG", target_ssim, DEFAULT_REFERENCE_QUALITY)
+        lossy.update(output_mime="image/jpeg", output_ext=".jpg")
+    iterations += lossy.pop("iterations")
+    if lossy["ssim"] >= target_ssim:
+        candidates.append(lossy)
+
+    result = min(candidates, key=lambda c: c["size"])
+    result["iterations"] = iterations
+    return result
+
+
+def _compress_best_format(
+    img: Image.Image,
+    source_mime: str,
+    target_size: int | None,
+    quality_hint: int | None = None,
+    target_ssim: float | None = None,
+) -> dict:
+    """Run the quality search with the codec that is smallest at equal quality."""
+    img = _normalize_png_mode(img)
+    reference_quality = quality_hint if quality_hint is not None else DEFAULT_REFERENCE_QUALITY
+    fmt, start_quality = _choose_format(img, reference_quality, target_ssim)
+
+    if target_ssim is not None:
+        result = _search_ssim(img, fmt, target_ssim, start_quality)
+    else:
+        result = _search_quality(img, fmt, target_size, start_quality)
+    mime, ext = FORMAT_OUTPUTS[fmt]
+    if mime != source_mime:
+        result.update(output_mime=mime, output_ext=ext)
+    return result
+
+
+def _candidate_formats(has_alpha: bool) -> list[str]:
+    formats = ["WEBP"] if has_alpha else ["JPEG", "WEBP"]
+    if pil_features.check("avif"):
+        formats.append("AVIF")
+    return formats
+
+
+@traced("image.best_format")
+def _choose_format(
+    img: Image.Image, reference_quality: int, target_ssim: float | None = None
+) -> tuple[str, int]:
+    """Pick the codec with the fewest bytes at equal SSIM.
+
+    All encodes run on a small thumbnail. The first candidate is encoded
+    at reference_quality; every other candidate's quality is bisected
+    until it matches that encode's SSIM, and the smallest proxy wins.
+    With target_ssim, every candidate is matched to target_ssim instead.
+
+    Returns:
+        The winning Pillow format and its matched quality, which is a good
+        starting point for the full-size search.
+    """
+    thumb = img.copy()
+    thumb.thumbnail((PROXY_SIZE, PROXY_SIZE))
+    reference = luma(thumb)
+    formats = _candidate_formats(_has_alpha(img))
+
+    if target_ssim is None:
+        quality = max(5, min(95, reference_quality))
+        encoded = _proxy_encode(thumb, formats[0], quality)
+        target_ssim = _encoded_ssim(reference, encoded)
+        best = (len(encoded), formats[0], quality)
+        formats = formats[1:]
+    else:
+        best = (float("inf"), formats[0], reference_quality)
+
+    for fmt in formats:
+        size, quality = _match_ssim(thumb, reference, fmt, target_ssim)
+        if size < best[0]:
+            best = (size, fmt, quality)
+    return best[1], best[2]
+
+
+def _match_ssim(
+    thumb: Image.Image, reference: np.ndarray, fmt: str, target_ssim: float
+) -> tuple[int, int]:
+    """Size and quality of the lowest-quality encode reaching target_ssim."""
+    lo, hi = 5, 95
+    best = None
+    while hi - lo > 2:
+        quality = (lo + hi) // 2
+        encoded = _proxy_encode(thumb, fmt, quality)
+        if _encoded_ssim(reference, encoded) >= target_ssim:
+            best = (len(encoded), quality)
+            hi = quality
+        else:
+            lo = quality
+    if best is None:
+        best = (len(_proxy_encode(thumb, fmt, hi)), hi)
+    return best
+
+
+def _proxy_encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    cancel.check()
     buf = io.BytesIO()
-    img.save(buf, format=fmt, quality=quality)
-    buf.seek(0)
-    return buf.read()
+    img.save(buf, format=fmt, quality=quality, **_thread_params(fmt))
+    return buf.getvalue()
+
+
+def _thread_params(fmt: str) -> dict:
+    """Save options bounding a multithreaded encoder to the job's budget."""
+    return {"max_threads": governor.thread_budget()} if fmt == "AVIF" else {}
+
+
+def _encoded_ssim(reference: np.ndarray, encoded: bytes | io.BytesIO) -> float:
+    if isinstance(encoded, io.BytesIO):
+        encoded.seek(0)
+    else:
+        encoded = io.BytesIO(encoded)
+    decoded = Image.open(encoded)
+    return ssim(reference, luma(decoded, (reference.shape[1], reference.shape[0])))
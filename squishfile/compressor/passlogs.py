@@ -0,0 +1,169 @@
+"""Cache of x264 first-pass statistics, probe results and complexity.
+
+A two-pass encode spends about half its time in pass 1, which only
+depends on the source and the filter chain, not on the target: x264's
+second pass can aim any bitrate from the same statistics. Pass-1 logs
+(the .log file and its .mbtree) are therefore kept, keyed by the
+source's SHA-256 and the scale filter, and a video compressed again at
+another size (a retry, a ladder, a recovered job) runs pass 2 only.
+The source's probe result and sampled complexity (see
+`video._Planner`) are kept alongside.
+
+The cache lives next to the store (SQUISHFILE_STORE_DIR/passlogs), or in
+the temporary directory (as squishfile/passlogs, which the startup sweep
+of stale temporary files leaves alone), shared by every server process.
+It holds at most SQUISHFILE_PASSLOG_CACHE_MB megabytes (0 disables it);
+the least recently used files go first.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from squishfile.config import TEMP_PREFIX, env_int, env_str
+
+logger = logging.getLogger(__name__)
+
+# Part of every log's key: statistics from other encoder settings would
+# not match what pass 2 expects
+PASS1_SETTINGS = "libx264 medium"
+
+STATS_SUFFIXES = ("", ".mbtree")
+
+
+def enabled() -> bool:
+    return _limit() > 0
+
+
+def _limit() -> int:
+    return env_int("SQUISHFILE_PASSLOG_CACHE_MB", 256) * 1024 * 1024
+
+
+def cache_dir() -> str:
+    root = env_str("SQUISHFILE_STORE_DIR")
+    directory = (os.path.join(root, "passlogs") if root
+                 else os.path.join(tempfile.gettempdir(), "squishfile", "passlogs"))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _stats_key(content: str, scale_filter: str | None) -> str:
+    return hashlib.sha256(
+        f"{content}|{scale_filter or ''}|{PASS1_SETTINGS}".encode()
+    ).hexdigest()
+
+
+def probe(data: bytes, content: str) -> dict | None:
+    """probe_media(data), remembered per content."""
+    from squishfile.compressor.ffmpeg_utils import probe_media
+
+    info = _load_json(f"{content}.probe.json")
+    if info is None:
+        info = probe_media(data)
+        if info is not None:
+            _save_json(f"{content}.probe.json", info)
+    return info
+
+
+def complexity(content: str) -> dict:
+    """Sampled complexity of the source, per frame size and rate."""
+    return _load_json(f"{content}.complexity.json") or {}
+
+
+def save_complexity(content: str, measured: dict) -> None:
+    _save_json(f"{content}.complexity.json", measured)
+
+
+def _load_json(name: str):
+    if not enabled():
+        return None
+    path = os.path.join(cache_dir(), name)
+    try:
+        with open(path) as f:
+            value = json.load(f)
+        os.utime(path)
+        return value
+    except (OSError, ValueError):
+        return None
+
+
+def _save_json(name: str, value) -> None:
+    if not enabled():
+        return
+    try:
+        _write(os.path.join(cache_dir(), name), json.dumps(value).encode())
+    except OSError:
+        pass
+
+
+def fetch(content: str, scale_filter: str | None, stats_path: str) -> bool:
+    """Copy the cached pass-1 log for the source at this scale to
+    stats_path (and its .mbtree); False if there is none."""
+    if not enabled():
+        return False
+    cached = os.path.join(cache_dir(), _stats_key(content, scale_filter) + ".log")
+    try:
+        for suffix in STATS_SUFFIXES:
+            shutil.copyfile(cached + suffix, stats_path + suffix)
+            os.utime(cached + suffix)
+    except OSError:
+        return False
+    return True
+
+
+def save(content: str, scale_filter: str | None, stats_path: str) -> None:
+    """Keep the pass-1 log at stats_path for later encodes of the source."""
+    if not enabled():
+        return
+    cached = os.path.join(cache_dir(), _stats_key(content, scale_filter) + ".log")
+    try:
+        # The .log last: fetch needs both, and looks for the .mbtree second
+        for suffix in reversed(STATS_SUFFIXES):
+            with open(stats_path + suffix, "rb") as f:
+                _write(cached + suffix, f.read())
+    except OSError:
+        logger.warning("Could not cache pass-1 statistics", exc_info=True)
+        return
+    _evict()
+
+
+def _write(path: str, data: bytes) -> None:
+    """Write a cache file atomically (other processes may be reading)."""
+    fd, tmp = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _evict() -> None:
+    """Delete least recently used files until the cache fits its limit."""
+    directory = cache_dir()
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(TEMP_PREFIX):
+            continue  # Being written
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if total <= _limit():
+            break
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -1,5 +1,7 @@
 import fitz  # PyMuPDF
+from squishfile import cancel
 from squishfile.compressor.image import compress_image
+from squishfile.metrics import span, traced
 
 
 def compress_pdf(data: bytes, target_size: int) -> dict:
@@ -10,6 +12,25 @@ def compress_pdf(data: bytes, target_size: int) -> dict:
 
     ratio = target_size / original_size
     doc = fitz.open(stream=data, filetype="pdf")
+    iterations = _compress_embedded_images(doc, ratio)
+
+    with span("pdf.serialize"):
+        result_bytes = doc.tobytes(deflate=True, garbage=4)
+    iterations += 1
+    doc.close()
+
+    return {
+        "data": result_bytes,
+        "size": len(result_bytes),
+        "skipped": False,
+        "iterations": iterations,
+    }
+
+
+@traced("pdf.images")
+def _compress_embedded_images(doc, ratio: float) -> int:
+    """Recompress every embedded image in place; returns encode iterations."""
+    iterations = 0
 
     # Extract and compress embedded images
     for page_num in range(len(doc)):
@@ -17,6 +38,7 @@ def compress_pdf(data: bytes, target_size: int) -> dict:
         image_list = page.get_images(full=True)
 
         for img_info in image_list:
+            cancel.check()
             xref = img_info[0]
             try:
                 base_image = doc.extract_image(xref)
@@ -26,18 +48,14 @@ def compress_pdf(data: bytes, target_size: int) -> dict:
 
                 img_target = max(1024, int(len(img_data) * ratio))
                 compressed = compress_image(img_data, img_mime, img_target)
+                iterations += compressed.get("iterations", 0)
 
                 if not compressed["skipped"]:
                     # Replace image in PDF using page.replace_image
                     page.replace_image(xref, stream=compressed["data"])
+            except cancel.JobCancelled:
+                raise
             except Exception:
                 continue  # Skip images that can't be processed
 
-    result_bytes = doc.tobytes(deflate=True, garbage=4)
-    doc.close()
-
-    return {
-        "data": result_bytes,
-        "size": len(result_bytes),
-        "skipped": False,
-    }
+    return iterations
@@ -1,37 +1,160 @@
 # squishfile/compressor/predictor.py
+import json
 import os
-import joblib
+import threading
+
 import numpy as np
 
+from squishfile.compressor.features import FEATURE_NAMES, feature_vector, size_features
+
 _model = None
-_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "quality_model.pkl")
+_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "quality_model.json")
+
+# Per-format model used for each source MIME type. PNG and GIF sources
+# are converted to JPEG by the image engine, so they share one model.
+MODEL_KEYS = {
+    "image/jpeg": "jpeg",
+    "image/webp": "webp",
+    "image/png": "png_to_jpeg",
+    "image/gif": "png_to_jpeg",
+}
+
+_log_lock = threading.Lock()
 
 
 def _load_model():
     global _model
     if _model is None:
         if os.path.exists(_MODEL_PATH):
-            _model = joblib.load(_MODEL_PATH)
+            with open(_MODEL_PATH) as f:
+                bundle = json.load(f)
+            # Ignore models trained on a different feature layout
+            if bundle.get("feature_names") == FEATURE_NAMES:
+                _model = {
+                    "models": {
+                        key: {
+                            "mean": np.asarray(entry["mean"]),
+                            "scale": np.asarray(entry["scale"]),
+                            "intercept": float(entry["intercept"]),
+                            "linear": np.asarray(entry["linear"]),
+                            "quadratic": np.asarray(entry["quadratic"]),
+                            "feature_means": entry["feature_means"],
+                        }
+                        for key, entry in bundle["models"].items()
+                    }
+                }
     return _model
 
 
+def _evaluate(entry: dict, X: np.ndarray) -> np.ndarray:
+    """Evaluate an exported quadratic model on a batch of feature rows."""
+    z = (X - entry["mean"]) / entry["scale"]
+    return (
+        entry["intercept"]
+        + z @ entry["linear"]
+        + np.einsum("ij,jk,ik->i", z, entry["quadratic"], z)
+    )
+
+
+def _heuristic(original_size: int, target_size: int) -> int:
+    size_ratio = target_size / original_size if original_size > 0 else 1.0
+    return int(size_ratio * 85)
+
+
 def predict_quality(
     file_type: str,
     original_size: int,
     target_size: int,
     width: int = 1920,
     height: int = 1080,
+    features: dict | None = None,
 ) -> int:
-    model = _load_model()
+    """Predict the encoder quality that lands closest to target_size.
 
-    pixel_count = width * height
-    size_ratio = target_size / original_size if original_size > 0 else 1.0
+    Args:
+        file_type: Source MIME type; selects the per-format model.
+        original_size: Source size in bytes.
+        target_size: Target size in bytes.
+        width: Image width in pixels.
+        height: Image height in pixels.
+        features: Optional content features from `features.extract_features`.
+            Missing features are imputed with the training means.
 
-    if model is not None:
-        features = np.array([[original_size, target_size, pixel_count, size_ratio]])
-        quality = int(model.predict(features)[0])
-    else:
-        # Fallback heuristic if model not found
-        quality = int(size_ratio * 85)
+    Returns:
+        Quality in the 5-95 range.
+    """
+    return predict_qualities([{
+        "file_type": file_type,
+        "original_size": original_size,
+        "target_size": target_size,
+        "width": width,
+        "height": height,
+        "features": features,
+    }])[0]
+
+
+def predict_qualities(items: list[dict]) -> list[int]:
+    """Vectorized `predict_quality` for a batch of images.
+
+    Args:
+        items: Dicts with the keyword arguments of `predict_quality`.
+
+    Returns:
+        One quality (5-95) per item, in order.
+    """
+    bundle = _load_model()
+    qualities = [0] * len(items)
+    groups: dict[str, list[int]] = {}
+
+    for i, item in enumerate(items):
+        key = MODEL_KEYS.get(item["file_type"])
+        if bundle and key in bundle["models"]:
+            groups.setdefault(key, []).append(i)
+        else:
+            # Fallback heuristic if no model for this format
+            qualities[i] = _heuristic(item["original_size"], item["target_size"])
+
+    for key, indices in groups.items():
+        entry = bundle["models"][key]
+        rows = []
+        for i in indices:
+            item = items[i]
+            values = {
+                **(item.get("features") or {}),
+                **size_features(
+                    item["original_size"], item["target_size"],
+                    item.get("width", 1920), item.get("height", 1080),
+                ),
+            }
+            rows.append(feature_vector(values, entry["feature_means"]))
+        predictions = _evaluate(entry, np.array(rows))
+        for i, quality in zip(indices, predictions):
+            qualities[i] = int(round(float(quality)))
+
+    return [max(5, min(95, q)) for q in qualities]
+
+
+def log_training_sample(
+    file_type: str,
+    features: dict,
+    quality: int,
+    iterations: int,
+    predicted: int,
+) -> None:
+    """Append a (features -> final quality) pair to the opt-in training log.
 
-    return max(5, min(95, quality))
+    Enabled by pointing SQUISHFILE_TRAINING_LOG at a JSONL file; consumed
+    by `scripts/train_model.py --log`.
+    """
+    path = os.environ.get("SQUISHFILE_TRAINING_LOG")
+    if not path or file_type not in MODEL_KEYS:
+        return
+    record = {
+        "model": MODEL_KEYS[file_type],
+        "features": {name: features[name] for name in FEATURE_NAMES if name in features},
+        "quality": quality,
+        "predicted": predicted,
+        "iterations": iterations,
+    }
+    with _log_lock, open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
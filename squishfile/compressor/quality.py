@@ -0,0 +1,168 @@
+"""Fast perceptual quality measures on downscaled luma planes.
+
+Scores are computed on a grayscale copy no larger than QUALITY_SIZE, with
+NumPy box filters, so a comparison costs a few milliseconds regardless
+of the source resolution. PDFs are compared on a few rendered pages and
+videos with FFmpeg's ssim/psnr filters on sampled, downscaled frames.
+"""
+import io
+import os
+import re
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+from squishfile.config import TEMP_PREFIX
+
+# Longest side of the luma planes that are compared
+QUALITY_SIZE = 512
+
+# SSIM window (pixels) and stabilizing constants for 8-bit data
+SSIM_WINDOW = 7
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+# PSNR reported for identical inputs (which would be infinite)
+PSNR_CAP = 100.0
+
+# Pages compared per PDF, spread evenly through the document
+PDF_SAMPLE_PAGES = 3
+
+# Video frames are sampled at this rate, over at most this many seconds,
+# and compared at VIDEO_SAMPLE_SIZE (width x height).
+VIDEO_SAMPLE_FPS = 1
+VIDEO_SAMPLE_SECONDS = 60
+VIDEO_SAMPLE_SIZE = (320, 180)
+
+
+def luma(img: Image.Image, size: tuple[int, int] | None = None) -> np.ndarray:
+    """Float luma plane of `img`, resized to `size` or fit in QUALITY_SIZE.
+
+    Transparent pixels are composited over white, the way most viewers
+    show them.
+    """
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        rgba = img.convert("RGBA")
+        img = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        img.alpha_composite(rgba)
+    gray = img.convert("L")
+    if size is None:
+        gray.thumbnail((QUALITY_SIZE, QUALITY_SIZE))
+    elif gray.size != size:
+        gray = gray.resize(size, Image.BILINEAR)
+    return np.asarray(gray, dtype=np.float64)
+
+
+def _box_mean(x: np.ndarray, window: int) -> np.ndarray:
+    """Mean over every window x window block ("valid" positions only)."""
+    c = np.pad(x, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = c[window:, window:] - c[:-window, window:] - c[window:, :-window] + c[:-window, :-window]
+    return total / (window * window)
+
+
+def ssim(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Mean structural similarity of two equally sized luma planes."""
+    window = min(SSIM_WINDOW, *reference.shape)
+    mu_a = _box_mean(reference, window)
+    mu_b = _box_mean(candidate, window)
+    var_a = _box_mean(reference * reference, window) - mu_a * mu_a
+    var_b = _box_mean(candidate * candidate, window) - mu_b * mu_b
+    cov = _box_mean(reference * candidate, window) - mu_a * mu_b
+    score = ((2 * mu_a * mu_b + _C1) * (2 * cov + _C2)) / (
+        (mu_a * mu_a + mu_b * mu_b + _C1) * (var_a + var_b + _C2)
+    )
+    return float(score.mean())
+
+
+def psnr(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Peak signal-to-noise ratio (dB) of two equally sized luma planes."""
+    mse = float(np.mean((reference - candidate) ** 2))
+    if mse == 0:
+        return PSNR_CAP
+    return min(PSNR_CAP, float(10 * np.log10(255 ** 2 / mse)))
+
+
+def compare(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    return {"ssim": ssim(reference, candidate), "psnr": psnr(reference, candidate)}
+
+
+def _open_for_comparison(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    # JPEGs decode straight to a reduced-size grayscale image
+    img.draft("L", (QUALITY_SIZE, QUALITY_SIZE))
+    # Outputs are stored upright, so compare the original as displayed
+    if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+    return img
+
+
+def measure_image(original: bytes, compressed: bytes) -> dict:
+    """SSIM and PSNR of a compressed image (first frame) against the original."""
+    reference = luma(_open_for_comparison(original))
+    size = (reference.shape[1], reference.shape[0])
+    return compare(reference, luma(_open_for_comparison(compressed), size))
+
+
+def measure_pdf(original: bytes, compressed: bytes) -> dict:
+    """Mean SSIM and PSNR over a few rendered pages of two PDFs."""
+    import fitz
+
+    with fitz.open(stream=original, filetype="pdf") as ref_doc, \
+            fitz.open(stream=compressed, filetype="pdf") as out_doc:
+        pages = min(len(ref_doc), len(out_doc))
+        if pages == 0:
+            return {}
+        sample = sorted({round(i * (pages - 1) / max(1, PDF_SAMPLE_PAGES - 1))
+                         for i in range(min(pages, PDF_SAMPLE_PAGES))})
+        scores = [compare(_render_page(ref_doc[i]), _render_page(out_doc[i])) for i in sample]
+    return {key: float(np.mean([score[key] for score in scores])) for key in ("ssim", "psnr")}
+
+
+def _render_page(page) -> np.ndarray:
+    import fitz
+
+    zoom = QUALITY_SIZE / max(page.rect.width, page.rect.height, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    plane = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return plane[:, :pix.width].astype(np.float64)
+
+
+def measure_video(original: bytes, compressed: bytes) -> dict:
+    """SSIM and PSNR of sampled, downscaled frames from FFmpeg's filters."""
+    from squishfile.compressor.ffmpeg_utils import get_ffmpeg, run_ffmpeg
+
+    width, height = VIDEO_SAMPLE_SIZE
+    sample = f"fps={VIDEO_SAMPLE_FPS},scale={width}:{height},format=gray"
+    graph = (
+        f"[0:v]{sample}[out];[1:v]{sample},split[ref1][ref2];"
+        "[out][ref1]ssim[checked];[checked][ref2]psnr"
+    )
+    paths = []
+    try:
+        for data in (compressed, original):
+            fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX)
+            paths.append(path)
+            os.write(fd, data)
+            os.close(fd)
+        result = run_ffmpeg(
+            [get_ffmpeg(), "-t", str(VIDEO_SAMPLE_SECONDS), "-i", paths[0],
+             "-t", str(VIDEO_SAMPLE_SECONDS), "-i", paths[1],
+             "-lavfi", graph, "-an", "-f", "null", "-"],
+            timeout=120,
+        )
+    except (subprocess.TimeoutExpired, OSError):
+        return {}
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+    ssim_match = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    psnr_match = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    if not ssim_match or not psnr_match:
+        return {}
+    return {
+        "ssim": float(ssim_match.group(1)),
+        "psnr": min(PSNR_CAP, float(psnr_match.group(1))),
+    }
@@ -0,0 +1,204 @@
+"""Registry of compression engines and what each one can do.
+
+Every engine is described by an `EngineSpec`: the MIME types it accepts
+(with their file extensions), how to import its compress function, a
+rough cost model and the targets and outputs it supports. The detector,
+the engine dispatcher, the worker pools and duration estimates all read
+from here.
+
+Third-party engines are found through the "squishfile.engines" entry
+point group; each entry point must resolve to an `EngineSpec`:
+
+    [project.entry-points."squishfile.engines"]
+    heic = "my_package.squish:HEIC_ENGINE"
+
+or can be added at runtime with `register`. A registered engine replaces
+any earlier engine for the same category.
+"""
+import importlib
+import logging
+from dataclasses import dataclass, field
+from importlib.metadata import entry_points
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "squishfile.engines"
+
+# Bound values: where the work happens, which decides the pool it runs on
+CPU_BOUND = "cpu"
+SUBPROCESS_BOUND = "subprocess"
+
+
+@dataclass(frozen=True)
+class EngineSpec:
+    """Capabilities of one compression engine.
+
+    Attributes:
+        category: Category name reported by the detector ("image", ...).
+        mimes: Accepted MIME types, mapped to their file extensions.
+        entry_point: "module:function" of the compress function, which is
+            called as function(data, mime, target_size, **options) (or
+            without mime if takes_mime is False) and returns a result dict.
+        seconds_per_mb: Estimated compression time per MB of input.
+        mime_seconds_per_mb: Per-MIME overrides of seconds_per_mb.
+        bound: CPU_BOUND (runs Python/C code in process) or
+            SUBPROCESS_BOUND (waits on FFmpeg or another child process).
+        targets: Targets supported: "size" and/or "ssim".
+        outputs: MIME types the engine may produce besides its input's.
+        options: Keyword options the compress function accepts.
+        support: Modules to import ahead of first use alongside the engine.
+        takes_mime: Whether the compress function takes the MIME type.
+        ladder_entry_point: "module:function" compressing to several
+            targets at once, called like the compress function but with
+            a list of target sizes (and quality_hints for quality_hint),
+            returning one result dict per target. Without one, a ladder
+            calls the compress function once per target.
+    """
+
+    category: str
+    mimes: dict[str, str]
+    entry_point: str
+    seconds_per_mb: float = 1.0
+    mime_seconds_per_mb: dict[str, float] = field(default_factory=dict)
+    bound: str = CPU_BOUND
+    targets: frozenset[str] = frozenset({"size"})
+    outputs: tuple[str, ...] = ()
+    options: frozenset[str] = frozenset()
+    support: tuple[str, ...] = ()
+    takes_mime: bool = True
+    ladder_entry_point: str | None = None
+
+    def load(self):
+        """Import and return the compress function."""
+        return _import(self.entry_point)
+
+    def load_ladder(self):
+        """Import and return the ladder function (None if there is none)."""
+        return _import(self.ladder_entry_point) if self.ladder_entry_point else None
+
+    def estimate_seconds(self, size: int, mime: str | None = None) -> float:
+        rate = self.mime_seconds_per_mb.get(mime, self.seconds_per_mb)
+        return rate * size / (1024 * 1024)
+
+
+def _import(entry_point: str):
+    module_name, attr = entry_point.split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+BUILTIN_ENGINES = (
+    EngineSpec(
+        category="image",
+        mimes={
+            "image/jpeg": ".jpg",
+            "image/png": ".png",
+            "image/webp": ".webp",
+            "image/gif": ".gif",
+            "image/svg+xml": ".svg",
+        },
+        entry_point="squishfile.compressor.image:compress_image",
+        ladder_entry_point="squishfile.compressor.image:compress_image_ladder",
+        # Measured with `python -m benchmarks.run` on one core
+        seconds_per_mb=1.5,
+        mime_seconds_per_mb={"image/jpeg": 0.3, "image/png": 4.0, "image/webp": 2.8},
+        targets=frozenset({"size", "ssim"}),
+        outputs=("image/jpeg", "image/webp", "image/avif", "image/png", "video/mp4"),
+        options=frozenset({"quality_hint", "animation_format", "best_format", "target_ssim"}),
+        support=("squishfile.compressor.features", "squishfile.compressor.predictor"),
+    ),
+    EngineSpec(
+        category="pdf",
+        mimes={"application/pdf": ".pdf"},
+        entry_point="squishfile.compressor.pdf:compress_pdf",
+        seconds_per_mb=0.4,
+        takes_mime=False,
+    ),
+    EngineSpec(
+        category="video",
+        mimes={"video/mp4": ".mp4", "video/webm": ".webm", "video/quicktime": ".mov"},
+        entry_point="squishfile.compressor.video:compress_video",
+        ladder_entry_point="squishfile.compressor.video:compress_video_ladder",
+        seconds_per_mb=1.0,
+        bound=SUBPROCESS_BOUND,
+        outputs=("video/mp4",),
+    ),
+    EngineSpec(
+        category="audio",
+        mimes={"audio/mpeg": ".mp3", "audio/wav": ".wav", "audio/x-wav": ".wav"},
+        entry_point="squishfile.compressor.audio:compress_audio",
+        ladder_entry_point="squishfile.compressor.audio:compress_audio_ladder",
+        seconds_per_mb=0.15,
+        bound=SUBPROCESS_BOUND,
+        outputs=("audio/mpeg",),
+    ),
+)
+
+_engines: dict[str, EngineSpec] = {}
+_discovered = False
+
+
+def register(spec: EngineSpec) -> None:
+    """Add an engine, replacing any engine registered for its category.
+
+    For a MIME type claimed by several categories, the most recently
+    registered engine wins. Registrations are per process: worker
+    processes (SQUISHFILE_WORKERS) only see entry-point plugins.
+    """
+    _discover()
+    _add(spec)
+
+
+def engines() -> dict[str, EngineSpec]:
+    """All engines by category: built-ins, then entry-point plugins."""
+    _discover()
+    return _engines
+
+
+def _add(spec: EngineSpec) -> None:
+    _engines.pop(spec.category, None)
+    _engines[spec.category] = spec
+
+
+def _discover() -> None:
+    global _discovered
+    if _discovered:
+        return
+    _discovered = True
+    for spec in BUILTIN_ENGINES:
+        _add(spec)
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            spec = ep.load()
+        except Exception:
+            logger.warning("Could not load engine plugin %s", ep.name, exc_info=True)
+            continue
+        if isinstance(spec, EngineSpec):
+            _add(spec)
+        else:
+            logger.warning("Engine plugin %s is not an EngineSpec", ep.name)
+
+
+def get(category: str) -> EngineSpec | None:
+    return engines().get(category)
+
+
+def for_mime(mime: str) -> EngineSpec | None:
+    """The engine that accepts `mime`."""
+    for spec in reversed(list(engines().values())):
+        if mime in spec.mimes:
+            return spec
+    return None
+
+
+def supported_mimes(category: str | None = None) -> dict[str, str]:
+    """Accepted MIME types mapped to extensions, for one or all categories."""
+    mimes = {}
+    for spec in engines().values():
+        if category is None or spec.category == category:
+            mimes.update(spec.mimes)
+    return mimes
+
+
+def extension_for(mime: str, default: str = ".bin") -> str:
+    spec = for_mime(mime)
+    return spec.mimes[mime] if spec else default
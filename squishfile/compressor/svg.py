@@ -0,0 +1,380 @@
+"""SVG compression by streaming minification, with rasterization fallback.
+
+The document is read with `iterparse` and written out as it is parsed;
+finished elements are released immediately, so memory stays bounded by
+the nesting depth rather than the size of the file. Minification drops
+comments, the XML prolog, <metadata>, editor namespaces (Inkscape,
+Sodipodi, Illustrator, Sketch, ...) and insignificant whitespace, rounds
+numbers in geometry attributes and re-serializes path data with the
+fewest separators. If even the coarsest precision misses the target and
+SQUISHFILE_SVG_RASTERIZE is on (the default), the SVG is rendered with
+PyMuPDF and handed to the PNG engine, which picks PNG, WebP or JPEG.
+"""
+import io
+import math
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from squishfile import cancel
+from squishfile.config import env_bool
+from squishfile.metrics import span
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# Namespaces written by editors that have no effect on rendering
+EDITOR_NAMESPACES = (
+    "http://www.inkscape.org/namespaces/inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+    "http://ns.adobe.com/",
+    "http://www.bohemiancoding.com/sketch/ns",
+    "http://www.serif.com/",
+    "http://www.figma.com/",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "http://creativecommons.org/ns#",
+    "http://purl.org/dc/elements/1.1/",
+)
+
+DROPPED_ELEMENTS = {f"{{{SVG_NS}}}metadata"}
+
+# Elements whose text content is rendered, so whitespace matters
+TEXT_ELEMENTS = {
+    f"{{{SVG_NS}}}{name}" for name in ("text", "tspan", "textPath", "title", "desc")
+}
+
+# Attributes holding numbers (or lists of numbers) that can be rounded
+NUMERIC_ATTRIBUTES = {
+    "x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "rx", "ry", "fx", "fy",
+    "dx", "dy", "width", "height", "points", "viewBox", "stroke-width",
+    "stroke-dashoffset", "stroke-dasharray", "stroke-miterlimit", "opacity",
+    "fill-opacity", "stroke-opacity", "stop-opacity", "offset", "font-size",
+    "letter-spacing",
+}
+
+# Attributes holding transform lists. Only translations are coordinates;
+# scale, rotation and skew factors keep FACTOR_DIGITS significant digits
+TRANSFORM_ATTRIBUTES = {"transform", "gradientTransform", "patternTransform"}
+FACTOR_DIGITS = 3
+
+# Positions of the coordinates among each transform function's arguments
+TRANSFORM_COORDINATES = {"translate": (0, 1), "matrix": (4, 5), "rotate": (1, 2)}
+
+# Decimal places tried in order; fewer places is smaller but coarser
+PRECISIONS = (3, 2, 1)
+
+# Longest side (pixels) of the rasterized image
+MAX_RASTER_SIZE = 4096
+
+# Attributes holding a color
+COLOR_ATTRIBUTES = {"fill", "stroke", "stop-color", "flood-color", "lighting-color", "color"}
+
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# A number in CSS, not part of a name (.cls-1) or hex color (#1a2b3c)
+_CSS_NUMBER = re.compile(r"(?<![#\w.\-])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# A #rrggbb color standing on its own: not a url(#id) reference
+_LONG_HEX_COLOR = re.compile(
+    r"(?<![\w#])(?<!url\()(?<!url\([\"'])#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3\b"
+)
+# A CSS declaration's value (after its property's colon)
+_CSS_VALUE = re.compile(r":[^;{}]+")
+_TRANSFORM = re.compile(r"([a-zA-Z]+)\s*\(([^)]*)\)")
+_PATH_TOKEN = re.compile(r"[MmZzLlHhVvCcSsQqTtAa]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def compress_svg(data: bytes, target_size: int) -> dict:
+    """Compress an SVG to target_size.
+
+    Returns:
+        Dict with keys: data, size, skipped, iterations, plus output_mime
+        and output_ext if the SVG had to be rasterized.
+    """
+    return compress_svg_ladder(data, [target_size])[0]
+
+
+def compress_svg_ladder(data: bytes, target_sizes: list[int]) -> list[dict]:
+    """Compress an SVG to each of target_sizes, minifying it once per
+    precision and rasterizing it at most once.
+
+    Returns:
+        One result dict per target (see `compress_svg`), in the order of
+        target_sizes.
+    """
+    minified: dict[int, bytes] = {}
+    results = [None] * len(target_sizes)
+    rasterized = []  # Targets the minified SVG misses
+
+    with span("svg.minify"):
+        for i, target_size in enumerate(target_sizes):
+            best = None
+            iterations = 0
+            for precision in PRECISIONS:
+                cancel.check()
+                if precision not in minified:
+                    try:
+                        minified[precision] = minify_svg(data, precision)
+                    except ET.ParseError:
+                        return [{"data": data, "size": len(data), "skipped": True,
+                                 "message": "Could not parse SVG"} for _ in target_sizes]
+                iterations += 1
+                if best is None or len(minified[precision]) < len(best):
+                    best = minified[precision]
+                if len(minified[precision]) <= target_size * 1.05:
+                    break
+            results[i] = {"data": best, "size": len(best), "skipped": False,
+                          "iterations": iterations}
+            if len(best) > target_size * 1.05:
+                rasterized.append(i)
+
+    if rasterized and env_bool("SQUISHFILE_SVG_RASTERIZE", True):
+        rasters = _rasterize(data, [target_sizes[i] for i in rasterized])
+        for i, raster in zip(rasterized, rasters or ()):
+            if raster["size"] < results[i]["size"]:
+                raster["iterations"] += results[i]["iterations"]
+                results[i] = raster
+
+    return results
+
+
+def minify_svg(data: bytes, precision: int = 3) -> bytes:
+    """Minify an SVG document in a single streaming pass.
+
+    `precision` is the number of decimals kept for drawings about 100
+    units across; smaller coordinate systems (like 24x24 icons) keep
+    proportionally more.
+    """
+    out = io.StringIO()
+    prefixes = {XML_NS: "xml"}
+    pending_ns: list[tuple[str, str]] = []
+    # Open elements: [element, written, wrote_text, tag open ("<tag" without ">"),
+    # precision]
+    stack: list[list] = []
+    closed = None  # Last finished child, whose tail is not known until now
+
+    def open_content(entry):
+        if entry[3]:
+            out.write(">")
+            entry[3] = False
+
+    def flush_tail():
+        nonlocal closed
+        if closed is not None:
+            parent = stack[-1] if stack else None
+            if parent is not None and parent[1]:
+                _write_text(out, parent, closed.tail)
+            closed = None
+        if stack:
+            # Finished children are no longer needed
+            del stack[-1][0][:-1]
+
+    for event, value in ET.iterparse(io.BytesIO(data), events=("start-ns", "start", "end")):
+        if event == "start-ns":
+            prefix, uri = value
+            if not _is_editor_namespace(uri):
+                # Prefer the default namespace for SVG's own elements
+                if prefix == "" or uri not in prefixes:
+                    prefixes[uri] = prefix
+                pending_ns.append((prefix, uri))
+            continue
+
+        elem = value
+        if event == "start":
+            flush_tail()
+            parent = stack[-1] if stack else None
+            if parent is not None and parent[1] and not parent[2]:
+                _write_text(out, parent, parent[0].text)
+                parent[2] = True
+
+            if parent is None:
+                precision += _extra_decimals(elem)
+            written = (parent is None or parent[1]) and not _is_dropped(elem.tag)
+            if written:
+                if parent is not None:
+                    open_content(parent)
+                out.write("<" + _qualified(elem.tag, prefixes))
+                for prefix, uri in pending_ns:
+                    if prefixes[uri] != prefix:
+                        continue  # Redundant alias, e.g. xmlns:svg next to xmlns
+                    out.write(f' xmlns{":" + prefix if prefix else ""}={_quote(uri)}')
+                for name, attr in elem.attrib.items():
+                    if _is_editor_namespace(_namespace(name)):
+                        continue
+                    out.write(f" {_qualified(name, prefixes)}={_quote(_minify_attribute(name, attr, precision))}")
+            pending_ns = []
+            stack.append([elem, written, False, written, precision])
+            continue
+
+        # event == "end"
+        flush_tail()
+        entry = stack.pop()
+        if entry[1]:
+            if not entry[2]:
+                _write_text(out, entry, elem.text)
+            if entry[3]:
+                out.write("/>")
+            else:
+                out.write(f"</{_qualified(elem.tag, prefixes)}>")
+        elem.text = None
+        closed = elem
+        if not stack:
+            break
+
+    return out.getvalue().encode("utf-8")
+
+
+def _extra_decimals(root: ET.Element) -> int:
+    """Decimals to add for coordinate systems smaller than ~100 units."""
+    sizes = [float(n) for n in _NUMBER.findall(root.get("viewBox", ""))[2:]]
+    if not sizes:
+        sizes = [float(n) for attr in ("width", "height") for n in _NUMBER.findall(root.get(attr, ""))]
+    extent = max(sizes, default=0)
+    if extent <= 0:
+        return 0
+    return max(0, 2 - math.floor(math.log10(extent)))
+
+
+def _write_text(out: io.StringIO, entry: list, text: str | None) -> None:
+    if not text:
+        return
+    tag = entry[0].tag
+    if tag in TEXT_ELEMENTS:
+        content = text
+    elif tag == f"{{{SVG_NS}}}style":
+        content = _minify_css(text, entry[4])
+    elif text.strip():
+        content = " ".join(text.split())
+    else:
+        return
+    if content:
+        if entry[3]:
+            out.write(">")
+            entry[3] = False
+        out.write(escape(content))
+
+
+def _namespace(name: str) -> str:
+    return name[1:name.index("}")] if name.startswith("{") else ""
+
+
+def _is_editor_namespace(uri: str) -> bool:
+    return bool(uri) and uri.startswith(EDITOR_NAMESPACES)
+
+
+def _is_dropped(tag: str) -> bool:
+    return tag in DROPPED_ELEMENTS or _is_editor_namespace(_namespace(tag))
+
+
+def _qualified(name: str, prefixes: dict) -> str:
+    if not name.startswith("{"):
+        return name
+    uri, local = name[1:].split("}", 1)
+    prefix = prefixes.get(uri, "")
+    return f"{prefix}:{local}" if prefix else local
+
+
+def _quote(value: str) -> str:
+    return '"' + escape(value, {'"': "&quot;"}) + '"'
+
+
+def _format_number(value: str, precision: int) -> str:
+    number = round(float(value), precision)
+    text = f"{number:.{precision}f}".rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def _minify_attribute(name: str, value: str, precision: int) -> str:
+    if name == "d":
+        return _minify_path(value, precision)
+    if name == "style":
+        return _minify_css(value, precision)
+    if name in COLOR_ATTRIBUTES:
+        return _LONG_HEX_COLOR.sub(r"#\1\2\3", value.strip())
+    if name in TRANSFORM_ATTRIBUTES:
+        return _minify_transform(value, precision)
+    if name in NUMERIC_ATTRIBUTES:
+        rounded = _NUMBER.sub(lambda m: _format_number(m.group(), precision), value)
+        return " ".join(rounded.replace(",", " ").split())
+    return value
+
+
+def _minify_transform(value: str, precision: int) -> str:
+    def function(match: re.Match) -> str:
+        coordinates = TRANSFORM_COORDINATES.get(match.group(1), ())
+        args = [
+            _format_number(number, precision) if k in coordinates
+            else _format_factor(number, precision)
+            for k, number in enumerate(_NUMBER.findall(match.group(2)))
+        ]
+        return f"{match.group(1)}({' '.join(args)})"
+
+    return _TRANSFORM.sub(function, value.strip())
+
+
+def _format_factor(value: str, precision: int) -> str:
+    """A unitless factor, rounded to FACTOR_DIGITS significant digits
+    (or `precision` decimals, if more), so it never rounds to zero."""
+    number = float(value)
+    if number == 0 or not math.isfinite(number):
+        return _format_number(value, precision)
+    decimals = FACTOR_DIGITS - 1 - math.floor(math.log10(abs(number)))
+    return _format_number(value, max(precision, decimals))
+
+
+def _minify_path(d: str, precision: int) -> str:
+    """Round path coordinates and drop every separator that is not needed."""
+    parts = []
+    previous = None  # Last number written in the current run, if any
+    for token in _PATH_TOKEN.findall(d):
+        if token[0].isalpha():
+            parts.append(token)
+            previous = None
+            continue
+        number = _format_number(token, precision)
+        if previous is not None and not (
+            number.startswith("-")
+            or (number.startswith(".") and "." in previous and "e" not in previous.lower())
+        ):
+            parts.append(" ")
+        parts.append(number)
+        previous = number
+    return "".join(parts)
+
+
+def _minify_css(css: str, precision: int) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = " ".join(css.split())
+    css = re.sub(r"\s*([:;{},])\s*", r"\1", css).rstrip(";")
+    css = _CSS_NUMBER.sub(lambda m: _format_number(m.group(), precision), css)
+    # Colors only in values: "#aabbcc{...}" is an id selector
+    return _CSS_VALUE.sub(lambda m: _LONG_HEX_COLOR.sub(r"#\1\2\3", m.group()), css)
+
+
+def _rasterize(data: bytes, target_sizes: list[int]) -> list[dict] | None:
+    """Render the SVG once and compress it to each target with the PNG
+    engine (None if it cannot be rendered)."""
+    import fitz
+
+    from squishfile.compressor.image import _compress_png_ladder, _open_image
+
+    with span("svg.rasterize"):
+        try:
+            with fitz.open(stream=data, filetype="svg") as doc:
+                page = doc[0]
+                zoom = min(1.0, MAX_RASTER_SIZE / max(page.rect.width, page.rect.height, 1))
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=True)
+                png = pix.tobytes("png")
+        except Exception:
+            return None
+
+    results = _compress_png_ladder(_open_image(png), target_sizes, [None] * len(target_sizes))
+    for result in results:
+        result.setdefault("output_mime", "image/png")
+        result.setdefault("output_ext", ".png")
+        result["iterations"] += 1
+    return results
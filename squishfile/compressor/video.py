@@ -1,23 +1,53 @@
-"""Video compression using FFmpeg two-pass encoding (via imageio-ffmpeg)."""
+"""Video compression using FFmpeg two-pass encoding (via imageio-ffmpeg).
+
+Before encoding, `_Planner` picks the frame size and rate for the
+target: short clips of the source are sample-encoded to measure how
+many bits per pixel it needs, and the largest frame size and rate that
+the target's bitrate can encode at ACCEPTABLE_CRF quality wins (scaled
+to keep the aspect ratio, never padded). Pass 1's statistics are cached
+per source and filter chain (see `passlogs`), so compressing the same
+video again runs pass 2 only.
+"""
+import math
 import os
 import shutil
 import subprocess
 import tempfile
 
-from squishfile.compressor.ffmpeg_utils import get_ffmpeg, probe_media
+from squishfile.compressor import passlogs, registry
+from squishfile.compressor.curves import (
+    CRF_HALVING, SAMPLE_CRF, SAMPLE_PRESET, sample_clips,
+)
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg, run_ffmpeg
+from squishfile.config import TEMP_PREFIX
+from squishfile.metrics import span
 
-# Minimum video bitrate before we try downscaling
+# Lowest video bitrate encoded, whatever the target
 MIN_BITRATE_KBPS = 100
 
 # Audio bitrate for output (kbps)
 AUDIO_BITRATE_KBPS = 128
 
-# Resolution downscale steps
-SCALE_STEPS = [
-    (1280, 720),
-    (854, 480),
-    (640, 360),
-]
+# Share of the output taken by the MP4 container rather than the streams
+CONTAINER_OVERHEAD = 0.02
+
+# Shorter sides and frame rates the planner may reduce a video to
+PLAN_SHORT_SIDES = (1080, 720, 540, 480, 360, 240)
+PLAN_FRAME_RATES = (30, 24)
+# Frame rate assumed when the probe reports none
+DEFAULT_FRAME_RATE = 25
+
+# The planner keeps the largest frame size and rate whose predicted
+# CRF (x264's quality scale, lower is better) is at most ACCEPTABLE_CRF
+ACCEPTABLE_CRF = 28
+# At this many bits per pixel or more, any video looks fine at its own
+# size and rate, so nothing is sampled
+GENEROUS_BITS_PER_PIXEL = 0.1
+# Bits an encode needs grow with its pixel rate to about this power, so
+# bits per pixel shrink with it to the power (this - 1)
+PIXEL_RATE_EXPONENT = 0.75
+# Sample encodes per planner, at most
+MAX_PLAN_SAMPLES = 3
 
 
 def compress_video(data: bytes, mime: str, target_size: int) -> dict:
@@ -37,7 +67,8 @@ def compress_video(data: bytes, mime: str, target_size: int) -> dict:
         return {"data": data, "size": original_size, "skipped": True}
 
     # Probe to get duration and resolution
-    info = probe_media(data)
+    content = passlogs.content_key(data)
+    info = passlogs.probe(data, content)
     if info is None:
         return {"data": data, "size": original_size, "skipped": True,
                 "message": "Could not probe video file"}
@@ -47,63 +78,44 @@ def compress_video(data: bytes, mime: str, target_size: int) -> dict:
         return {"data": data, "size": original_size, "skipped": True,
                 "message": "Could not determine video duration"}
 
-    # Calculate target video bitrate
-    audio_bits = AUDIO_BITRATE_KBPS * 1000
-    total_target_bits = target_size * 8
-    video_bitrate = int(total_target_bits / duration - audio_bits)
-
-    if video_bitrate <= 0:
-        video_bitrate = MIN_BITRATE_KBPS * 1000
-
-    video_bitrate_raw_kbps = video_bitrate // 1000
-    video_bitrate_kbps = max(MIN_BITRATE_KBPS, video_bitrate_raw_kbps)
-
-    # Determine if we need to scale down based on unclamped bitrate
-    scale_filter = None
-    if video_bitrate_raw_kbps < MIN_BITRATE_KBPS:
-        # Find the video stream resolution
-        for stream in info.get("streams", []):
-            if stream.get("codec_type") == "video":
-                orig_w = stream.get("width", 1920)
-                orig_h = stream.get("height", 1080)
-                for sw, sh in SCALE_STEPS:
-                    if orig_w > sw or orig_h > sh:
-                        scale_filter = f"scale={sw}:{sh}:force_original_aspect_ratio=decrease,pad={sw}:{sh}:(ow-iw)/2:(oh-ih)/2"
-                        break
-                break
-
-    ext = _ext_for_mime(mime)
-    in_fd, in_path = tempfile.mkstemp(suffix=ext)
-    out_fd, out_path = tempfile.mkstemp(suffix=".mp4")
-    passlog_dir = tempfile.mkdtemp(prefix="ffmpeg2pass_")
-    passlog_prefix = os.path.join(passlog_dir, "passlog")
+    ext = registry.extension_for(mime)
+    in_fd, in_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=ext)
+    out_fd, out_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp4")
+    # x264 reads and writes its statistics in the directory FFmpeg runs in
+    passlog_dir = tempfile.mkdtemp(prefix=f"{TEMP_PREFIX}2pass-")
+    stats = "passlog.log"
 
     try:
         os.write(in_fd, data)
         os.close(in_fd)
         os.close(out_fd)
 
+        planner = _Planner(in_path, info, duration, content)
+        video_bitrate_kbps, scale_filter = planner.plan(target_size)
         vf = ["-vf", scale_filter] if scale_filter else []
 
-        # Pass 1
-        cmd_pass1 = [
-            get_ffmpeg(), "-y", "-i", in_path,
-            "-c:v", "libx264", "-preset", "medium",
-            "-b:v", f"{video_bitrate_kbps}k",
-            *vf,
-            "-pass", "1",
-            "-passlogfile", passlog_prefix,
-            "-an",
-            "-f", "null",
-            os.devnull,
-        ]
+        # Pass 1, unless an earlier encode of this source left its statistics
+        iterations = 1
+        if not passlogs.fetch(content, scale_filter, os.path.join(passlog_dir, stats)):
+            cmd_pass1 = [
+                get_ffmpeg(), "-y", "-i", in_path,
+                "-c:v", "libx264", "-preset", "medium",
+                "-b:v", f"{video_bitrate_kbps}k",
+                *vf,
+                "-pass", "1",
+                "-x264-params", f"stats={stats}",
+                "-an",
+                "-f", "null",
+                os.devnull,
+            ]
 
-        result1 = subprocess.run(
-            cmd_pass1, capture_output=True, text=True, timeout=300,
-        )
-        if result1.returncode != 0:
-            return {"data": data, "size": original_size, "skipped": True,
-                    "message": "FFmpeg pass 1 failed"}
+            with span("video.pass1"):
+                result1 = run_ffmpeg(cmd_pass1, timeout=300, cwd=passlog_dir)
+            if result1.returncode != 0:
+                return {"data": data, "size": original_size, "skipped": True,
+                        "message": "FFmpeg pass 1 failed"}
+            passlogs.save(content, scale_filter, os.path.join(passlog_dir, stats))
+            iterations = 2
 
         # Pass 2
         cmd_pass2 = [
@@ -112,14 +124,13 @@ def compress_video(data: bytes, mime: str, target_size: int) -> dict:
             "-b:v", f"{video_bitrate_kbps}k",
             *vf,
             "-pass", "2",
-            "-passlogfile", passlog_prefix,
+            "-x264-params", f"stats={stats}",
             "-c:a", "aac", "-b:a", f"{AUDIO_BITRATE_KBPS}k",
             out_path,
         ]
 
-        result2 = subprocess.run(
-            cmd_pass2, capture_output=True, text=True, timeout=300,
-        )
+        with span("video.pass2"):
+            result2 = run_ffmpeg(cmd_pass2, timeout=300, cwd=passlog_dir)
         if result2.returncode != 0:
             return {"data": data, "size": original_size, "skipped": True,
                     "message": "FFmpeg pass 2 failed"}
@@ -133,6 +144,7 @@ def compress_video(data: bytes, mime: str, target_size: int) -> dict:
             "skipped": False,
             "output_mime": "video/mp4",
             "output_ext": ".mp4",
+            "iterations": iterations,
         }
     except subprocess.TimeoutExpired:
         return {"data": data, "size": original_size, "skipped": True,
@@ -146,10 +158,316 @@ def compress_video(data: bytes, mime: str, target_size: int) -> dict:
             shutil.rmtree(passlog_dir, ignore_errors=True)
 
 
-def _ext_for_mime(mime: str) -> str:
-    """Return file extension for a given video MIME type."""
-    return {
-        "video/mp4": ".mp4",
-        "video/webm": ".webm",
-        "video/quicktime": ".mov",
-    }.get(mime, ".bin")
+def _video_bitrate_kbps(duration: float, target_size: int, has_audio: bool = True) -> int:
+    """Video bitrate filling target_size bytes, after the audio."""
+    audio_bits = AUDIO_BITRATE_KBPS * 1000 if has_audio else 0
+    stream_bits = target_size * 8 * (1 - CONTAINER_OVERHEAD)
+    video_bitrate = int(stream_bits / duration - audio_bits)
+    return max(MIN_BITRATE_KBPS, video_bitrate // 1000)
+
+
+class _Planner:
+    """Chooses the frame size, frame rate and bitrate of a video's encodes.
+
+    Candidates ("rungs") are the source's own size and rate, then
+    smaller PLAN_SHORT_SIDES and lower PLAN_FRAME_RATES, tried from the
+    largest pixel rate down. A rung's complexity is the bits per pixel
+    its sample encode (at SAMPLE_CRF) took; rungs not sampled are
+    predicted from the nearest sampled one. A bitrate B at a rung
+    needing R bits per second at SAMPLE_CRF lands near CRF
+    SAMPLE_CRF + CRF_HALVING * log2(R / B). Samples are shared by every
+    target planned (a ladder's) and cached per source.
+    """
+
+    def __init__(self, path: str, info: dict, duration: float, content: str):
+        self.path = path
+        self.duration = duration
+        self.content = content
+        self.size, self.fps = _video_format(info)
+        # Without stream details, assume there is audio to make room for
+        streams = info.get("streams", [])
+        self.has_audio = not streams or any(s.get("codec_type") == "audio" for s in streams)
+        self.measured = passlogs.complexity(content)
+
+    def plan(self, target_size: int) -> tuple[int, str | None]:
+        """Video bitrate (kbps) and filter chain (None: the source's
+        size and rate) for an output of target_size bytes."""
+        bitrate_kbps = _video_bitrate_kbps(self.duration, target_size, self.has_audio)
+        if self.size is None:
+            return bitrate_kbps, None
+        rungs = self._rungs()
+        budget = bitrate_kbps * 1000
+        if len(rungs) == 1 or budget / _pixel_rate(rungs[0]) >= GENEROUS_BITS_PER_PIXEL:
+            return bitrate_kbps, None
+
+        with span("video.plan"):
+            if not self._sampled(rungs[0]):
+                return bitrate_kbps, None
+            for _ in range(MAX_PLAN_SAMPLES - 1):
+                rung = self._choose(rungs, budget)
+                if _key(rung) in self.measured or not self._sampled(rung):
+                    break
+        return bitrate_kbps, _filter_chain(self._choose(rungs, budget), rungs[0])
+
+    def _rungs(self) -> list[tuple[int, int, float]]:
+        width, height = self.size
+        short = min(width, height)
+        rates = [self.fps] + [fps for fps in PLAN_FRAME_RATES if fps < self.fps - 0.5]
+        rungs = [(width, height, rate) for rate in rates]
+        for side in PLAN_SHORT_SIDES:
+            if side < short:
+                scale = side / short
+                scaled = (_even(width * scale), _even(height * scale))
+                rungs += [(*scaled, rate) for rate in rates]
+        return sorted(rungs, key=_pixel_rate, reverse=True)
+
+    def _choose(self, rungs: list, budget: float) -> tuple[int, int, float]:
+        """The first rung predicted to look acceptable (else the smallest)."""
+        for rung in rungs:
+            if self._crf(rung, budget) <= ACCEPTABLE_CRF:
+                return rung
+        return rungs[-1]
+
+    def _crf(self, rung: tuple, budget: float) -> float:
+        needed = self._bits_per_pixel(rung) * _pixel_rate(rung)
+        return SAMPLE_CRF + CRF_HALVING * math.log2(needed / budget)
+
+    def _bits_per_pixel(self, rung: tuple) -> float:
+        if _key(rung) in self.measured:
+            return self.measured[_key(rung)]
+        nearest = min(
+            (_parse_key(key) for key in self.measured),
+            key=lambda sampled: abs(math.log(_pixel_rate(sampled) / _pixel_rate(rung))),
+        )
+        ratio = _pixel_rate(rung) / _pixel_rate(nearest)
+        return self.measured[_key(nearest)] * ratio ** (PIXEL_RATE_EXPONENT - 1)
+
+    def _sampled(self, rung: tuple) -> bool:
+        """Sample-encode the rung and record its complexity (False if
+        FFmpeg failed)."""
+        if _key(rung) in self.measured:
+            return True
+        starts, clip_seconds = sample_clips(self.duration)
+        cmd = [get_ffmpeg(), "-y"]
+        for start in starts:
+            cmd += ["-ss", f"{start:.2f}", "-t", str(clip_seconds), "-i", self.path]
+        inputs = "".join(f"[{k}:v]" for k in range(len(starts)))
+        chain = _filter_chain(rung, (*self.size, self.fps)) or "null"
+        out_fd, out_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp4")
+        os.close(out_fd)
+        try:
+            cmd += [
+                "-filter_complex", f"{inputs}concat=n={len(starts)}:v=1:a=0,{chain}[v]",
+                "-map", "[v]", "-an",
+                "-c:v", "libx264", "-preset", SAMPLE_PRESET, "-crf", str(SAMPLE_CRF),
+                out_path,
+            ]
+            result = run_ffmpeg(cmd, timeout=120)
+            if result.returncode != 0:
+                return False
+            bits = os.path.getsize(out_path) * 8
+        except subprocess.TimeoutExpired:
+            return False
+        finally:
+            os.unlink(out_path)
+
+        pixels = _pixel_rate(rung) * len(starts) * clip_seconds
+        self.measured[_key(rung)] = bits / pixels
+        passlogs.save_complexity(self.content, self.measured)
+        return True
+
+
+def _video_format(info: dict) -> tuple[tuple[int, int] | None, float]:
+    """Displayed frame size (None if unknown) and frame rate of the
+    first video stream."""
+    from fractions import Fraction
+
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") != "video":
+            continue
+        try:
+            fps = float(Fraction(stream.get("r_frame_rate") or "0"))
+        except (ValueError, ZeroDivisionError):
+            fps = 0
+        fps = fps if 0 < fps <= 240 else DEFAULT_FRAME_RATE
+        width, height = stream.get("width"), stream.get("height")
+        if not width or not height:
+            return None, fps
+        # Rotated videos (phones) are displayed, and scaled, turned
+        rotation = stream.get("tags", {}).get("rotate") or next(
+            (data["rotation"] for data in stream.get("side_data_list", []) if "rotation" in data),
+            0,
+        )
+        if round(float(rotation)) % 180 == 90:
+            width, height = height, width
+        return (width, height), fps
+    return None, DEFAULT_FRAME_RATE
+
+
+def _filter_chain(rung: tuple, source: tuple) -> str | None:
+    """FFmpeg filters turning the source's frames into the rung's (None
+    if they are the same)."""
+    width, height, fps = rung
+    filters = []
+    if fps != source[2]:
+        filters.append(f"fps={fps:g}")
+    if (width, height) != source[:2]:
+        filters.append(f"scale={width}:{height}")
+    return ",".join(filters) or None
+
+
+def _pixel_rate(rung: tuple) -> float:
+    width, height, fps = rung
+    return width * height * fps
+
+
+def _even(value: float) -> int:
+    # H.264 with 4:2:0 chroma needs even dimensions
+    return max(2, int(round(value / 2)) * 2)
+
+
+def _key(rung: tuple) -> str:
+    width, height, fps = rung
+    return f"{width}x{height}@{fps:g}"
+
+
+def _parse_key(key: str) -> tuple[int, int, float]:
+    size, fps = key.split("@")
+    width, height = size.split("x")
+    return int(width), int(height), float(fps)
+
+
+def compress_video_ladder(data: bytes, mime: str, target_sizes: list[int]) -> list[dict]:
+    """Compress video data to several target sizes at once.
+
+    Each pass is one FFmpeg process whose decoded frames are split
+    between all of its outputs: pass 1 has one output per distinct
+    resolution without cached statistics, pass 2 one per target, reading
+    the pass-1 log of its resolution. The source is decoded at most
+    twice however many targets there are.
+
+    Returns:
+        One result dict per target, in the order of target_sizes.
+    """
+    original_size = len(data)
+    results = [{"data": data, "size": original_size, "skipped": True}
+               for _ in target_sizes]
+    pending = [i for i, target in enumerate(target_sizes) if original_size > target]
+    if not pending:
+        return results
+
+    content = passlogs.content_key(data)
+    info = passlogs.probe(data, content)
+    duration = float(info["format"].get("duration", 0)) if info else 0
+    if duration <= 0:
+        message = "Could not probe video file" if info is None else "Could not determine video duration"
+        for i in pending:
+            results[i]["message"] = message
+        return results
+
+    ext = registry.extension_for(mime)
+    in_fd, in_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=ext)
+    out_paths = {}
+    # FFmpeg names -passlogfile logs after the output's stream index,
+    # which differs between the passes here; the logs are named directly
+    # instead, relative to the directory FFmpeg runs in (x264-params
+    # cannot hold a drive letter's colon)
+    passlog_dir = tempfile.mkdtemp(prefix=f"{TEMP_PREFIX}2pass-")
+
+    try:
+        os.write(in_fd, data)
+        os.close(in_fd)
+
+        planner = _Planner(in_path, info, duration, content)
+        plans = {i: planner.plan(target_sizes[i]) for i in pending}
+        # Outputs sharing a filter chain share a pass-1 log
+        scales = list(dict.fromkeys(scale for _, scale in plans.values()))
+        stats = [f"passlog{g}.log" for g in range(len(scales))]
+        for i in pending:
+            out_fd, out_paths[i] = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=".mp4")
+            os.close(out_fd)
+
+        # Pass 1 for resolutions without cached statistics, at the middle
+        # bitrate of each one's targets
+        missing = [g for g, scale in enumerate(scales)
+                   if not passlogs.fetch(content, scale, os.path.join(passlog_dir, stats[g]))]
+        if missing:
+            cmd_pass1 = [get_ffmpeg(), "-y", "-i", in_path,
+                         "-filter_complex", _split_graph([scales[g] for g in missing])]
+            outputs1 = []
+            for k, g in enumerate(missing):
+                rates = sorted(plans[i][0] for i in pending if plans[i][1] == scales[g])
+                cmd_pass1 += [
+                    "-map", f"[out{k}]",
+                    "-c:v", "libx264", "-preset", "medium",
+                    "-b:v", f"{rates[len(rates) // 2]}k",
+                    "-pass", "1",
+                    "-x264-params", f"stats={stats[g]}",
+                    "-an",
+                    "-f", "null",
+                    os.devnull,
+                ]
+                outputs1.append(len(cmd_pass1) - 1)
+            with span("video.pass1"):
+                result1 = run_ffmpeg(cmd_pass1, timeout=300, cwd=passlog_dir, outputs=outputs1)
+            if result1.returncode != 0:
+                for i in pending:
+                    results[i]["message"] = "FFmpeg pass 1 failed"
+                return results
+            for g in missing:
+                passlogs.save(content, scales[g], os.path.join(passlog_dir, stats[g]))
+
+        # Pass 2: every target
+        cmd_pass2 = [get_ffmpeg(), "-y", "-i", in_path,
+                     "-filter_complex", _split_graph([plans[i][1] for i in pending])]
+        outputs2 = []
+        for k, i in enumerate(pending):
+            bitrate_kbps, scale = plans[i]
+            cmd_pass2 += [
+                "-map", f"[out{k}]", "-map", "0:a:0?",
+                "-c:v", "libx264", "-preset", "medium",
+                "-b:v", f"{bitrate_kbps}k",
+                "-pass", "2",
+                "-x264-params", f"stats={stats[scales.index(scale)]}",
+                "-c:a", "aac", "-b:a", f"{AUDIO_BITRATE_KBPS}k",
+                out_paths[i],
+            ]
+            outputs2.append(len(cmd_pass2) - 1)
+        with span("video.pass2"):
+            result2 = run_ffmpeg(cmd_pass2, timeout=300 * len(pending), cwd=passlog_dir,
+                                 outputs=outputs2)
+        if result2.returncode != 0:
+            for i in pending:
+                results[i]["message"] = "FFmpeg pass 2 failed"
+            return results
+
+        for i in pending:
+            with open(out_paths[i], "rb") as f:
+                compressed = f.read()
+            results[i] = {
+                "data": compressed,
+                "size": len(compressed),
+                "skipped": False,
+                "output_mime": "video/mp4",
+                "output_ext": ".mp4",
+                "iterations": 2 if missing else 1,
+            }
+        return results
+    except subprocess.TimeoutExpired:
+        for i in pending:
+            results[i]["message"] = "Video compression timed out"
+        return results
+    finally:
+        for p in (in_path, *out_paths.values()):
+            if os.path.exists(p):
+                os.unlink(p)
+        shutil.rmtree(passlog_dir, ignore_errors=True)
+
+
+def _split_graph(scales: list[str | None]) -> str:
+    """Filter graph splitting the first video stream into [out0],
+    [out1], ..., each through its filter chain (None: unchanged)."""
+    branches = "".join(f"[in{k}]" for k in range(len(scales)))
+    graph = [f"[0:v]split={len(scales)}{branches}"]
+    graph += [f"[in{k}]{scale or 'null'}[out{k}]" for k, scale in enumerate(scales)]
+    return ";".join(graph)
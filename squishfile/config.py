@@ -0,0 +1,37 @@
+"""Runtime settings read from SQUISHFILE_* environment variables.
+
+Values are read on every call rather than cached at import time, so a
+setting can be changed per process (or per test) without reloading
+modules.
+"""
+import os
+
+# Prefix of every temporary file and directory the engines create, so
+# that leftovers of a crashed process can be recognized and swept
+TEMP_PREFIX = "squishfile-"
+
+
+def env_str(name: str, default: str = "") -> str:
+    return os.environ.get(name, default)
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def env_int(name: str, default: int = 0) -> int:
+    value = os.environ.get(name)
+    try:
+        return int(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+
+def env_list(name: str, default: list[str] | None = None) -> list[str]:
+    value = os.environ.get(name)
+    if value is None:
+        return list(default or [])
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -2,31 +2,14 @@
 
 import magic
 
-SUPPORTED_IMAGES = {
-    "image/jpeg": ".jpg",
-    "image/png": ".png",
-    "image/webp": ".webp",
-    "image/gif": ".gif",
-    "image/svg+xml": ".svg",
-}
+from squishfile.compressor import registry
+from squishfile.metrics import span
 
-SUPPORTED_PDFS = {
-    "application/pdf": ".pdf",
-}
-
-SUPPORTED_VIDEOS = {
-    "video/mp4": ".mp4",
-    "video/webm": ".webm",
-    "video/quicktime": ".mov",
-}
-
-SUPPORTED_AUDIO = {
-    "audio/mpeg": ".mp3",
-    "audio/wav": ".wav",
-    "audio/x-wav": ".wav",
-}
-
-SUPPORTED = {**SUPPORTED_IMAGES, **SUPPORTED_PDFS, **SUPPORTED_VIDEOS, **SUPPORTED_AUDIO}
+# MIME type -> extension, per category (see compressor.registry)
+SUPPORTED_IMAGES = registry.supported_mimes("image")
+SUPPORTED_PDFS = registry.supported_mimes("pdf")
+SUPPORTED_VIDEOS = registry.supported_mimes("video")
+SUPPORTED_AUDIO = registry.supported_mimes("audio")
 
 
 def detect_file_type(data: bytes, filename: str) -> dict:
@@ -39,20 +22,12 @@ def detect_file_type(data: bytes, filename: str) -> dict:
     Returns:
         Dict with keys: mime, category, extension, original_filename, size.
     """
-    mime = magic.from_buffer(data, mime=True)
-
-    if mime in SUPPORTED_IMAGES:
-        category = "image"
-    elif mime in SUPPORTED_PDFS:
-        category = "pdf"
-    elif mime in SUPPORTED_VIDEOS:
-        category = "video"
-    elif mime in SUPPORTED_AUDIO:
-        category = "audio"
-    else:
-        category = "unsupported"
-
-    extension = SUPPORTED.get(mime, "")
+    with span("detect"):
+        mime = magic.from_buffer(data, mime=True)
+
+    spec = registry.for_mime(mime)
+    category = spec.category if spec else "unsupported"
+    extension = spec.mimes[mime] if spec else ""
 
     return {
         "mime": mime,
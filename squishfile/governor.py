@@ -0,0 +1,113 @@
+"""CPU budgeting for concurrent compression jobs.
+
+Encoders default to one thread per core, so a few jobs at once would
+each start as many threads as the machine has cores. The governor counts
+the jobs this server is running (`job_running`, entered by
+`workers.run_compress`) and gives each a share of the cores
+(`thread_budget`): FFmpeg gets it as -threads/-filter_threads, and AVIF
+encodes as max_threads. Jobs on the threadpool read the budget live, so
+each FFmpeg invocation gets the share at the time it starts; jobs sent
+to a worker process carry the budget computed when they were dispatched.
+
+SQUISHFILE_CPUS overrides the number of cores (default: the CPUs this
+process may run on), and SQUISHFILE_FFMPEG_NICE lowers FFmpeg's
+scheduling priority so encodes yield to request handling.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from squishfile import metrics
+from squishfile.config import env_int
+
+# Thread pools of native libraries, pinned to one thread in worker
+# processes: the governor decides the parallelism, not each library
+NATIVE_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+_lock = threading.Lock()
+_active = 0
+_local = threading.local()
+
+
+def cpu_count() -> int:
+    configured = env_int("SQUISHFILE_CPUS", 0)
+    if configured > 0:
+        return configured
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def active_jobs() -> int:
+    return _active
+
+
+@contextmanager
+def job_running():
+    """Count a job as running for as long as the block lasts."""
+    global _active
+    with _lock:
+        _active += 1
+        _publish()
+    try:
+        yield
+    finally:
+        with _lock:
+            _active -= 1
+            _publish()
+
+
+def _publish() -> None:
+    metrics.set_gauge("squishfile_cpu_cores", cpu_count())
+    metrics.set_gauge("squishfile_active_jobs", _active)
+    metrics.set_gauge("squishfile_job_threads", max(1, cpu_count() // max(1, _active)))
+
+
+def thread_budget(concurrency: int | None = None) -> int:
+    """Threads one encoder of the current job may use.
+
+    `concurrency` caps the jobs assumed to run at once (e.g. a worker
+    pool's size, when more jobs than that are waiting for it).
+    """
+    assigned = getattr(_local, "threads", None)
+    if assigned is not None:
+        return assigned
+    jobs = max(1, _active)
+    if concurrency:
+        jobs = min(jobs, concurrency)
+    return max(1, cpu_count() // jobs)
+
+
+@contextmanager
+def job_threads(threads: int | None):
+    """Fix this thread's budget to `threads` (None: follow the live share)."""
+    previous = getattr(_local, "threads", None)
+    _local.threads = threads
+    try:
+        yield
+    finally:
+        _local.threads = previous
+
+
+def ffmpeg_command(cmd: list[str], outputs: list[int] | None = None) -> list[str]:
+    """`cmd` with the current budget applied to decoding (every input),
+    filtering and encoding (every output: the items of `cmd` at the
+    positions `outputs`, by default its last item)."""
+    threads = str(thread_budget())
+    outputs = set(outputs or (len(cmd) - 1,))
+    budgeted = [cmd[0], "-filter_threads", threads]
+    for k, arg in enumerate(cmd[1:], 1):
+        if arg == "-i" or k in outputs:
+            budgeted += ["-threads", threads]
+        budgeted.append(arg)
+    return budgeted
+
+
+def ffmpeg_niceness() -> int:
+    return env_int("SQUISHFILE_FFMPEG_NICE", 0)
+
+
+def limit_native_threads() -> None:
+    """Pin native thread pools to one thread (call before importing NumPy)."""
+    for name in NATIVE_THREAD_VARS:
+        os.environ.setdefault(name, "1")
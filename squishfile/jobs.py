@@ -0,0 +1,331 @@
+"""Compression jobs: running them, journaling them and recovering them.
+
+With SQUISHFILE_STORE_DIR set, every job is recorded in a `jobs` table
+next to the store's index: its parameters, its state (queued, running,
+done, failed or cancelled) and the server process that owns it.
+Owners refresh their jobs' heartbeat every HEARTBEAT_SECONDS. Any
+process (a restarted one, or a surviving peer during a rolling deploy)
+re-runs unfinished jobs whose owner has stopped beating; finished
+outputs are in the store and stay downloadable across restarts. An
+interrupted encode restarts from the beginning, since FFmpeg's two-pass
+state cannot be resumed, though a video whose first pass had finished
+skips it (see compressor.passlogs).
+
+On startup, temporary files and directories older than TEMP_MAX_AGE
+that crashed processes left behind are swept, as are abandoned resumable
+uploads and store blobs no entry refers to.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from squishfile import cancel, uploads
+from squishfile.config import TEMP_PREFIX, env_str
+from squishfile.scheduler import estimate_cost, get_scheduler
+from squishfile.store import DiskStore, get_store
+from squishfile.workers import run_compress
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+UNFINISHED = (JOB_QUEUED, JOB_RUNNING)
+
+# An owner that has not refreshed its jobs for ORPHAN_BEATS heartbeats
+# is presumed dead
+HEARTBEAT_SECONDS = 10
+ORPHAN_BEATS = 3
+
+# Temporary files are swept once no live encode can still be using them:
+# the longest video search (every scale step, two passes each) stays well
+# under this.
+TEMP_MAX_AGE = 3 * 3600
+# Temporary directory prefixes swept, including the one older versions used
+_TEMP_PREFIXES = (TEMP_PREFIX, "ffmpeg2pass_")
+
+# Scheduler client that recovered jobs run as
+RECOVERED_CLIENT = "recovered"
+
+# Entry keys a single-target job writes
+OUTPUT_FIELDS = (
+    "compressed_data", "compressed_path", "compressed_size", "output_ext", "output_mime",
+)
+
+# Identifies this server process in the journal
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Journal:
+    """Job records in an SQLite database shared by every server process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (file_id TEXT PRIMARY KEY, "
+                "params TEXT NOT NULL, state TEXT NOT NULL, owner TEXT, "
+                "message TEXT, heartbeat REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def submit(self, file_id: str, params: dict, owner: str = OWNER) -> None:
+        """Record a new job for `file_id`, replacing any earlier one."""
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, ?)",
+                (file_id, json.dumps(params), JOB_QUEUED, owner, time.time()),
+            )
+
+    def set_state(self, file_id: str, state: str, message: str | None = None) -> None:
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, message = ?, heartbeat = ? WHERE file_id = ?",
+                (state, message, time.time(), file_id),
+            )
+
+    def get(self, file_id: str) -> dict | None:
+        row = self._connect().execute(
+            "SELECT file_id, params, state, owner, message, heartbeat "
+            "FROM jobs WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        return _job(row) if row else None
+
+    def heartbeat(self, owner: str = OWNER) -> None:
+        """Mark the unfinished jobs of `owner` as still alive."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND state IN (?, ?)",
+                (time.time(), owner, *UNFINISHED),
+            )
+
+    def claim_orphans(self, owner: str = OWNER, now: float | None = None) -> list[dict]:
+        """Take over unfinished jobs whose owner stopped beating.
+
+        Each job is claimed with a compare-and-swap on its previous owner,
+        so of several processes recovering at once only one gets it.
+        """
+        now = time.time() if now is None else now
+        stale = now - HEARTBEAT_SECONDS * ORPHAN_BEATS
+        db = self._connect()
+        rows = db.execute(
+            "SELECT file_id, params, state, owner, message, heartbeat FROM jobs "
+            "WHERE state IN (?, ?) AND heartbeat < ? AND owner != ?",
+            (*UNFINISHED, stale, owner),
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            with db:
+                cursor = db.execute(
+                    "UPDATE jobs SET owner = ?, state = ?, heartbeat = ? "
+                    "WHERE file_id = ? AND owner = ? AND heartbeat < ?",
+                    (owner, JOB_QUEUED, now, row[0], row[3], stale),
+                )
+            if cursor.rowcount:
+                claimed.append(_job(row))
+        return claimed
+
+
+def _job(row) -> dict:
+    file_id, params, state, owner, message, heartbeat = row
+    return {"file_id": file_id, "params": json.loads(params), "state": state,
+            "owner": owner, "message": message, "heartbeat": heartbeat}
+
+
+_journals: dict[str, Journal] = {}
+
+
+def get_journal() -> Journal | None:
+    """The journal of the SQUISHFILE_STORE_DIR store (None if unset)."""
+    root = env_str("SQUISHFILE_STORE_DIR")
+    if not root:
+        return None
+    journal = _journals.get(root)
+    if journal is None:
+        get_store()  # Creates the directory
+        journal = _journals[root] = Journal(os.path.join(root, "index.sqlite3"))
+    return journal
+
+
+async def run(entry: dict, params: dict, client: str | None = None) -> dict:
+    """Compress an entry's upload with `params` and store the output.
+
+    `params` are compress_file's keyword arguments other than data, or
+    compress_ladder's (with target_sizes), whose outputs are stored as
+    the entry's variants. The job waits for its turn in the scheduler
+    as `client`'s; it raises scheduler.Rejected if the client has too
+    much work queued or the server is too busy. Recovered jobs (no
+    client) are never refused.
+    """
+    store = get_store()
+    journal = get_journal()
+    scheduler = get_scheduler()
+    ticket = scheduler.submit(
+        client or RECOVERED_CLIENT, estimate_cost(entry, params), enforce=client is not None
+    )
+
+    # A disk-backed upload is read by the worker itself
+    source = {"data": entry["data"]} if "data" in entry else {"data_path": entry["path"]}
+    compression = None
+    try:
+        if journal is not None:
+            journal.submit(entry["id"], params)
+        cancel.clear(entry["id"])
+        await scheduler.wait(ticket)
+        if journal is not None:
+            journal.set_state(entry["id"], JOB_RUNNING)
+        # Shielded: the worker stops on the job's cancel flag, not when
+        # this task is cancelled
+        compression = asyncio.ensure_future(
+            run_compress(**source, **params, job_id=entry["id"])
+        )
+        result = await asyncio.shield(compression)
+    except cancel.JobCancelled:
+        cancel.clear(entry["id"])
+        if journal is not None:
+            journal.set_state(entry["id"], JOB_CANCELLED)
+        raise
+    except asyncio.CancelledError:
+        if cancel.is_cancelled(entry["id"]):
+            # Abandoned by its client: the flag stops the worker, and is
+            # dropped once it has
+            if journal is not None:
+                journal.set_state(entry["id"], JOB_CANCELLED)
+            if compression is None:
+                cancel.clear(entry["id"])
+            else:
+                compression.add_done_callback(_clear_when_stopped(entry["id"]))
+        elif compression is not None:
+            # The server is shutting down: the job stays unfinished, to be
+            # recovered by the next process
+            compression.cancel()
+        raise
+    except Exception as exc:
+        if journal is not None:
+            journal.set_state(entry["id"], JOB_FAILED, str(exc))
+        raise
+    finally:
+        scheduler.release(ticket)
+
+    # Only the output's keys are saved: a size curve precomputed while
+    # the job ran was stored meanwhile, and a whole entry would drop it
+    if "variants" in result:
+        store.set_variants(entry, params["target_sizes"], result["variants"])
+        store.save_fields(entry, ("variants",))
+    else:
+        store.set_output(entry, result)
+        entry["compressed_size"] = result["size"]
+
+        # The output's format, if it changed (e.g. webm -> mp4); the
+        # entry's own mime and filename stay the upload's
+        if "output_ext" in result and not result.get("skipped"):
+            entry["output_ext"] = result["output_ext"]
+            entry["output_mime"] = result["output_mime"]
+        else:
+            entry.pop("output_ext", None)
+            entry.pop("output_mime", None)
+        store.save_fields(entry, OUTPUT_FIELDS)
+
+    if journal is not None:
+        journal.set_state(entry["id"], JOB_DONE, result.get("message"))
+    return result
+
+
+def _clear_when_stopped(job_id: str):
+    """Done-callback of an abandoned job's compression."""
+    def stopped(compression: asyncio.Future) -> None:
+        if not compression.cancelled():
+            compression.exception()  # Nobody awaits its JobCancelled
+        cancel.clear(job_id)
+    return stopped
+
+
+async def _recover(journal: Journal) -> list[asyncio.Task]:
+    """Start re-running orphaned jobs; returns their tasks."""
+    store = get_store()
+    tasks = []
+    for job in await asyncio.to_thread(journal.claim_orphans):
+        entry = store.get(job["file_id"])
+        if entry is None:
+            journal.set_state(job["file_id"], JOB_FAILED, "Upload no longer stored")
+            continue
+        logger.info("Resuming compression of %s", job["file_id"])
+        tasks.append(asyncio.create_task(_resume(entry, job["params"])))
+    return tasks
+
+
+async def _resume(entry: dict, params: dict) -> None:
+    try:
+        await run(entry, params)
+    except Exception:
+        logger.warning("Resumed compression of %s failed", entry["id"], exc_info=True)
+
+
+async def maintain() -> None:
+    """Sweep leftovers, then keep this process's jobs alive and pick up
+    orphaned ones (runs for the server's lifetime)."""
+    await asyncio.to_thread(sweep_temp_files)
+    journal = get_journal()
+    if journal is None:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(journal.heartbeat)
+            await _recover(journal)
+        except sqlite3.Error:
+            logger.warning("Job journal unavailable", exc_info=True)
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+
+def sweep_temp_files(max_age: float = TEMP_MAX_AGE) -> int:
+    """Delete stale temporary files and unreferenced store blobs.
+
+    Returns the number of paths removed.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    # Resumable uploads live in the temporary directory or the store's
+    for directory in {tempfile.gettempdir(), uploads.upload_dir()}:
+        for name in os.listdir(directory):
+            if name.startswith(_TEMP_PREFIXES):
+                removed += _remove_if_older(os.path.join(directory, name), cutoff)
+    store = get_store()
+    if isinstance(store, DiskStore):
+        referenced = store.blob_paths()
+        for name in os.listdir(store.blob_dir):
+            path = os.path.join(store.blob_dir, name)
+            if path not in referenced:
+                removed += _remove_if_older(path, cutoff)
+    if removed:
+        logger.info("Swept %d stale temporary file(s)", removed)
+    return removed
+
+
+def _remove_if_older(path: str, cutoff: float) -> int:
+    try:
+        if os.lstat(path).st_mtime >= cutoff:
+            return 0
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.unlink(path)
+        return 1
+    except FileNotFoundError:
+        return 0
@@ -1,24 +1,49 @@
+import asyncio
 import os
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from squishfile import __version__
+from squishfile.metrics import render_prometheus
 from squishfile.routes.upload import router as upload_router
 from squishfile.routes.compress import router as compress_router
 from squishfile.compressor.ffmpeg_utils import check_ffmpeg
+from squishfile import jobs, precompute, workers
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="SquishFile", version=__version__)
 
-if not check_ffmpeg():
-    logger.warning(
-        "FFmpeg not available. Video and audio compression will not work. "
-        "Try reinstalling: pip install imageio-ffmpeg"
-    )
+async def _check_ffmpeg_in_background(app: FastAPI) -> None:
+    app.state.ffmpeg_available = await asyncio.to_thread(check_ffmpeg)
+    if not app.state.ffmpeg_available:
+        logger.warning(
+            "FFmpeg not available. Video and audio compression will not work. "
+            "Try reinstalling: pip install imageio-ffmpeg"
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here may block: health checks must be answered right away.
+    app.state.ffmpeg_available = None
+    ffmpeg_check = asyncio.create_task(_check_ffmpeg_in_background(app))
+    workers.start()
+    # Sweeps temp files, then recovers jobs interrupted by a restart
+    maintenance = asyncio.create_task(jobs.maintain())
+    # Size curves of new uploads, computed while the server is idle
+    precomputation = asyncio.create_task(precompute.run())
+    yield
+    ffmpeg_check.cancel()
+    maintenance.cancel()
+    precomputation.cancel()
+    workers.shutdown()
+
+
+app = FastAPI(title="SquishFile", version=__version__, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +62,13 @@ async def health_check():
     return {"status": "ok", "version": __version__}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 FRONTEND_DIR = os.path.join(os.path.dirname(__file__), "frontend", "dist")
 
 if os.path.exists(FRONTEND_DIR):
@@ -0,0 +1,243 @@
+"""Lightweight per-stage tracing and Prometheus metrics for SquishFile.
+
+Stages are timed with the `span` context manager and aggregated into
+in-process counters and histograms, which `render_prometheus` exposes in
+the Prometheus text format (served at /api/metrics). Setting the
+SQUISHFILE_TRACE_LOG environment variable to 1 also emits every finished
+span as a structured JSON log line on the "squishfile.trace" logger.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from squishfile.config import env_bool
+
+trace_logger = logging.getLogger("squishfile.trace")
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50)
+SSIM_BUCKETS = (0.5, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.97, 0.98, 0.99, 0.995, 1.0)
+PSNR_BUCKETS = (20, 25, 28, 30, 32, 35, 38, 40, 45, 50, 60, 100)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "squishfile_stage_duration_seconds": (
+        "histogram", "Time spent in each processing stage.", DURATION_BUCKETS,
+    ),
+    "squishfile_queue_wait_seconds": (
+        "histogram", "Time a compression job waited before a worker picked it up.",
+        DURATION_BUCKETS,
+    ),
+    "squishfile_encode_iterations": (
+        "histogram", "Full encodes performed per compression.", ITERATION_BUCKETS,
+    ),
+    "squishfile_compressions_total": (
+        "counter", "Compressions handled, by category and outcome.", None,
+    ),
+    "squishfile_bytes_in_total": (
+        "counter", "Bytes received by the compression engine.", None,
+    ),
+    "squishfile_bytes_out_total": (
+        "counter", "Bytes produced by the compression engine.", None,
+    ),
+    "squishfile_output_ssim": (
+        "histogram", "SSIM of compressed outputs against their originals.", SSIM_BUCKETS,
+    ),
+    "squishfile_output_psnr_db": (
+        "histogram", "PSNR (dB) of compressed outputs against their originals.", PSNR_BUCKETS,
+    ),
+    "squishfile_cpu_cores": (
+        "gauge", "Cores the governor shares between compression jobs.", None,
+    ),
+    "squishfile_active_jobs": (
+        "gauge", "Compression jobs currently running.", None,
+    ),
+    "squishfile_job_threads": (
+        "gauge", "Encoder threads each running job may use.", None,
+    ),
+    "squishfile_jobs_waiting": (
+        "gauge", "Compression jobs waiting for their turn in the scheduler.", None,
+    ),
+    "squishfile_jobs_scheduled": (
+        "gauge", "Compression jobs the scheduler has let run.", None,
+    ),
+    "squishfile_queued_cpu_seconds": (
+        "gauge", "Estimated CPU-seconds of the jobs waiting in the scheduler.", None,
+    ),
+    "squishfile_jobs_rejected_total": (
+        "counter", "Compression jobs refused by admission control, by reason.", None,
+    ),
+}
+
+_lock = threading.Lock()
+# (name, sorted label items) -> float for counters and gauges,
+# [bucket counts..., sum, count] for histograms
+_values: dict[tuple, object] = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    if name not in METRICS:
+        raise KeyError(f"Unknown metric: {name}")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Increment a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to its current value."""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Record one observation into a histogram."""
+    key = _key(name, labels)
+    buckets = METRICS[name][2]
+    with _lock:
+        hist = _values.get(key)
+        if hist is None:
+            hist = _values[key] = [0] * len(buckets) + [0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+def _trace_log_enabled() -> bool:
+    return env_bool("SQUISHFILE_TRACE_LOG")
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time a processing stage.
+
+    Yields a dict the caller may fill with extra attributes (e.g. bytes
+    out); they are included in the structured log line but not used as
+    metric labels, to keep label cardinality bounded.
+    """
+    attrs: dict = {}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("squishfile_stage_duration_seconds", elapsed, stage=stage, **labels)
+        if _trace_log_enabled():
+            record = {"span": stage, "duration_ms": round(elapsed * 1000, 3), **labels, **attrs}
+            if error:
+                record["error"] = error
+            trace_logger.info(json.dumps(record, default=str))
+
+
+def traced(stage: str, **labels):
+    """Decorator form of `span` for functions that are a stage on their own."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_compression(category: str, bytes_in: int, result: dict) -> None:
+    """Account one finished compression: outcome, bytes and encode count."""
+    outcome = "skipped" if result.get("skipped") else "compressed"
+    inc("squishfile_compressions_total", category=category, outcome=outcome)
+    inc("squishfile_bytes_in_total", bytes_in, category=category)
+    inc("squishfile_bytes_out_total", result.get("size", 0), category=category)
+    if not result.get("skipped"):
+        observe("squishfile_encode_iterations", result.get("iterations", 0), category=category)
+    if result.get("ssim") is not None:
+        observe("squishfile_output_ssim", result["ssim"], category=category)
+    if result.get("psnr") is not None:
+        observe("squishfile_output_psnr_db", result["psnr"], category=category)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        snapshot = {k: (list(v) if isinstance(v, list) else v) for k, v in _values.items()}
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(
+            ((k[1], v) for k, v in snapshot.items() if k[0] == name), key=lambda s: s[0],
+        )
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind in ("counter", "gauge"):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for bound, count in zip(buckets, value):
+                le = (("le", _format_value(float(bound))),)
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {count}")
+            lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {value[-1]}')
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def drain() -> dict:
+    """Return and clear all recorded values.
+
+    Worker processes call this after each job so the parent can `merge`
+    their observations into the registry it serves at /api/metrics.
+    """
+    with _lock:
+        values = dict(_values)
+        _values.clear()
+    return values
+
+
+def merge(values: dict) -> None:
+    """Add values produced by `drain` in another process."""
+    with _lock:
+        for key, value in values.items():
+            current = _values.get(key)
+            if current is None or METRICS[key[0]][0] == "gauge":
+                _values[key] = value
+            elif isinstance(value, list):
+                _values[key] = [a + b for a, b in zip(current, value)]
+            else:
+                _values[key] = current + value
+
+
+def reset() -> None:
+    """Clear all recorded values (used by tests)."""
+    with _lock:
+        _values.clear()
@@ -0,0 +1,93 @@
+"""Speculative size curves, computed in the background after upload.
+
+With SQUISHFILE_PRECOMPUTE=1, every upload that has a curve (JPEG/WebP
+images and videos, see `compressor.curves`) is queued for one as soon as
+it is stored. The curve is kept in the entry as "size_curve";
+/api/compress hands it to the engine, whose search then starts at the
+right quality, and /api/estimate uses it to predict the result before
+anything is compressed.
+
+Curves are low priority: one upload at a time, on one thread, started
+only while the scheduler has a free slot and no job waiting for one.
+Their FFmpeg sample encodes get SQUISHFILE_FFMPEG_NICE like any other.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+from collections import deque
+
+from squishfile import governor
+from squishfile.compressor import curves
+from squishfile.config import TEMP_PREFIX, env_bool
+from squishfile.scheduler import get_scheduler
+from squishfile.store import get_store
+
+logger = logging.getLogger(__name__)
+
+# How often the background task looks for idle time
+IDLE_POLL_SECONDS = 0.5
+
+# Uploads beyond this many waiting for a curve get none
+MAX_PENDING = 100
+
+_pending: deque[str] = deque()
+
+
+def enabled() -> bool:
+    return env_bool("SQUISHFILE_PRECOMPUTE", False)
+
+
+def submit(entry: dict) -> None:
+    """Queue a stored upload for its curve (if enabled and it can have one)."""
+    if not enabled() or entry["category"] not in ("image", "video"):
+        return
+    if len(_pending) < MAX_PENDING:
+        _pending.append(entry["id"])
+
+
+async def run() -> None:
+    """Compute queued curves while the server is idle (runs for the
+    server's lifetime)."""
+    while True:
+        if not _pending or not get_scheduler().idle():
+            await asyncio.sleep(IDLE_POLL_SECONDS)
+            continue
+        file_id = _pending.popleft()
+        try:
+            await asyncio.to_thread(precompute, file_id)
+        except Exception:
+            logger.warning("Could not precompute a size curve for %s", file_id, exc_info=True)
+
+
+def precompute(file_id: str) -> dict | None:
+    """Compute and store the upload's curve; returns it (None if n/a)."""
+    store = get_store()
+    entry = store.get(file_id)
+    if entry is None or "size_curve" in entry:
+        return None
+    with governor.job_threads(1):
+        curve = _curve(entry)
+    if curve is not None:
+        store.set_field(file_id, "size_curve", curve)
+    return curve
+
+
+def _curve(entry: dict) -> dict | None:
+    if entry["category"] == "image":
+        data = entry.get("data")
+        if data is None:
+            with open(entry["path"], "rb") as f:
+                data = f.read()
+        return curves.image_curve(data, entry["mime"])
+
+    duration = entry.get("duration") or 0
+    if "path" in entry:
+        return curves.video_curve(entry["path"], duration)
+    fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(entry["data"])
+        return curves.video_curve(path, duration)
+    finally:
+        os.unlink(path)
@@ -1,81 +1,276 @@
 # squishfile/routes/compress.py
+import asyncio
 import io
 import os
 import zipfile
+from typing import Literal
 from urllib.parse import quote
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import Response
-from pydantic import BaseModel
-from squishfile.routes.upload import file_store
-from squishfile.compressor.engine import compress_file
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+from squishfile import cancel, jobs
+from squishfile.compressor import curves
+from squishfile.config import env_str
+from squishfile.metrics import span
+from squishfile.scheduler import OVER_QUOTA, Rejected
+from squishfile.store import get_store
 
 router = APIRouter(prefix="/api")
 
+# How often a running compression checks whether its client went away
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Most targets one ladder request may ask for
+MAX_LADDER_TARGETS = 8
+
 
 class CompressRequest(BaseModel):
     file_id: str
-    target_size_kb: int
+    target_size_kb: int | None = None
+    # Smallest file whose SSIM against the original is at least this
+    # (images only; takes precedence over target_size_kb)
+    target_ssim: float | None = Field(default=None, gt=0, lt=1)
+    # Output for animated GIFs: stay GIF, or transcode to animated WebP/MP4
+    animation_format: Literal["gif", "webp", "mp4"] = "gif"
+    # Pick JPEG, WebP or AVIF per image, whichever is smallest at equal quality
+    best_format: bool = False
+
+
+class LadderRequest(BaseModel):
+    file_id: str
+    # Every output wanted, each compressed as by /compress, from one decode
+    target_sizes_kb: list[int] = Field(min_length=1, max_length=MAX_LADDER_TARGETS)
+    animation_format: Literal["gif", "webp", "mp4"] = "gif"
+    best_format: bool = False
 
 
 @router.post("/compress")
-async def compress(req: CompressRequest):
-    entry = file_store.get(req.file_id)
+async def compress(req: CompressRequest, request: Request):
+    entry = get_store().get(req.file_id)
     if not entry:
         raise HTTPException(status_code=404, detail="File not found")
 
-    target_bytes = req.target_size_kb * 1024
-
-    result = compress_file(
-        data=entry["data"],
-        mime=entry["mime"],
-        category=entry["category"],
-        target_size=target_bytes,
-        width=entry.get("width", 0),
-        height=entry.get("height", 0),
-    )
-
-    # Store compressed data
-    entry["compressed_data"] = result["data"]
-    entry["compressed_size"] = result["size"]
+    if req.target_size_kb is None and req.target_ssim is None:
+        raise HTTPException(status_code=400, detail="Provide target_size_kb or target_ssim")
+    target_bytes = req.target_size_kb * 1024 if req.target_size_kb is not None else None
 
-    # Update filename/mime if output format changed (e.g. webm -> mp4)
-    if "output_ext" in result and not result.get("skipped"):
-        old_name = entry["original_filename"]
-        stem, _ = os.path.splitext(old_name)
-        entry["original_filename"] = stem + result["output_ext"]
-        entry["mime"] = result["output_mime"]
+    result = await _run(entry, {
+        "mime": entry["mime"],
+        "category": entry["category"],
+        "target_size": target_bytes,
+        "width": entry.get("width", 0),
+        "height": entry.get("height", 0),
+        "animation_format": req.animation_format,
+        "best_format": req.best_format,
+        "target_ssim": req.target_ssim,
+        "size_curve": entry.get("size_curve"),
+    }, request)
 
     return {
         "file_id": req.file_id,
         "original_size": result["original_size"],
         "compressed_size": result["size"],
         "skipped": result["skipped"],
+        "ssim": result.get("ssim"),
+        "psnr": result.get("psnr"),
         "message": result.get("message"),
     }
 
 
-@router.get("/download/{file_id}")
-async def download(file_id: str):
-    entry = file_store.get(file_id)
+@router.post("/compress-ladder")
+async def compress_ladder(req: LadderRequest, request: Request):
+    """Compress a file to several target sizes at once.
+
+    The outputs are stored as the file's variants, downloadable with
+    /download/{file_id}?variant=<index in target_sizes_kb>.
+    """
+    entry = get_store().get(req.file_id)
     if not entry:
         raise HTTPException(status_code=404, detail="File not found")
+    if any(kb <= 0 for kb in req.target_sizes_kb):
+        raise HTTPException(status_code=400, detail="Target sizes must be positive")
+
+    result = await _run(entry, {
+        "mime": entry["mime"],
+        "category": entry["category"],
+        "target_sizes": [kb * 1024 for kb in req.target_sizes_kb],
+        "width": entry.get("width", 0),
+        "height": entry.get("height", 0),
+        "animation_format": req.animation_format,
+        "best_format": req.best_format,
+        "size_curve": entry.get("size_curve"),
+    }, request)
+
+    return {
+        "file_id": req.file_id,
+        "original_size": entry["size"],
+        "variants": [
+            {
+                "variant": index,
+                "target_size_kb": kb,
+                "compressed_size": variant["size"],
+                "skipped": variant["skipped"],
+                "ssim": variant.get("ssim"),
+                "psnr": variant.get("psnr"),
+                "message": variant.get("message"),
+            }
+            for index, (kb, variant) in enumerate(zip(req.target_sizes_kb, result["variants"]))
+        ],
+    }
+
+
+async def _run(entry: dict, params: dict, request: Request) -> dict:
+    """Run a compression job for the request's client (see jobs.run)."""
+    # Compression is CPU/subprocess bound: run it on a worker so the
+    # event loop keeps serving other requests meanwhile.
+    # A client that disconnects abandons the job, so it is cancelled.
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, entry["id"]))
+    job = asyncio.ensure_future(jobs.run(entry, params, client=_client_id(request)))
+    try:
+        with span("route.compress", category=entry["category"]):
+            return await asyncio.shield(job)
+    except Rejected as exc:
+        # Over the client's quota (429), or the queue is too long (503)
+        raise HTTPException(
+            status_code=429 if exc.reason == OVER_QUOTA else 503,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    except cancel.JobCancelled:
+        raise HTTPException(status_code=409, detail="Compression cancelled")
+    except asyncio.CancelledError:
+        # The server dropped the request (client gone): the worker thread
+        # or process would otherwise carry on. The flag is set before the
+        # job is cancelled, so the job is recorded as cancelled rather
+        # than left to be recovered.
+        cancel.cancel_job(entry["id"])
+        job.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+
+@router.get("/estimate/{file_id}")
+async def estimate(
+    file_id: str,
+    target_size_kb: int | None = Query(default=None, gt=0),
+    target_ssim: float | None = Query(default=None, gt=0, lt=1),
+):
+    """Predicted result of compressing to a target, from the file's
+    precomputed size curve (SQUISHFILE_PRECOMPUTE)."""
+    entry = get_store().get(file_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="File not found")
+    curve = entry.get("size_curve")
+    if curve is None:
+        return {"file_id": file_id, "ready": False}
+    target_bytes = target_size_kb * 1024 if target_size_kb is not None else None
+    return {
+        "file_id": file_id,
+        "ready": True,
+        "curve": curve,
+        **curves.estimate(curve, target_bytes, target_ssim),
+    }
+
+
+def _client_id(request: Request) -> str:
+    """Who a request is scheduled for: the SQUISHFILE_CLIENT_HEADER
+    header (set by a trusted proxy or gateway) or the client's address."""
+    header = env_str("SQUISHFILE_CLIENT_HEADER")
+    if header and request.headers.get(header):
+        return request.headers[header]
+    return request.client.host if request.client else "unknown"
+
+
+async def _cancel_on_disconnect(request: Request, job_id: str) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    cancel.cancel_job(job_id)
+
+
+@router.delete("/jobs/{file_id}")
+async def cancel_job(file_id: str):
+    """Stop the file's running compression; its request gets a 409."""
+    if not get_store().get(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    cancel.cancel_job(file_id)
+    return {"file_id": file_id, "cancelled": True}
+
+
+@router.get("/jobs/{file_id}")
+async def job_status(file_id: str):
+    """State of a file's latest compression (needs SQUISHFILE_STORE_DIR)."""
+    journal = jobs.get_journal()
+    job = journal.get(file_id) if journal is not None else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"file_id": file_id, "state": job["state"], "message": job["message"]}
+
+
+def _output(entry: dict) -> tuple[str | None, bytes | None]:
+    """The bytes to download, as a file path or in memory.
+
+    Without an output (nothing compressed, or a skipped result) the
+    original upload is returned.
+    """
+    if "compressed_path" in entry:
+        return entry["compressed_path"], None
+    if "compressed_data" in entry:
+        return None, entry["compressed_data"]
+    return entry.get("path"), entry.get("data")
 
-    data = entry.get("compressed_data", entry["data"])
-    filename = entry["original_filename"]
 
+def _output_filename(entry: dict) -> str:
+    """The upload's filename, with the output's extension if the output
+    changed format."""
+    stem, ext = os.path.splitext(entry["original_filename"])
+    return stem + entry.get("output_ext", ext)
+
+
+def _variant_output(entry: dict, index: int) -> tuple[str, str | None, bytes | None]:
+    """A ladder variant's filename and bytes (see _output)."""
+    variants = entry.get("variants", [])
+    if not 0 <= index < len(variants):
+        raise HTTPException(status_code=404, detail="Variant not found")
+    variant = variants[index]
+    stem, ext = os.path.splitext(entry["original_filename"])
+    filename = f"{stem}-{variant['target_size'] // 1024}kb{variant.get('output_ext', ext)}"
+    if "compressed_path" in variant:
+        return filename, variant["compressed_path"], None
+    if "compressed_data" in variant:
+        return filename, None, variant["compressed_data"]
+    return filename, entry.get("path"), entry.get("data")
+
+
+@router.get("/download/{file_id}")
+async def download(file_id: str, variant: int | None = None):
+    """The file's output, or with `variant`, one of its ladder's outputs."""
+    entry = get_store().get(file_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if variant is None:
+        filename = _output_filename(entry)
+        path, data = _output(entry)
+    else:
+        filename, path, data = _variant_output(entry, variant)
     ascii_filename = filename.encode("ascii", errors="replace").decode("ascii")
     encoded_filename = quote(filename)
+    headers = {
+        "Content-Disposition": (
+            f'attachment; filename="{ascii_filename}"; '
+            f"filename*=UTF-8''{encoded_filename}"
+        )
+    }
 
+    if path:
+        # Streamed from disk in chunks
+        return FileResponse(path, media_type="application/octet-stream", headers=headers)
     return Response(
         content=data,
         media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": (
-                f'attachment; filename="{ascii_filename}"; '
-                f"filename*=UTF-8''{encoded_filename}"
-            )
-        },
+        headers=headers,
     )
 
 
@@ -85,15 +280,19 @@ async def download_all(ids: str = Query(..., description="Comma-separated file I
     if not file_ids:
         raise HTTPException(status_code=400, detail="No file IDs provided")
 
+    store = get_store()
     buf = io.BytesIO()
     with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
         for file_id in file_ids:
-            entry = file_store.get(file_id)
+            entry = store.get(file_id)
             if not entry:
                 continue
-            data = entry.get("compressed_data", entry["data"])
-            filename = entry["original_filename"]
-            zf.writestr(filename, data)
+            filename = _output_filename(entry)
+            path, data = _output(entry)
+            if path:
+                zf.write(path, arcname=filename)
+            else:
+                zf.writestr(filename, data)
 
     buf.seek(0)
     return Response(
@@ -1,22 +1,119 @@
+import os
 import uuid
 import io
-from fastapi import APIRouter, UploadFile, HTTPException
-from PIL import Image
+from fastapi import APIRouter, UploadFile, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from squishfile import precompute, uploads
 from squishfile.detector import detect_file_type
-from squishfile.compressor.ffmpeg_utils import probe_media
+from squishfile.compressor import registry
+from squishfile.compressor.ffmpeg_utils import probe_media, probe_media_file
+from squishfile.metrics import traced
+from squishfile.store import get_store
 
 router = APIRouter(prefix="/api")
 
-# In-memory store for uploaded files (per session)
-file_store: dict[str, dict] = {}
+# Bytes of a resumable upload read to detect its type
+DETECT_BYTES = 1024 * 1024
+
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    # Total bytes, if known: chunks past it are refused, and the upload
+    # can only be finished once complete
+    size: int | None = Field(default=None, ge=0)
+
+
+class FinishUploadRequest(BaseModel):
+    # Expected SHA-256 (hex) of the whole file
+    sha256: str | None = None
 
 
 @router.post("/upload")
 async def upload_file(file: UploadFile):
     data = await file.read()
+    response = await run_in_threadpool(_ingest, data, file.filename or "unknown")
+    precompute.submit(response)
+    return response
+
+
+@router.post("/uploads")
+async def create_upload(req: UploadSessionRequest):
+    """Start a resumable upload."""
+    return await run_in_threadpool(uploads.create, req.filename, req.size)
+
+
+@router.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Offset to send the next chunk at."""
+    info = await run_in_threadpool(uploads.status, upload_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return info
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Append the request body at `offset` of the upload."""
+    chunk = await request.body()
+    try:
+        offset = await run_in_threadpool(uploads.append, upload_id, offset, chunk)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except uploads.OffsetMismatch as exc:
+        raise HTTPException(
+            status_code=409, detail=str(exc), headers={"Upload-Offset": str(exc.offset)}
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"upload_id": upload_id, "offset": offset}
+
+
+@router.post("/uploads/{upload_id}/finish")
+async def finish_upload(upload_id: str, req: FinishUploadRequest | None = None):
+    """Detect and store a completed upload, like POST /upload."""
+    try:
+        path, filename, sha256 = await run_in_threadpool(
+            uploads.finish, upload_id, req.sha256 if req else None
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    response = await run_in_threadpool(_ingest_file, path, filename, sha256)
+    precompute.submit(response)
+    return response
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    if not await run_in_threadpool(uploads.abort, upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "deleted": True}
 
-    info = detect_file_type(data, file.filename or "unknown")
 
+@traced("route.upload")
+def _ingest(data: bytes, filename: str) -> dict:
+    """Detect, inspect and store an uploaded file (runs off the event loop)."""
+    return _register(detect_file_type(data, filename), data=data)
+
+
+@traced("route.upload")
+def _ingest_file(path: str, filename: str, sha256: str) -> dict:
+    """Like _ingest, for a finished resumable upload's spool file."""
+    with open(path, "rb") as f:
+        info = detect_file_type(f.read(DETECT_BYTES), filename)
+    info["size"] = os.path.getsize(path)
+    info["sha256"] = sha256
+    try:
+        return _register(info, path=path)
+    except Exception:
+        os.unlink(path)
+        raise
+
+
+def _register(info: dict, data: bytes | None = None, path: str | None = None) -> dict:
+    """Add an upload held in `data` or in the file at `path` to the store."""
     if info["category"] == "unsupported":
         raise HTTPException(
             status_code=400,
@@ -26,23 +123,38 @@ async def upload_file(file: UploadFile):
     file_id = str(uuid.uuid4())[:8]
     entry = {
         "id": file_id,
-        "data": data,
         **info,
     }
+    if data is not None:
+        entry["data"] = data
+    else:
+        entry["path"] = path
 
     # Extract image dimensions
     if info["category"] == "image" and info["mime"] != "image/svg+xml":
-        img = Image.open(io.BytesIO(data))
-        entry["width"] = img.width
-        entry["height"] = img.height
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data) if data is not None else path) as img:
+            entry["width"] = img.width
+            entry["height"] = img.height
 
     # Extract media duration for video/audio
     if info["category"] in ("video", "audio"):
-        probe = probe_media(data)
+        probe = probe_media(data) if data is not None else probe_media_file(path)
         if probe and "format" in probe:
             entry["duration"] = float(probe["format"].get("duration", 0))
+        # Frame size, for the scheduler's cost estimate
+        for stream in (probe or {}).get("streams", []):
+            if stream.get("codec_type") == "video" and stream.get("width"):
+                entry["width"] = stream["width"]
+                entry["height"] = stream.get("height", 0)
+                break
 
-    file_store[file_id] = entry
+    # Rough compression time, for batch planning in the client
+    spec = registry.for_mime(info["mime"])
+    entry["estimated_seconds"] = round(spec.estimate_seconds(info["size"], info["mime"]), 2)
 
     # Return info without raw data
-    return {k: v for k, v in entry.items() if k != "data"}
+    response = {k: v for k, v in entry.items() if k not in ("data", "path")}
+    get_store().add(entry)
+    return response
@@ -0,0 +1,236 @@
+"""Admission control and fair ordering of compression jobs.
+
+Every job is given an estimated cost in CPU-seconds before it runs
+(`estimate_cost`: from the pixel count of images, the duration and frame
+size of videos and the duration of audio). With these the scheduler:
+
+- runs at most SQUISHFILE_MAX_JOBS jobs at once, and at most
+  SQUISHFILE_CLIENT_MAX_JOBS of any one client;
+- refuses a job (`Rejected`, with a delay after which to retry) when
+  its client's queued and running work would exceed
+  SQUISHFILE_CLIENT_CPU_SECONDS, or when it would wait longer than
+  SQUISHFILE_MAX_QUEUE_WAIT seconds;
+- orders waiting jobs by weighted fair queueing. Each job is tagged
+  with a virtual finish time: where its client's previous job finished
+  (or the current virtual time, if later) plus its cost divided by the
+  client's weight (SQUISHFILE_CLIENT_WEIGHTS). The smallest tag runs
+  next, so a client that queues fifty videos only delays its own later
+  jobs, while another client's job runs as if the queue were empty.
+
+Jobs are scheduled per server process, on its event loop.
+"""
+import asyncio
+import math
+import time
+from dataclasses import dataclass, field
+from itertools import count
+
+from squishfile import governor, metrics
+from squishfile.compressor import registry
+from squishfile.config import env_int, env_list
+
+# Estimated single-core compression time, measured like the registry's
+# rates: per megapixel of a still image (by MIME type), per second of
+# video per megapixel of frame, and per second of audio
+IMAGE_SECONDS_PER_MEGAPIXEL = {"image/jpeg": 0.05, "image/png": 2.0, "image/webp": 0.4}
+VIDEO_SECONDS_PER_MEGAPIXEL_SECOND = 1.3
+AUDIO_SECONDS_PER_SECOND = 0.02
+# Frame size assumed when a video's resolution is unknown (720p)
+DEFAULT_VIDEO_PIXELS = 1280 * 720
+
+# An SSIM target measures every candidate; best_format tries three encoders
+SSIM_TARGET_FACTOR = 2.5
+BEST_FORMAT_FACTOR = 3.0
+
+# Floor of every estimate, so that tiny jobs still advance their client's tag
+MIN_COST = 0.05
+
+# Rejection reasons
+OVER_QUOTA = "quota"
+QUEUE_FULL = "busy"
+
+
+class Rejected(Exception):
+    """A job refused by admission control."""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        # Whole seconds, for a Retry-After header
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def estimate_cost(entry: dict, params: dict) -> float:
+    """Estimated CPU-seconds to compress an upload with `params`."""
+    category, mime = entry["category"], entry["mime"]
+    seconds = None
+    duration = entry.get("duration") or 0
+    if category == "image" and mime in IMAGE_SECONDS_PER_MEGAPIXEL:
+        pixels = entry.get("width", 0) * entry.get("height", 0)
+        if pixels:
+            seconds = IMAGE_SECONDS_PER_MEGAPIXEL[mime] * pixels / 1e6
+    elif category == "video" and duration:
+        pixels = entry.get("width", 0) * entry.get("height", 0) or DEFAULT_VIDEO_PIXELS
+        seconds = VIDEO_SECONDS_PER_MEGAPIXEL_SECOND * duration * pixels / 1e6
+    elif category == "audio" and duration:
+        seconds = AUDIO_SECONDS_PER_SECOND * duration
+    if seconds is None:
+        spec = registry.get(category)
+        seconds = spec.estimate_seconds(entry["size"], mime) if spec else 0
+
+    if params.get("target_ssim") is not None:
+        seconds *= SSIM_TARGET_FACTOR
+    if params.get("best_format"):
+        seconds *= BEST_FORMAT_FACTOR
+    # A ladder decodes once, but still encodes every target
+    seconds *= len(params.get("target_sizes") or [None])
+    return max(MIN_COST, seconds)
+
+
+def client_weight(client: str) -> float:
+    """The client's share of the CPU relative to others (default 1)."""
+    for item in env_list("SQUISHFILE_CLIENT_WEIGHTS"):
+        name, _, weight = item.partition("=")
+        if name.strip() == client:
+            try:
+                return max(0.01, float(weight))
+            except ValueError:
+                break
+    return 1.0
+
+
+def max_jobs() -> int:
+    return max(1, env_int("SQUISHFILE_MAX_JOBS", governor.cpu_count()))
+
+
+def client_max_jobs() -> int:
+    return max(1, env_int("SQUISHFILE_CLIENT_MAX_JOBS", 2))
+
+
+@dataclass(eq=False)
+class Ticket:
+    """A job's place in the scheduler."""
+
+    client: str
+    cost: float
+    start: float
+    finish: float
+    seq: int
+    future: asyncio.Future = field(repr=False)
+    started_at: float | None = None
+
+    def remaining(self, now: float) -> float:
+        """Estimated seconds of work left."""
+        if self.started_at is None:
+            return self.cost
+        return max(0.0, self.cost - (now - self.started_at))
+
+
+class Scheduler:
+    def __init__(self):
+        self._waiting: list[Ticket] = []
+        self._running: list[Ticket] = []
+        self._last_finish: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = count()
+
+    def submit(self, client: str, cost: float, enforce: bool = True) -> Ticket:
+        """Queue a job of `cost` CPU-seconds for `client`.
+
+        Raises Rejected if `enforce` and the client is over its quota or
+        the job would wait too long; call `wait` for the job's turn and
+        `release` once it has finished (or given up).
+        """
+        start = max(self._virtual_time, self._last_finish.get(client, 0.0))
+        finish = start + cost / client_weight(client)
+        if enforce:
+            self._admit(client, cost, finish)
+
+        self._last_finish[client] = finish
+        ticket = Ticket(client, cost, start, finish, next(self._seq),
+                        asyncio.get_running_loop().create_future())
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _admit(self, client: str, cost: float, finish: float) -> None:
+        now = time.monotonic()
+        concurrency = client_max_jobs()
+        outstanding = sum(t.remaining(now) for t in self._waiting + self._running
+                          if t.client == client)
+        quota = env_int("SQUISHFILE_CLIENT_CPU_SECONDS", 1800)
+        # A single job larger than the quota still runs on its own
+        if quota > 0 and outstanding and outstanding + cost > quota:
+            metrics.inc("squishfile_jobs_rejected_total", reason=OVER_QUOTA)
+            raise Rejected(
+                "Too much queued work for this client", OVER_QUOTA,
+                (outstanding + cost - quota) / min(concurrency, max_jobs()),
+            )
+
+        # Work that runs before this job: everything running and the jobs
+        # of any client tagged to finish earlier, once every slot is
+        # taken; and the client's own jobs, at most `concurrency` at a time
+        wait = 0.0
+        if len(self._running) >= max_jobs() or self._waiting:
+            ahead = sum(t.remaining(now) for t in self._running)
+            ahead += sum(t.cost for t in self._waiting if t.finish <= finish)
+            wait = ahead / max_jobs()
+        own_running = sum(1 for t in self._running if t.client == client)
+        if own_running >= concurrency or any(t.client == client for t in self._waiting):
+            wait = max(wait, outstanding / concurrency)
+        limit = env_int("SQUISHFILE_MAX_QUEUE_WAIT", 600)
+        if limit > 0 and wait > limit:
+            metrics.inc("squishfile_jobs_rejected_total", reason=QUEUE_FULL)
+            raise Rejected("Server busy", QUEUE_FULL, wait - limit)
+
+    def idle(self) -> bool:
+        """Whether a new job would start right away."""
+        return not self._waiting and len(self._running) < max_jobs()
+
+    async def wait(self, ticket: Ticket) -> None:
+        """Return once the job may run."""
+        await ticket.future
+
+    def release(self, ticket: Ticket) -> None:
+        """Remove a finished or abandoned job and start the next ones."""
+        if ticket in self._running:
+            self._running.remove(ticket)
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+            ticket.future.cancel()
+        if not self._waiting and not self._running:
+            # Idle: tags start over, and forget clients
+            self._last_finish.clear()
+            self._virtual_time = 0.0
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        limit, concurrency = max_jobs(), client_max_jobs()
+        while len(self._running) < limit:
+            running = {}
+            for t in self._running:
+                running[t.client] = running.get(t.client, 0) + 1
+            eligible = [t for t in self._waiting
+                        if not t.future.done() and running.get(t.client, 0) < concurrency]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (t.finish, t.seq))
+            self._waiting.remove(ticket)
+            self._running.append(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            ticket.started_at = time.monotonic()
+            ticket.future.set_result(None)
+        self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("squishfile_jobs_waiting", len(self._waiting))
+        metrics.set_gauge("squishfile_jobs_scheduled", len(self._running))
+        metrics.set_gauge("squishfile_queued_cpu_seconds", sum(t.cost for t in self._waiting))
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler() -> Scheduler:
+    return _scheduler
+
@@ -0,0 +1,255 @@
+"""Storage for uploaded files and their compressed outputs.
+
+An entry is a dict: the detector's info plus route state such as
+"compressed_size". Its bytes are either held in the entry ("data",
+"compressed_data") or on disk ("path", "compressed_path"). A ladder's
+outputs are kept as "variants": one dict per target, each with its
+target_size, size and bytes (again "compressed_data" or
+"compressed_path", absent if the variant is the original).
+
+By default entries live in a dict in this process. Setting
+SQUISHFILE_STORE_DIR stores them under that directory instead: an SQLite
+index (WAL mode, safe across processes) plus one blob file per upload
+and per output. Every process of `uvicorn --workers N` then sees the
+same uploads, and inputs and outputs move between processes as paths
+rather than as bytes.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from squishfile.config import env_str
+
+
+class MemoryStore:
+    """Entries kept in this process's memory."""
+
+    def __init__(self):
+        self._entries: dict[str, dict] = {}
+
+    def get(self, file_id: str) -> dict | None:
+        return self._entries.get(file_id)
+
+    def __getitem__(self, file_id: str) -> dict:
+        return self._entries[file_id]
+
+    def add(self, entry: dict) -> None:
+        """Store a new upload; entry["data"] holds its bytes, or
+        entry["path"] names a file the store takes over."""
+        self._entries[entry["id"]] = entry
+
+    def save(self, entry: dict) -> None:
+        self._entries[entry["id"]] = entry
+
+    def set_field(self, file_id: str, key: str, value) -> None:
+        """Set one key of a stored entry, leaving the rest as stored."""
+        entry = self._entries.get(file_id)
+        if entry is not None:
+            entry[key] = value
+
+    def save_fields(self, entry: dict, keys: tuple[str, ...]) -> None:
+        """Save these keys of the entry (dropping those it lacks), leaving
+        the rest as stored."""
+        stored = self._entries.get(entry["id"])
+        if stored is None or stored is entry:
+            return
+        for key in keys:
+            if key in entry:
+                stored[key] = entry[key]
+            else:
+                stored.pop(key, None)
+
+    def set_output(self, entry: dict, result: dict) -> None:
+        """Replace the entry's output with a compression result's.
+
+        A skipped result is the original, so no copy is kept.
+        """
+        discard_output(entry)
+        if result.get("path"):
+            entry["compressed_path"] = result["path"]
+        elif not result["skipped"]:
+            entry["compressed_data"] = result["data"]
+
+    def set_variants(self, entry: dict, target_sizes: list[int], results: list[dict]) -> None:
+        """Replace the entry's variants with a ladder's results."""
+        discard_variants(entry)
+        entry["variants"] = []
+        for target_size, result in zip(target_sizes, results):
+            variant = _variant(target_size, result)
+            if result.get("path"):
+                variant["compressed_path"] = result["path"]
+            elif not result["skipped"]:
+                variant["compressed_data"] = result["data"]
+            entry["variants"].append(variant)
+
+
+class DiskStore:
+    """Entries indexed in SQLite, with their bytes in blob files."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(id TEXT PRIMARY KEY, entry TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(
+                os.path.join(self.root, "index.sqlite3"), timeout=30
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, file_id: str) -> dict | None:
+        row = self._connect().execute(
+            "SELECT entry FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __getitem__(self, file_id: str) -> dict:
+        entry = self.get(file_id)
+        if entry is None:
+            raise KeyError(file_id)
+        return entry
+
+    def add(self, entry: dict) -> None:
+        """Store a new upload; entry["data"] (or the file at
+        entry["path"]) is moved to a blob file."""
+        if "data" in entry:
+            entry["path"] = self._write_blob(entry["id"], entry.pop("data"))
+        else:
+            fd, path = self._blob_file(entry["id"])
+            os.close(fd)
+            shutil.move(entry["path"], path)
+            entry["path"] = path
+        self.save(entry)
+
+    def save(self, entry: dict) -> None:
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO files (id, entry, updated) VALUES (?, ?, ?)",
+                (entry["id"], json.dumps(entry), time.time()),
+            )
+
+    def set_field(self, file_id: str, key: str, value) -> None:
+        """Set one key of a stored entry, leaving the rest as stored
+        (atomic with other processes' saves)."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE files SET entry = json_set(entry, ?, json(?)), updated = ? WHERE id = ?",
+                (f"$.{key}", json.dumps(value), time.time(), file_id),
+            )
+
+    def save_fields(self, entry: dict, keys: tuple[str, ...]) -> None:
+        """Save these keys of the entry (dropping those it lacks), leaving
+        the rest as stored (atomic with other processes' saves)."""
+        removed = [f"$.{key}" for key in keys if key not in entry]
+        updated = [key for key in keys if key in entry]
+        expr = "entry"
+        if removed:
+            expr = f"json_remove({expr}{', ?' * len(removed)})"
+        if updated:
+            expr = f"json_set({expr}{', ?, json(?)' * len(updated)})"
+        args = [*removed]
+        for key in updated:
+            args += [f"$.{key}", json.dumps(entry[key])]
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE files SET entry = {expr}, updated = ? WHERE id = ?",
+                (*args, time.time(), entry["id"]),
+            )
+
+    def set_output(self, entry: dict, result: dict) -> None:
+        """Replace the entry's output with a compression result's.
+
+        A skipped result is the original, so no copy is kept.
+        """
+        discard_output(entry)
+        if result.get("path"):
+            fd, path = self._blob_file(entry["id"])
+            os.close(fd)
+            shutil.move(result["path"], path)
+            entry["compressed_path"] = path
+        elif not result["skipped"]:
+            entry["compressed_path"] = self._write_blob(entry["id"], result["data"])
+
+    def set_variants(self, entry: dict, target_sizes: list[int], results: list[dict]) -> None:
+        """Replace the entry's variants with a ladder's results."""
+        discard_variants(entry)
+        entry["variants"] = []
+        for target_size, result in zip(target_sizes, results):
+            variant = _variant(target_size, result)
+            if result.get("path"):
+                fd, path = self._blob_file(entry["id"])
+                os.close(fd)
+                shutil.move(result["path"], path)
+                variant["compressed_path"] = path
+            elif not result["skipped"]:
+                variant["compressed_path"] = self._write_blob(entry["id"], result["data"])
+            entry["variants"].append(variant)
+
+    def blob_paths(self) -> set[str]:
+        """Every blob file an entry refers to."""
+        paths = set()
+        for (row,) in self._connect().execute("SELECT entry FROM files"):
+            entry = json.loads(row)
+            for item in (entry, *entry.get("variants", ())):
+                paths.update(item[key] for key in ("path", "compressed_path") if key in item)
+        return paths
+
+    def _blob_file(self, file_id: str) -> tuple[int, str]:
+        # Unique names: a new output never overwrites a file being served
+        return tempfile.mkstemp(prefix=f"{file_id}-", dir=self.blob_dir)
+
+    def _write_blob(self, file_id: str, data: bytes) -> str:
+        fd, path = self._blob_file(file_id)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return path
+
+
+def discard_output(entry: dict) -> None:
+    """Forget an entry's output, deleting its file if it has one."""
+    entry.pop("compressed_data", None)
+    path = entry.pop("compressed_path", None)
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def discard_variants(entry: dict) -> None:
+    """Forget an entry's variants, deleting their files."""
+    for variant in entry.pop("variants", ()):
+        discard_output(variant)
+
+
+def _variant(target_size: int, result: dict) -> dict:
+    variant = {"target_size": target_size, "size": result["size"], "skipped": result["skipped"]}
+    if "output_ext" in result and not result["skipped"]:
+        variant["output_ext"] = result["output_ext"]
+        variant["output_mime"] = result["output_mime"]
+    return variant
+
+
+_stores: dict[str, MemoryStore | DiskStore] = {}
+
+
+def get_store() -> MemoryStore | DiskStore:
+    """The store selected by SQUISHFILE_STORE_DIR (memory if unset)."""
+    root = env_str("SQUISHFILE_STORE_DIR")
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = DiskStore(root) if root else MemoryStore()
+    return store
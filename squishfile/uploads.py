@@ -0,0 +1,209 @@
+"""Resumable uploads, sent in chunks.
+
+A session is created with the file's name (and optionally its size),
+then chunks are appended at explicit offsets. A client whose connection
+drops asks for the session's offset and carries on from there; a chunk
+at any other offset is refused. Chunks are appended to a spool file and
+hashed (SHA-256) as they arrive, so finishing an upload never re-reads
+what was already hashed. The routes run detection and probing once the
+upload is finished and hand the spool file to the store.
+
+Sessions live next to the store (SQUISHFILE_STORE_DIR/uploads), or in
+the temporary directory: a spool file plus a JSON file describing it. A
+session's offset is its spool file's size, so any server process can
+continue an upload another one started; the running hash is kept per
+process and caught up from the file when needed. A lock file per
+session (locked with flock, or msvcrt on Windows) keeps two processes
+from appending the same chunk at once.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from squishfile.config import TEMP_PREFIX, env_str
+
+
+class OffsetMismatch(Exception):
+    """A chunk sent for an offset other than the session's."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+_lock = threading.Lock()
+# upload_id -> lock serializing its chunks
+_session_locks: dict[str, threading.Lock] = {}
+# upload_id -> (bytes hashed, running SHA-256)
+_hashes: dict[str, tuple[int, "hashlib._Hash"]] = {}
+
+
+def upload_dir() -> str:
+    root = env_str("SQUISHFILE_STORE_DIR")
+    directory = os.path.join(root, "uploads") if root else tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _paths(upload_id: str) -> tuple[str, str]:
+    """The session's spool file and description."""
+    base = os.path.join(upload_dir(), f"{TEMP_PREFIX}upload-{upload_id}")
+    return base, base + ".json"
+
+
+def _lock_path(upload_id: str) -> str:
+    return os.path.join(upload_dir(), f"{TEMP_PREFIX}upload-{upload_id}.lock")
+
+
+def _session_lock(upload_id: str) -> threading.Lock:
+    with _lock:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+@contextmanager
+def _locked(upload_id: str):
+    """Hold the session against other threads and other processes."""
+    with _session_lock(upload_id):
+        try:
+            fd = os.open(_lock_path(upload_id), os.O_RDWR)
+        except FileNotFoundError:
+            # Finished, aborted or unknown: nothing left to append to
+            yield
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if os.name == "nt":
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                except OSError:
+                    pass
+            os.close(fd)  # Releases the flock
+
+
+def create(filename: str, size: int | None = None) -> dict:
+    """Start an upload of `size` bytes (None: unknown until finished)."""
+    upload_id = uuid.uuid4().hex[:12]
+    spool, meta = _paths(upload_id)
+    open(spool, "wb").close()
+    open(_lock_path(upload_id), "wb").close()
+    with open(meta, "w") as f:
+        json.dump({"filename": filename, "size": size}, f)
+    _hashes[upload_id] = (0, hashlib.sha256())
+    return {"upload_id": upload_id, "filename": filename, "size": size, "offset": 0}
+
+
+def status(upload_id: str) -> dict | None:
+    """The session's name, declared size and offset (None if unknown)."""
+    spool, meta = _paths(upload_id)
+    try:
+        with open(meta) as f:
+            info = json.load(f)
+        offset = os.path.getsize(spool)
+    except (FileNotFoundError, ValueError):
+        return None
+    return {"upload_id": upload_id, **info, "offset": offset}
+
+
+def append(upload_id: str, offset: int, chunk: bytes) -> int:
+    """Append `chunk` at `offset`; returns the new offset.
+
+    Raises KeyError for an unknown session, OffsetMismatch if the upload
+    is not at `offset` and ValueError past the declared size.
+    """
+    with _locked(upload_id):
+        info = status(upload_id)
+        if info is None:
+            raise KeyError(upload_id)
+        if offset != info["offset"]:
+            raise OffsetMismatch(info["offset"])
+        if info["size"] is not None and offset + len(chunk) > info["size"]:
+            raise ValueError("Chunk goes past the declared size")
+
+        spool, _ = _paths(upload_id)
+        with open(spool, "ab") as f:
+            f.write(chunk)
+        hashed, digest = _hashes.get(upload_id, (0, hashlib.sha256()))
+        if hashed == offset:
+            digest.update(chunk)
+            _hashes[upload_id] = (offset + len(chunk), digest)
+        return offset + len(chunk)
+
+
+def finish(upload_id: str, sha256: str | None = None) -> tuple[str, str, str]:
+    """End the session, returning (spool path, filename, SHA-256 hex).
+
+    The spool file is the caller's to keep or delete. Raises KeyError
+    for an unknown session, and ValueError for an incomplete upload or
+    one whose hash is not `sha256` (the session is then kept).
+    """
+    with _locked(upload_id):
+        info = status(upload_id)
+        if info is None:
+            raise KeyError(upload_id)
+        if info["size"] is not None and info["offset"] != info["size"]:
+            raise ValueError(f"Upload incomplete: {info['offset']} of {info['size']} bytes")
+        spool, meta = _paths(upload_id)
+        digest = _catch_up(upload_id, spool)
+        if sha256 and sha256.lower() != digest:
+            raise ValueError("Checksum mismatch")
+        os.unlink(meta)
+        _forget(upload_id)
+    _unlink_lock(upload_id)
+    return spool, info["filename"], digest
+
+
+def _catch_up(upload_id: str, spool: str) -> str:
+    """Hash whatever the running hash has not seen (chunks another
+    process received, or everything after a restart)."""
+    hashed, digest = _hashes.get(upload_id, (0, hashlib.sha256()))
+    with open(spool, "rb") as f:
+        f.seek(hashed)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+            hashed += len(block)
+    _hashes[upload_id] = (hashed, digest)
+    return digest.hexdigest()
+
+
+def abort(upload_id: str) -> bool:
+    """Delete a session and its data; False if there was none."""
+    with _locked(upload_id):
+        found = False
+        for path in _paths(upload_id):
+            try:
+                os.unlink(path)
+                found = True
+            except FileNotFoundError:
+                pass
+        _forget(upload_id)
+    _unlink_lock(upload_id)
+    return found
+
+
+def _unlink_lock(upload_id: str) -> None:
+    # After the session's lock is released (Windows cannot delete an
+    # open file); a process still waiting on it finds the session gone
+    try:
+        os.unlink(_lock_path(upload_id))
+    except OSError:
+        pass
+
+
+def _forget(upload_id: str) -> None:
+    _hashes.pop(upload_id, None)
+    with _lock:
+        _session_locks.pop(upload_id, None)
@@ -0,0 +1,145 @@
+"""Execution of compression jobs off the event loop.
+
+By default jobs run in the server's threadpool. Setting SQUISHFILE_WORKERS
+to N > 0 runs them in a pool of N worker processes instead, started at
+server startup with the engines listed in SQUISHFILE_WARMUP (default: all
+categories) already imported, so the first request per worker does not
+pay for importing Pillow, PyMuPDF or NumPy. Engines the registry marks
+as subprocess-bound (FFmpeg) still run on the threadpool: their work
+happens in a child process either way, and a worker process would only
+sit waiting on it.
+
+Every job counts against the governor's CPU budget while it runs (see
+governor.py); worker processes get their thread budget with the job and
+keep native libraries' thread pools to one thread.
+
+Outputs of SQUISHFILE_SPOOL_KB or more are written to a temporary file
+by the job itself and returned as a "path" instead of "data", so large
+results are neither pickled back from a worker nor held in memory.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+from squishfile import cancel, governor, metrics
+from squishfile.compressor import registry
+from squishfile.config import TEMP_PREFIX, env_int, env_list
+
+logger = logging.getLogger(__name__)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_size = 0
+
+
+def _warm_up(categories: list[str] | None) -> None:
+    from squishfile.compressor.engine import warm_up
+
+    warm_up(categories)
+
+
+def _init_worker(categories: list[str] | None) -> None:
+    governor.limit_native_threads()
+    _warm_up(categories)
+
+
+def _run_job(enqueued_at: float, kwargs: dict) -> dict:
+    metrics.observe("squishfile_queue_wait_seconds", time.time() - enqueued_at)
+    from squishfile.compressor.engine import compress_file, compress_ladder
+
+    with cancel.current_job(kwargs.pop("job_id", None)), \
+            governor.job_threads(kwargs.pop("threads", None)):
+        if "data_path" in kwargs:
+            with open(kwargs.pop("data_path"), "rb") as f:
+                kwargs["data"] = f.read()
+        if "target_sizes" in kwargs:
+            return {"variants": [_spool(result) for result in compress_ladder(**kwargs)]}
+        return _spool(compress_file(**kwargs))
+
+
+def _spool(result: dict) -> dict:
+    """Move a large output to a temporary file (result["path"])."""
+    threshold = env_int("SQUISHFILE_SPOOL_KB", 16384) * 1024
+    if threshold <= 0 or result["skipped"] or result["size"] < threshold:
+        return result
+    fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=result.get("output_ext", ""))
+    with os.fdopen(fd, "wb") as f:
+        f.write(result["data"])
+    result["data"] = None
+    result["path"] = path
+    return result
+
+
+def _run_job_in_worker(enqueued_at: float, kwargs: dict) -> dict:
+    result = _run_job(enqueued_at, kwargs)
+    # Ship this job's observations back to the parent's registry
+    result["_metrics"] = metrics.drain()
+    return result
+
+
+def _noop() -> None:
+    return None
+
+
+def start() -> None:
+    """Start the worker pool if SQUISHFILE_WORKERS is set.
+
+    Without a pool, engines named in SQUISHFILE_WARMUP are imported in a
+    background thread instead so the first request does not pay for it.
+    """
+    global _pool, _pool_size
+    workers = env_int("SQUISHFILE_WORKERS", 0)
+    categories = env_list("SQUISHFILE_WARMUP") or None
+
+    if workers <= 0:
+        if categories:
+            asyncio.get_running_loop().run_in_executor(None, _warm_up, categories)
+        return
+
+    _pool_size = workers
+    _pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(categories,),
+    )
+    # One submission per worker makes the executor spawn all of them now,
+    # in the background, instead of lazily on the first requests.
+    for _ in range(workers):
+        _pool.submit(_noop)
+    logger.info("Started %d compression worker process(es)", workers)
+
+
+def shutdown() -> None:
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_size = 0
+
+
+async def run_compress(**kwargs) -> dict:
+    """Run `engine.compress_file(**kwargs)` on a worker and return its result.
+
+    With target_sizes, `engine.compress_ladder(**kwargs)` runs instead,
+    and the result is {"variants": [one result per target]}.
+    The input may be given as data_path instead of data, to be read by the
+    worker rather than sent to it. With job_id, the job can be stopped
+    with `cancel.cancel_job(job_id)`, raising cancel.JobCancelled.
+    """
+    enqueued_at = time.time()
+    spec = registry.get(kwargs.get("category"))
+    with governor.job_running():
+        if _pool is None or (spec is not None and spec.bound == registry.SUBPROCESS_BOUND):
+            return await run_in_threadpool(_run_job, enqueued_at, kwargs)
+
+        loop = asyncio.get_running_loop()
+        kwargs["threads"] = governor.thread_budget(_pool_size)
+        result = await loop.run_in_executor(_pool, _run_job_in_worker, enqueued_at, kwargs)
+    metrics.merge(result.pop("_metrics"))
+    return result
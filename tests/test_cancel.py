@@ -0,0 +1,48 @@
+import io
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from squishfile import cancel
+from squishfile.compressor.engine import compress_file
+from squishfile.compressor.ffmpeg_utils import get_ffmpeg, run_ffmpeg
+from squishfile.main import app
+
+client = TestClient(app)
+
+
+def test_cancel_kills_running_subprocess():
+    # An endless encode of a generated test pattern
+    cmd = [get_ffmpeg(), "-re", "-f", "lavfi", "-i", "testsrc", "-f", "null", "-"]
+    threading.Timer(0.3, cancel.cancel_job, ("sleeper",)).start()
+    started = time.monotonic()
+    try:
+        with cancel.current_job("sleeper"), pytest.raises(cancel.JobCancelled):
+            run_ffmpeg(cmd, timeout=60)
+    finally:
+        cancel.clear("sleeper")
+    assert time.monotonic() - started < 5
+
+
+def test_cancelled_image_search_stops():
+    buf = io.BytesIO()
+    Image.effect_noise((400, 300), 64).convert("RGB").save(buf, format="JPEG", quality=95)
+    cancel.cancel_job("image-job")
+    try:
+        with cancel.current_job("image-job"), pytest.raises(cancel.JobCancelled):
+            compress_file(buf.getvalue(), "image/jpeg", "image", target_size=5000)
+    finally:
+        cancel.clear("image-job")
+
+
+def test_cancel_endpoint():
+    assert client.delete("/api/jobs/missing").status_code == 404
+    buf = io.BytesIO()
+    Image.new("RGB", (50, 50)).save(buf, format="PNG")
+    uploaded = client.post("/api/upload", files={"file": ("a.png", buf.getvalue(), "image/png")}).json()
+    assert client.delete(f"/api/jobs/{uploaded['id']}").json()["cancelled"] is True
+    assert cancel.is_cancelled(uploaded["id"])
+    cancel.clear(uploaded["id"])
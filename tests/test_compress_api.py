@@ -47,3 +47,96 @@ def test_download_endpoint():
     resp = client.get(f"/api/download/{file_id}")
     assert resp.status_code == 200
     assert resp.headers["content-type"] == "application/octet-stream"
+
+
+def test_compress_endpoint_with_ssim_target():
+    uploaded = _upload_jpeg()
+    resp = client.post("/api/compress", json={
+        "file_id": uploaded["id"],
+        "target_ssim": 0.95,
+    })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["ssim"] >= 0.95
+    assert data["compressed_size"] < uploaded["size"]
+
+
+def test_compress_endpoint_requires_a_target():
+    uploaded = _upload_jpeg(100, 100)
+    resp = client.post("/api/compress", json={"file_id": uploaded["id"]})
+    assert resp.status_code == 400
+
+
+def test_large_output_is_served_from_disk(monkeypatch):
+    import os
+
+    from squishfile.store import discard_output, get_store
+
+    monkeypatch.setenv("SQUISHFILE_SPOOL_KB", "1")
+    uploaded = _upload_jpeg()
+    target_kb = uploaded["size"] // 1024 // 2
+
+    client.post("/api/compress", json={"file_id": uploaded["id"], "target_size_kb": target_kb})
+    path = get_store()[uploaded["id"]]["compressed_path"]
+    assert "compressed_data" not in get_store()[uploaded["id"]]
+
+    resp = client.get(f"/api/download/{uploaded['id']}")
+    assert resp.content[:2] == b"\xff\xd8"
+    with open(path, "rb") as f:
+        assert resp.content == f.read()
+
+    # Compressing again replaces the spooled file
+    client.post("/api/compress", json={"file_id": uploaded["id"], "target_size_kb": target_kb // 2})
+    assert not os.path.exists(path)
+    discard_output(get_store()[uploaded["id"]])
+
+
+def test_compress_ladder_stores_downloadable_variants():
+    uploaded = _upload_jpeg()
+    size_kb = uploaded["size"] // 1024
+    targets = [size_kb // 2, size_kb // 4, size_kb * 2]
+
+    resp = client.post("/api/compress-ladder", json={
+        "file_id": uploaded["id"],
+        "target_sizes_kb": targets,
+    })
+    assert resp.status_code == 200
+    variants = resp.json()["variants"]
+    assert [v["target_size_kb"] for v in variants] == targets
+    assert variants[0]["compressed_size"] > variants[1]["compressed_size"]
+    assert variants[1]["compressed_size"] <= targets[1] * 1024 * 1.05
+    assert variants[2]["skipped"]
+
+    resp = client.get(f"/api/download/{uploaded['id']}?variant=1")
+    assert len(resp.content) == variants[1]["compressed_size"]
+    assert resp.content[:2] == b"\xff\xd8"
+    assert f"test-{targets[1]}kb.jpg" in resp.headers["content-disposition"]
+    assert client.get(f"/api/download/{uploaded['id']}?variant=3").status_code == 404
+
+
+def test_converted_output_keeps_the_source_format():
+    import numpy as np
+
+    from squishfile.store import get_store
+
+    rng = np.random.default_rng(0)
+    pixels = (np.linspace(0, 255, 300 * 300 * 3).reshape(300, 300, 3)
+              + rng.normal(0, 10, (300, 300, 3))).clip(0, 255).astype("uint8")
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    png = buf.getvalue()
+    uploaded = client.post("/api/upload", files={"file": ("a.png", png, "image/png")}).json()
+    file_id = uploaded["id"]
+
+    client.post("/api/compress", json={"file_id": file_id, "target_size_kb": len(png) // 1024 // 20})
+    resp = client.get(f"/api/download/{file_id}")
+    assert 'filename="a.jpg"' in resp.headers["content-disposition"]
+    entry = get_store().get(file_id)
+    assert entry["mime"] == "image/png"
+    assert entry["original_filename"] == "a.png"
+
+    # The original, unchanged, is downloaded under its own name
+    client.post("/api/compress", json={"file_id": file_id, "target_size_kb": len(png) // 1024 * 2})
+    resp = client.get(f"/api/download/{file_id}")
+    assert 'filename="a.png"' in resp.headers["content-disposition"]
+    assert resp.content == png
@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from squishfile import precompute
+from squishfile.compressor import curves
+from squishfile.compressor.engine import compress_file
+from squishfile.main import app
+
+client = TestClient(app)
+
+
+def _photo() -> bytes:
+    rng = np.random.default_rng(3)
+    noise = Image.fromarray((rng.random((120, 160, 3)) * 255).astype("uint8"))
+    img = Image.blend(noise.resize((1200, 900), Image.BICUBIC),
+                      Image.linear_gradient("L").resize((1200, 900)).convert("RGB"), 0.5)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def test_curve_starts_the_search_at_the_target():
+    data = _photo()
+    curve = curves.image_curve(data, "image/jpeg")
+    sizes = [size for _, size, _ in curve["points"]]
+    assert sizes == sorted(sizes)
+
+    target = len(data) // 3
+    result = compress_file(data, "image/jpeg", "image", target, measure_quality=False,
+                           size_curve=curve)
+    assert abs(result["size"] - target) <= target * 0.05
+    assert result["iterations"] <= 2
+    assert abs(curves.estimate(curve, target)["quality"] - result["quality"]) <= 5
+
+    # Out of the sampled range, the curve gives no starting point
+    assert curves.start_quality(curve, sizes[0] // 2) is None
+
+
+def test_precomputed_curve_gives_an_estimate(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_PRECOMPUTE", "1")
+    data = _photo()
+    uploaded = client.post("/api/upload", files={"file": ("a.jpg", data, "image/jpeg")}).json()
+    assert not client.get(f"/api/estimate/{uploaded['id']}").json()["ready"]
+
+    assert precompute._pending[-1] == uploaded["id"]
+    precompute._pending.clear()
+    precompute.precompute(uploaded["id"])
+
+    target_kb = len(data) // 3 // 1024
+    estimate = client.get(f"/api/estimate/{uploaded['id']}?target_size_kb={target_kb}").json()
+    assert estimate["ready"]
+    assert estimate["size"] <= target_kb * 1024
+    assert 0 < estimate["ssim"] <= 1
+
+    resp = client.post("/api/compress", json={"file_id": uploaded["id"], "target_size_kb": target_kb})
+    assert resp.status_code == 200
+    assert resp.json()["compressed_size"] <= target_kb * 1024 * 1.05
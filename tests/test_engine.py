@@ -75,3 +75,16 @@ def test_compress_file_audio_dispatch():
         target_size=10000,
     )
     assert result["skipped"] is True
+
+
+def test_compress_file_reports_quality(monkeypatch):
+    data = _make_test_jpeg()
+    result = compress_file(data=data, mime="image/jpeg", category="image",
+                           target_size=len(data) // 3)
+    assert 0 < result["ssim"] <= 1
+    assert result["psnr"] > 20
+
+    monkeypatch.setenv("SQUISHFILE_QUALITY_METRICS", "0")
+    result = compress_file(data=data, mime="image/jpeg", category="image",
+                           target_size=len(data) // 3)
+    assert "ssim" not in result and "psnr" not in result
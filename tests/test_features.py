@@ -0,0 +1,47 @@
+# tests/test_features.py
+import io
+import numpy as np
+from PIL import Image
+from squishfile.compressor.features import (
+    FEATURE_NAMES, estimate_jpeg_quality, extract_features, feature_vector, luma_features,
+)
+
+
+def _jpeg(quality=80, subsampling=2) -> bytes:
+    img = Image.new("RGB", (320, 240))
+    img.putdata([((i * 7) % 256, (i * 3) % 256, 128) for i in range(320 * 240)])
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, subsampling=subsampling)
+    return buf.getvalue()
+
+
+def test_extract_jpeg_features():
+    features = extract_features(_jpeg(quality=80, subsampling=2), "image/jpeg")
+    assert features["width"] == 320
+    assert features["height"] == 240
+    assert abs(features["source_quality"] - 80) <= 2
+    assert features["subsampling"] == 2
+    assert features["has_alpha"] == 0
+    assert features["entropy"] > 0
+
+
+def test_estimate_quality_tracks_encoder_setting():
+    low = Image.open(io.BytesIO(_jpeg(quality=30)))
+    high = Image.open(io.BytesIO(_jpeg(quality=90)))
+    assert estimate_jpeg_quality(low.quantization) < estimate_jpeg_quality(high.quantization)
+
+
+def test_flat_image_has_no_entropy_or_edges():
+    flat = np.full((64, 64), 128, dtype=np.uint8)
+    assert luma_features(flat) == {"entropy": 0.0, "edge_density": 0.0}
+
+
+def test_undecodable_data_returns_empty():
+    assert extract_features(b"not an image", "image/png") == {}
+
+
+def test_feature_vector_imputes_missing():
+    vector = feature_vector({"entropy": 3.0}, fill={"edge_density": 0.5})
+    assert len(vector) == len(FEATURE_NAMES)
+    assert vector[FEATURE_NAMES.index("entropy")] == 3.0
+    assert vector[FEATURE_NAMES.index("edge_density")] == 0.5
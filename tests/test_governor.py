@@ -0,0 +1,34 @@
+from squishfile import governor, metrics
+
+
+def test_budget_is_shared_between_running_jobs(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_CPUS", "8")
+    with governor.job_running():
+        assert governor.thread_budget() == 8
+        with governor.job_running(), governor.job_running():
+            assert governor.thread_budget() == 2
+            assert governor.thread_budget(concurrency=2) == 4
+            assert "squishfile_active_jobs 3" in metrics.render_prometheus()
+        with governor.job_threads(3):
+            assert governor.thread_budget() == 3
+    assert governor.active_jobs() == 0
+
+
+def test_ffmpeg_command_gets_thread_options(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_CPUS", "4")
+    cmd = governor.ffmpeg_command(["ffmpeg", "-i", "in.mp4", "-c:v", "libx264", "out.mp4"])
+    assert cmd[:5] == ["ffmpeg", "-filter_threads", "4", "-threads", "4"]
+    assert cmd[-3:] == ["-threads", "4", "out.mp4"]
+
+
+def test_ffmpeg_command_budgets_every_input_and_output(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_CPUS", "2")
+    cmd = governor.ffmpeg_command(
+        ["ffmpeg", "-i", "a.mp4", "-i", "b.mp4", "-map", "0", "x.mp4", "-map", "1", "y.mp4"],
+        outputs=[7, 10],
+    )
+    assert cmd == [
+        "ffmpeg", "-filter_threads", "2",
+        "-threads", "2", "-i", "a.mp4", "-threads", "2", "-i", "b.mp4",
+        "-map", "0", "-threads", "2", "x.mp4", "-map", "1", "-threads", "2", "y.mp4",
+    ]
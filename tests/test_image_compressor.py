@@ -35,3 +35,213 @@ def test_skip_if_already_small():
     target_size = len(original) * 2  # target bigger than original
     result = compress_image(original, "image/jpeg", target_size)
     assert result["skipped"] is True
+
+
+def _png_bytes(img: Image.Image, **params) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", **params)
+    return buf.getvalue()
+
+
+def _noisy_rgba(width=300, height=300) -> Image.Image:
+    import numpy as np
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    alpha[50:250, 50:250] = 255
+    return Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+def test_png_lossless_reencode_keeps_pixels():
+    img = Image.new("RGB", (400, 300), "white")
+    for x in range(0, 400, 20):
+        img.paste((x % 256, 40, 200), (x, 0, x + 10, 300))
+    original = _png_bytes(img, compress_level=0)
+    result = compress_image(original, "image/png", len(original) // 2)
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format == "PNG"
+    assert "output_ext" not in result
+    assert out.convert("RGB").tobytes() == img.tobytes()
+
+
+def test_png_palette_keeps_transparency():
+    original = _png_bytes(_noisy_rgba())
+    result = compress_image(original, "image/png", len(original) // 2)
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format == "PNG"
+    assert result["size"] <= len(original) // 2 * 1.05
+    rgba = out.convert("RGBA")
+    assert rgba.getpixel((0, 0))[3] == 0
+    assert rgba.getpixel((150, 150))[3] == 255
+
+
+def test_png_lossy_fallback_reports_new_format():
+    original = _png_bytes(_noisy_rgba())
+    result = compress_image(original, "image/png", len(original) // 20)
+    assert result["output_mime"] == "image/webp"
+    assert result["output_ext"] == ".webp"
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format == "WEBP"
+    assert out.convert("RGBA").getpixel((0, 0))[3] == 0
+
+
+def _animated_gif(frames=16, width=160, height=120) -> bytes:
+    import numpy as np
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    images = []
+    for i in range(frames):
+        arr = background.copy()
+        arr[40:80, i * 6:i * 6 + 30] = (255, 0, 0)
+        images.append(Image.fromarray(arr))
+    buf = io.BytesIO()
+    images[0].save(buf, format="GIF", save_all=True, append_images=images[1:],
+                   duration=80, loop=0)
+    return buf.getvalue()
+
+
+def test_animated_gif_keeps_animation():
+    original = _animated_gif()
+    target = len(original) // 3
+    result = compress_image(original, "image/gif", target)
+    assert "output_ext" not in result
+    assert result["size"] <= target * 1.05
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format == "GIF"
+    assert out.n_frames > 1
+    assert out.info.get("loop") == 0
+
+
+def test_animated_gif_to_webp():
+    original = _animated_gif()
+    result = compress_image(original, "image/gif", len(original) // 4, animation_format="webp")
+    assert result["output_ext"] == ".webp"
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format == "WEBP"
+    assert out.n_frames == 16
+
+
+def test_still_gif_reports_jpeg_output():
+    buf = io.BytesIO()
+    Image.open(io.BytesIO(_make_test_jpeg(200, 150))).save(buf, format="GIF")
+    original = buf.getvalue()
+    result = compress_image(original, "image/gif", len(original) // 4)
+    assert result["output_ext"] == ".jpg"
+    assert result["data"][:2] == b"\xff\xd8"
+
+
+def test_best_format_reports_chosen_codec():
+    original = _make_test_jpeg(400, 300)
+    result = compress_image(original, "image/jpeg", len(original) // 4, best_format=True)
+    out = Image.open(io.BytesIO(result["data"]))
+    if out.format == "JPEG":
+        assert "output_ext" not in result
+    else:
+        assert result["output_mime"] == f"image/{out.format.lower()}"
+    assert result["size"] <= len(original) // 4 * 1.05
+
+
+def test_best_format_keeps_transparency():
+    original = _png_bytes(_noisy_rgba())
+    result = compress_image(original, "image/png", len(original) // 20, best_format=True)
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.format in ("WEBP", "AVIF")
+    assert out.convert("RGBA").getpixel((0, 0))[3] == 0
+
+
+def test_target_ssim_reaches_score():
+    from squishfile.compressor.quality import luma, ssim
+    original = _make_test_jpeg(400, 300)
+    result = compress_image(original, "image/jpeg", None, target_ssim=0.95)
+    assert result["ssim"] >= 0.95
+    assert result["size"] < len(original)
+    out = Image.open(io.BytesIO(result["data"]))
+    reference = luma(Image.open(io.BytesIO(original)))
+    assert abs(ssim(reference, luma(out, out.size)) - result["ssim"]) < 1e-9
+
+
+def test_jpeg_subsampling_follows_color_detail():
+    import numpy as np
+    from squishfile.compressor.image import (
+        SUBSAMPLING_420, SUBSAMPLING_422, SUBSAMPLING_444, _jpeg_subsampling,
+    )
+
+    smooth = Image.linear_gradient("L").resize((400, 300)).convert("RGB")
+    assert _jpeg_subsampling(smooth) == SUBSAMPLING_420
+
+    columns = np.zeros((300, 400, 3), dtype=np.uint8)
+    columns[:, ::2] = (255, 0, 0)
+    columns[:, 1::2] = (0, 0, 255)
+    assert _jpeg_subsampling(Image.fromarray(columns)) == SUBSAMPLING_444
+
+    rows = np.zeros((300, 400, 3), dtype=np.uint8)
+    rows[::2] = (255, 0, 0)
+    rows[1::2] = (0, 0, 255)
+    assert _jpeg_subsampling(Image.fromarray(rows)) == SUBSAMPLING_422
+
+
+def test_jpeg_search_keeps_chroma_detail_with_room():
+    from PIL import JpegImagePlugin
+
+    img = Image.new("RGB", (400, 300), (20, 40, 200))
+    pixels = img.load()
+    for x in range(0, 400, 2):
+        for y in range(300):
+            pixels[x, y] = (255, 40, 40)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=98, subsampling=0)
+    original = buf.getvalue()
+
+    result = compress_image(original, "image/jpeg", len(original) // 2)
+    assert result["size"] <= len(original) // 2 * 1.05
+    assert JpegImagePlugin.get_sampling(Image.open(io.BytesIO(result["data"]))) == 0
+
+
+def test_ladder_matches_each_target():
+    from squishfile.compressor.image import compress_image_ladder
+
+    original = _make_test_jpeg()
+    targets = [len(original) // 4, len(original) // 2, len(original) * 2]
+    results = compress_image_ladder(original, "image/jpeg", targets)
+    assert results[0]["size"] <= targets[0] * 1.05
+    assert results[1]["size"] <= targets[1] * 1.05
+    assert results[0]["quality"] < results[1]["quality"]
+    assert results[2]["skipped"] is True
+
+
+def test_detailed_444_jpeg_final_encode_does_not_overflow():
+    import numpy as np
+
+    from squishfile.compressor.engine import compress_file
+
+    # Noise has sharp chroma everywhere, so the JPEG keeps 4:4:4
+    rng = np.random.default_rng(0)
+    img = Image.fromarray((rng.random((400, 400, 3)) * 255).astype("uint8"))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    data = buf.getvalue()
+    result = compress_file(data, "image/png", "image", len(data) // 10, measure_quality=False)
+    assert result["size"] <= len(data) // 10 * 1.05
+
+
+def test_png_ladder_decodes_once(monkeypatch):
+    import numpy as np
+
+    from squishfile.compressor import image
+
+    rng = np.random.default_rng(1)
+    smooth = np.linspace(0, 255, 300 * 300 * 3).reshape(300, 300, 3)
+    pixels = (smooth + rng.normal(0, 8, smooth.shape)).clip(0, 255).astype("uint8")
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    original = buf.getvalue()
+
+    opened = []
+    real_open = image._open_image
+    monkeypatch.setattr(image, "_open_image", lambda data: opened.append(data) or real_open(data))
+    targets = [len(original) // 2, len(original) // 20, len(original) // 40]
+    results = image.compress_image_ladder(original, "image/png", targets)
+    assert len(opened) == 1
+    for result, target in zip(results, targets):
+        assert result["size"] <= target * 1.05
+    assert results[2]["output_mime"] == "image/jpeg"
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import os
+import time
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from squishfile import jobs
+from squishfile.main import app
+from squishfile.store import get_store
+
+client = TestClient(app)
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.linear_gradient("L").resize((600, 400)).convert("RGB").save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+def test_orphans_are_claimed_once(tmp_path):
+    journal = jobs.Journal(str(tmp_path / "journal.sqlite3"))
+    journal.submit("live", {}, owner="a")
+    journal.submit("dead", {}, owner="b")
+    journal.submit("finished", {}, owner="b")
+    journal.set_state("finished", jobs.JOB_DONE)
+
+    with journal._connect() as db:
+        db.execute("UPDATE jobs SET heartbeat = 0 WHERE owner = 'b'")
+
+    claimed = journal.claim_orphans(owner="c")
+    assert [job["file_id"] for job in claimed] == ["dead"]
+    assert journal.claim_orphans(owner="d") == []
+    assert journal.get("dead")["owner"] == "c"
+
+
+def test_interrupted_job_is_recovered(monkeypatch, tmp_path):
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    data = _jpeg()
+    uploaded = client.post("/api/upload", files={"file": ("a.jpg", data, "image/jpeg")}).json()
+    entry = get_store().get(uploaded["id"])
+
+    # A job left running by a process that died
+    journal = jobs.get_journal()
+    journal.submit(uploaded["id"], {
+        "mime": "image/jpeg", "category": "image", "target_size": len(data) // 2,
+    }, owner="crashed")
+    journal.set_state(uploaded["id"], jobs.JOB_RUNNING)
+    with journal._connect() as db:
+        db.execute("UPDATE jobs SET heartbeat = 0")
+
+    async def recover():
+        await asyncio.gather(*await jobs._recover(journal))
+
+    asyncio.run(recover())
+    assert client.get(f"/api/jobs/{entry['id']}").json()["state"] == jobs.JOB_DONE
+    resp = client.get(f"/api/download/{entry['id']}")
+    assert len(resp.content) <= len(data) // 2 * 1.05
+
+
+def test_sweep_removes_only_stale_leftovers(monkeypatch, tmp_path):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    stale, fresh, other = (tmp_path / name for name in ("squishfile-a.mp4", "squishfile-b.mp4", "c.mp4"))
+    for path in (stale, fresh, other):
+        path.write_bytes(b"x")
+    (tmp_path / "ffmpeg2pass_x").mkdir()
+    old = time.time() - jobs.TEMP_MAX_AGE - 60
+    for path in (stale, other, tmp_path / "ffmpeg2pass_x"):
+        os.utime(path, (old, old))
+
+    assert jobs.sweep_temp_files() == 2
+    assert sorted(os.listdir(tmp_path)) == ["c.mp4", "squishfile-b.mp4"]
+
+
+def test_job_keeps_curve_precomputed_while_it_ran(monkeypatch, tmp_path):
+    from squishfile import precompute
+
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    data = _jpeg()
+    uploaded = client.post("/api/upload", files={"file": ("a.jpg", data, "image/jpeg")}).json()
+    entry = get_store().get(uploaded["id"])
+
+    # The curve lands between the job reading the entry and storing its output
+    real_compress = jobs.run_compress
+
+    async def compress_then_precompute(**kwargs):
+        result = await real_compress(**kwargs)
+        precompute.precompute(entry["id"])
+        return result
+
+    monkeypatch.setattr(jobs, "run_compress", compress_then_precompute)
+    asyncio.run(jobs.run(entry, {
+        "mime": "image/jpeg", "category": "image", "target_size": len(data) // 2,
+    }))
+
+    stored = get_store().get(entry["id"])
+    assert "size_curve" in stored
+    assert stored["compressed_size"] <= len(data) // 2 * 1.05
+
+
+def test_sweep_keeps_passlog_cache(monkeypatch, tmp_path):
+    from squishfile.compressor import passlogs
+
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    monkeypatch.delenv("SQUISHFILE_STORE_DIR", raising=False)
+    cache = passlogs.cache_dir()
+    old = time.time() - jobs.TEMP_MAX_AGE - 60
+    for path in (cache, os.path.dirname(cache)):
+        os.utime(path, (old, old))
+
+    jobs.sweep_temp_files()
+    assert os.path.isdir(cache)
+
+
+def test_abandoned_job_is_recorded_as_cancelled(monkeypatch, tmp_path):
+    from squishfile import cancel
+
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    data = _jpeg()
+    uploaded = client.post("/api/upload", files={"file": ("a.jpg", data, "image/jpeg")}).json()
+    entry = get_store().get(uploaded["id"])
+    journal = jobs.get_journal()
+    stopped = []
+
+    async def slow_compress(job_id, **kwargs):
+        while not cancel.is_cancelled(job_id):
+            await asyncio.sleep(0.01)
+        stopped.append(job_id)
+        raise cancel.JobCancelled(job_id)
+
+    monkeypatch.setattr(jobs, "run_compress", slow_compress)
+    params = {"mime": "image/jpeg", "category": "image", "target_size": len(data) // 2}
+
+    async def abandon(flag: bool):
+        task = asyncio.create_task(jobs.run(entry, params, client="a"))
+        await asyncio.sleep(0.1)
+        if flag:  # As the route does when its client goes away
+            cancel.cancel_job(entry["id"])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.1)
+
+    # Shutting down: left unfinished, to be recovered
+    asyncio.run(abandon(flag=False))
+    assert journal.get(entry["id"])["state"] == jobs.JOB_RUNNING
+
+    asyncio.run(abandon(flag=True))
+    assert journal.get(entry["id"])["state"] == jobs.JOB_CANCELLED
+    assert stopped == [entry["id"]]
+    assert not cancel.is_cancelled(entry["id"])
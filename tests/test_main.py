@@ -8,3 +8,26 @@ def test_health_check():
     response = client.get("/api/health")
     assert response.status_code == 200
     assert response.json() == {"status": "ok", "version": "0.1.0"}
+
+
+def test_import_does_not_load_heavy_engines():
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, squishfile.main; "
+        "heavy = [m for m in ('fitz', 'PIL', 'numpy', 'imageio_ffmpeg') if m in sys.modules]; "
+        "assert not heavy, heavy"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_ffmpeg_checked_at_startup():
+    import time
+
+    with TestClient(app) as c:
+        assert c.get("/api/health").status_code == 200
+        deadline = time.time() + 10
+        while app.state.ffmpeg_available is None and time.time() < deadline:
+            time.sleep(0.05)
+        assert app.state.ffmpeg_available is True
@@ -0,0 +1,78 @@
+import io
+
+from PIL import Image
+
+from squishfile.compressor.engine import compress_file
+from squishfile.compressor.metadata import EXIF_ORIENTATION, strip_metadata
+
+
+def _tagged_image(fmt: str, orientation: int = 1, size=(300, 200)) -> bytes:
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    exif = Image.Exif()
+    exif[0x010E] = "description " * 2000  # ImageDescription: ~24KB of metadata
+    exif[EXIF_ORIENTATION] = orientation
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, exif=exif.tobytes(), quality=90)
+    return buf.getvalue()
+
+
+def test_strip_jpeg_keeps_pixels():
+    data = _tagged_image("JPEG")
+    stripped = strip_metadata(data, "image/jpeg")
+    assert len(stripped) < len(data) // 2
+    assert Image.open(io.BytesIO(stripped)).tobytes() == Image.open(io.BytesIO(data)).tobytes()
+    assert not Image.open(io.BytesIO(stripped)).getexif()
+
+
+def test_strip_keeps_orientation_only():
+    for fmt, mime in (("JPEG", "image/jpeg"), ("PNG", "image/png"), ("WEBP", "image/webp")):
+        stripped = strip_metadata(_tagged_image(fmt, orientation=6), mime)
+        assert dict(Image.open(io.BytesIO(stripped)).getexif()) == {EXIF_ORIENTATION: 6}
+
+
+def test_metadata_prepass_skips_reencode():
+    data = _tagged_image("JPEG")
+    result = compress_file(data, "image/jpeg", "image", target_size=len(data) // 2)
+    assert result["skipped"] is False
+    assert result["iterations"] == 1
+    assert result["ssim"] == 1.0
+
+
+def test_lossy_output_is_upright(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_STRIP_METADATA", "0")
+    data = _tagged_image("JPEG", orientation=6, size=(600, 400))
+    result = compress_file(data, "image/jpeg", "image", target_size=4000)
+    out = Image.open(io.BytesIO(result["data"]))
+    assert out.size == (400, 600)
+    assert out.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+
+def test_strip_jpeg_can_keep_icc():
+    from PIL import ImageCms
+
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(buf, format="JPEG", icc_profile=icc, comment=b"x" * 500)
+    stripped = strip_metadata(buf.getvalue(), "image/jpeg", keep_icc=True)
+    assert Image.open(io.BytesIO(stripped)).info["icc_profile"] == icc
+
+
+def test_ladder_shares_jpeg_repack():
+    from squishfile.compressor.engine import compress_ladder
+    from squishfile.compressor.metadata import optimize_jpeg
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(0, 255, 400 * 600 * 3).reshape(400, 600, 3)
+    pixels = (ramp + rng.normal(0, 20, ramp.shape)).clip(0, 255).astype("uint8")
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=90)
+    data = buf.getvalue()
+    # Within reach of a re-pack, which only the pre-pass tries
+    repacked = optimize_jpeg(data)
+    targets = [len(repacked), len(repacked) // 3]
+    results = compress_ladder(data, "image/jpeg", "image", targets, measure_quality=False)
+    assert results[0]["data"] == repacked
+    assert results[0]["iterations"] == 2
+    assert results[1]["size"] <= targets[1] * 1.05
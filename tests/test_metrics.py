@@ -0,0 +1,61 @@
+# tests/test_metrics.py
+import io
+import json
+import logging
+from PIL import Image
+from fastapi.testclient import TestClient
+from squishfile import metrics
+from squishfile.main import app
+
+client = TestClient(app)
+
+
+def test_span_records_histogram():
+    metrics.reset()
+    with metrics.span("unit", category="image"):
+        pass
+    text = metrics.render_prometheus()
+    assert 'squishfile_stage_duration_seconds_count{category="image",stage="unit"} 1' in text
+    assert 'le="+Inf"' in text
+
+
+def test_counters_and_iterations():
+    metrics.reset()
+    metrics.record_compression("image", 1000, {"size": 400, "skipped": False, "iterations": 3})
+    text = metrics.render_prometheus()
+    assert 'squishfile_bytes_in_total{category="image"} 1000' in text
+    assert 'squishfile_bytes_out_total{category="image"} 400' in text
+    assert 'squishfile_compressions_total{category="image",outcome="compressed"} 1' in text
+    assert 'squishfile_encode_iterations_bucket{category="image",le="3"} 1' in text
+    assert 'squishfile_encode_iterations_bucket{category="image",le="2"} 0' in text
+
+
+def test_trace_log(monkeypatch, caplog):
+    monkeypatch.setenv("SQUISHFILE_TRACE_LOG", "1")
+    with caplog.at_level(logging.INFO, logger="squishfile.trace"):
+        with metrics.span("unit") as attrs:
+            attrs["bytes_out"] = 12
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["span"] == "unit"
+    assert record["bytes_out"] == 12
+
+
+def test_metrics_endpoint_after_compress():
+    metrics.reset()
+    img = Image.new("RGB", (400, 300))
+    img.putdata([((i * 7) % 256, (i * 3) % 256, 128) for i in range(400 * 300)])
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=95)
+    buf.seek(0)
+    uploaded = client.post("/api/upload", files={"file": ("m.jpg", buf, "image/jpeg")}).json()
+    client.post("/api/compress", json={
+        "file_id": uploaded["id"],
+        "target_size_kb": max(1, uploaded["size"] // 1024 // 3),
+    })
+
+    resp = client.get("/api/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    for stage in ("detect", "route.upload", "image.search", "route.compress"):
+        assert f'stage="{stage}"' in resp.text
+    assert "squishfile_queue_wait_seconds_count 1" in resp.text
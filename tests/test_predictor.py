@@ -18,3 +18,59 @@ def test_predict_smaller_target_gives_lower_quality():
     q_big = predict_quality("image/jpeg", 4_000_000, 1_000_000, 1920, 1080)
     q_small = predict_quality("image/jpeg", 4_000_000, 200_000, 1920, 1080)
     assert q_small < q_big
+
+
+def test_predict_with_content_features():
+    quality = predict_quality(
+        "image/png", 2_000_000, 300_000, 1280, 800,
+        features={"entropy": 4.0, "edge_density": 0.1, "has_alpha": 1.0},
+    )
+    assert 5 <= quality <= 95
+
+
+def test_training_log_is_opt_in(tmp_path, monkeypatch):
+    import json
+    from squishfile.compressor.predictor import log_training_sample
+
+    log_path = tmp_path / "train.jsonl"
+    log_training_sample("image/jpeg", {"entropy": 5.0}, quality=60, iterations=2, predicted=58)
+    assert not log_path.exists()
+
+    monkeypatch.setenv("SQUISHFILE_TRAINING_LOG", str(log_path))
+    log_training_sample("image/jpeg", {"entropy": 5.0, "width": 10}, quality=60, iterations=2, predicted=58)
+    record = json.loads(log_path.read_text())
+    assert record["model"] == "jpeg"
+    assert record["quality"] == 60
+    assert record["features"] == {"entropy": 5.0}
+
+
+def test_batch_prediction_matches_single():
+    from squishfile.compressor.predictor import predict_qualities
+
+    items = [
+        {"file_type": "image/jpeg", "original_size": 4_000_000, "target_size": 500_000,
+         "width": 1920, "height": 1080},
+        {"file_type": "image/webp", "original_size": 900_000, "target_size": 300_000,
+         "width": 1280, "height": 720, "features": {"entropy": 6.5}},
+        {"file_type": "image/svg+xml", "original_size": 10_000, "target_size": 5_000},
+    ]
+    batch = predict_qualities(items)
+    single = [
+        predict_quality(i["file_type"], i["original_size"], i["target_size"],
+                        i.get("width", 1920), i.get("height", 1080), i.get("features"))
+        for i in items
+    ]
+    assert batch == single
+    assert batch[2] == int(0.5 * 85)  # no model: size-ratio heuristic
+
+
+def test_predictor_does_not_import_sklearn():
+    import subprocess
+    import sys
+
+    code = (
+        "import sys; from squishfile.compressor.predictor import predict_quality; "
+        "predict_quality('image/jpeg', 4_000_000, 500_000); "
+        "assert 'sklearn' not in sys.modules and 'joblib' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,41 @@
+import numpy as np
+from PIL import Image
+
+from squishfile.compressor.quality import PSNR_CAP, QUALITY_SIZE, luma, measure_pdf, psnr, ssim
+
+
+def test_ssim_identical_is_one():
+    rng = np.random.default_rng(0)
+    plane = rng.integers(0, 256, size=(64, 80)).astype(np.float64)
+    assert ssim(plane, plane) == 1.0
+
+
+def test_ssim_drops_with_noise():
+    rng = np.random.default_rng(0)
+    plane = rng.integers(0, 256, size=(64, 80)).astype(np.float64)
+    slightly = np.clip(plane + rng.normal(0, 5, plane.shape), 0, 255)
+    heavily = np.clip(plane + rng.normal(0, 40, plane.shape), 0, 255)
+    assert 1.0 > ssim(plane, slightly) > ssim(plane, heavily)
+
+
+def test_luma_downscales_and_flattens_alpha():
+    img = Image.new("RGBA", (2000, 1000), (0, 0, 0, 0))
+    plane = luma(img)
+    assert max(plane.shape) == QUALITY_SIZE
+    assert plane.min() == 255.0  # transparent shows as white
+
+
+def test_psnr_identical_is_capped():
+    plane = np.full((32, 32), 128.0)
+    assert psnr(plane, plane) == PSNR_CAP
+    assert 20 < psnr(plane, plane + 10) < 30
+
+
+def test_measure_pdf_identical_documents():
+    import fitz
+    doc = fitz.open()
+    for i in range(4):
+        doc.new_page().insert_text((72, 72), f"Page {i}", fontsize=24)
+    data = doc.tobytes()
+    scores = measure_pdf(data, data)
+    assert scores == {"ssim": 1.0, "psnr": PSNR_CAP}
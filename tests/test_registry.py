@@ -0,0 +1,39 @@
+from squishfile.compressor import registry
+from squishfile.compressor.engine import compress_file
+
+TIFF_ENGINE = registry.EngineSpec(
+    category="tiff",
+    mimes={"image/tiff": ".tif"},
+    entry_point="tests.test_registry:_compress_tiff",
+    seconds_per_mb=2.0,
+)
+
+
+def _compress_tiff(data, mime, target_size):
+    return {"data": data[:target_size], "size": target_size, "skipped": False}
+
+
+def test_builtin_mimes_and_extensions():
+    assert registry.for_mime("image/png").category == "image"
+    assert registry.extension_for("video/quicktime") == ".mov"
+    assert registry.extension_for("application/x-unknown") == ".bin"
+    assert "audio/x-wav" in registry.supported_mimes("audio")
+    assert registry.get("video").bound == registry.SUBPROCESS_BOUND
+
+
+def test_estimate_seconds_uses_mime_rate():
+    image = registry.get("image")
+    assert image.estimate_seconds(1024 * 1024, "image/png") > image.estimate_seconds(1024 * 1024, "image/jpeg")
+    assert image.estimate_seconds(2 * 1024 * 1024) == 2 * image.seconds_per_mb
+
+
+def test_registered_engine_is_dispatched(monkeypatch):
+    monkeypatch.setattr(registry, "_engines", dict(registry.engines()))
+    registry.register(TIFF_ENGINE)
+    assert registry.for_mime("image/tiff") is TIFF_ENGINE
+
+    result = compress_file(b"x" * 1000, "image/tiff", "tiff", target_size=100)
+    assert result["size"] == 100
+
+    result = compress_file(b"x" * 1000, "image/tiff", "tiff", target_size=None, target_ssim=0.9)
+    assert result["skipped"] is True
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from squishfile.scheduler import (
+    OVER_QUOTA, QUEUE_FULL, Rejected, Scheduler, estimate_cost,
+)
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_MAX_JOBS", "1")
+    monkeypatch.setenv("SQUISHFILE_CLIENT_MAX_JOBS", "1")
+
+
+def test_waiting_jobs_are_shared_fairly_between_clients(one_slot):
+    async def scenario():
+        scheduler = Scheduler()
+        order = []
+        heavy = [scheduler.submit("heavy", 60) for _ in range(4)]
+        light = [scheduler.submit("light", 5) for _ in range(2)]
+        names = {id(t): f"heavy{i}" for i, t in enumerate(heavy)}
+        names.update({id(t): f"light{i}" for i, t in enumerate(light)})
+
+        async def job(ticket):
+            await scheduler.wait(ticket)
+            order.append(names[id(ticket)])
+            scheduler.release(ticket)
+
+        await asyncio.gather(*(job(t) for t in heavy + light))
+        return order
+
+    # The light client does not wait for the heavy client's backlog
+    assert asyncio.run(scenario()) == ["heavy0", "light0", "light1", "heavy1", "heavy2", "heavy3"]
+
+
+def test_client_over_quota_is_rejected(one_slot, monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_CLIENT_CPU_SECONDS", "100")
+
+    async def scenario():
+        scheduler = Scheduler()
+        # A job above the quota runs when the client has nothing else queued
+        first = scheduler.submit("a", 150)
+        with pytest.raises(Rejected) as rejected:
+            scheduler.submit("a", 10)
+        # Other clients are unaffected
+        scheduler.submit("b", 10)
+        scheduler.release(first)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == OVER_QUOTA
+    assert rejected.retry_after == 60
+
+
+def test_long_queue_is_rejected_with_retry_after(one_slot, monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_MAX_QUEUE_WAIT", "30")
+
+    async def scenario():
+        scheduler = Scheduler()
+        scheduler.submit("a", 20)
+        scheduler.submit("b", 15)
+        scheduler.submit("c", 1)  # Runs before b's job: waits ~20s
+        with pytest.raises(Rejected) as rejected:
+            scheduler.submit("d", 20)  # After a, b and c: waits ~36s
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == QUEUE_FULL
+    assert rejected.retry_after == 6
+
+
+def test_cost_estimates_scale_with_the_work():
+    photo = {"category": "image", "mime": "image/jpeg", "size": 2_000_000,
+             "width": 4000, "height": 3000}
+    clip = {"category": "video", "mime": "video/mp4", "size": 2_000_000,
+            "duration": 60, "width": 3840, "height": 2160}
+    assert estimate_cost(photo, {"target_size": 500_000}) < 1
+    assert estimate_cost(photo, {"target_ssim": 0.95}) > estimate_cost(photo, {"target_size": 1})
+    assert estimate_cost(clip, {"target_size": 500_000}) > 300
@@ -0,0 +1,48 @@
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from squishfile.main import app
+from squishfile.store import DiskStore
+
+client = TestClient(app)
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.linear_gradient("L").resize((600, 400)).convert("RGB").save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+def test_disk_store_is_shared_between_instances(tmp_path):
+    first, second = DiskStore(str(tmp_path)), DiskStore(str(tmp_path))
+    first.add({"id": "abc", "data": b"hello", "mime": "text/plain"})
+
+    entry = second.get("abc")
+    assert "data" not in entry
+    with open(entry["path"], "rb") as f:
+        assert f.read() == b"hello"
+
+    second.set_output(entry, {"data": b"hi", "size": 2, "skipped": False})
+    second.save(entry)
+    with open(first["abc"]["compressed_path"], "rb") as f:
+        assert f.read() == b"hi"
+    assert first.get("missing") is None
+
+
+def test_api_with_disk_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    data = _jpeg()
+    uploaded = client.post("/api/upload", files={"file": ("a.jpg", data, "image/jpeg")}).json()
+    assert "path" not in uploaded
+
+    resp = client.get(f"/api/download/{uploaded['id']}")
+    assert resp.content == data
+
+    target_kb = len(data) // 1024 // 2
+    client.post("/api/compress", json={"file_id": uploaded["id"], "target_size_kb": target_kb})
+    resp = client.get(f"/api/download/{uploaded['id']}")
+    assert resp.content[:2] == b"\xff\xd8"
+    assert len(resp.content) < len(data)
+    assert len(list((tmp_path / "blobs").iterdir())) == 2
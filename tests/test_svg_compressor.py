@@ -0,0 +1,115 @@
+"""Tests for SVG minification and rasterization."""
+import io
+
+from PIL import Image
+
+from squishfile.compressor.image import compress_image
+from squishfile.compressor.svg import minify_svg
+
+INKSCAPE_SVG = b"""<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!-- Created with Inkscape -->
+<svg
+   xmlns:dc="http://purl.org/dc/elements/1.1/"
+   xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+   xmlns:svg="http://www.w3.org/2000/svg"
+   xmlns="http://www.w3.org/2000/svg"
+   xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"
+   xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+   width="200" height="100" viewBox="0 0 200.000000 100.000000"
+   inkscape:version="1.0" sodipodi:docname="drawing.svg">
+  <sodipodi:namedview id="base" inkscape:zoom="0.35"/>
+  <metadata>
+    <rdf:RDF><dc:format>image/svg+xml</dc:format></rdf:RDF>
+  </metadata>
+  <g inkscape:label="Layer 1">
+    <path d="M 10.123456,20.654321 L 30.5 , -40.25 Z" style="fill : #ff0000 ; stroke-width:0.26458332px" />
+    <text x="10.5555" y="20">Hello  world</text>
+  </g>
+</svg>
+"""
+
+
+def test_minify_strips_editor_data_and_rounds():
+    out = minify_svg(INKSCAPE_SVG).decode()
+    assert out.startswith('<svg xmlns="http://www.w3.org/2000/svg"')
+    for removed in ("inkscape", "sodipodi", "metadata", "rdf:", "<!--", "<?xml", "xmlns:svg"):
+        assert removed not in out
+    assert 'd="M10.123 20.654L30.5-40.25Z"' in out
+    assert 'style="fill:#f00;stroke-width:.265px"' in out
+    assert ">Hello  world</text>" in out
+
+
+def test_minify_keeps_more_decimals_for_small_viewboxes():
+    icon = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24"><path d="M12.123456 2.5L3.14159 20z"/></svg>'
+    assert b'd="M12.12 2.5L3.14 20z"' in minify_svg(icon, precision=1)
+
+
+def test_compress_svg_stays_svg_when_minify_is_enough():
+    result = compress_image(INKSCAPE_SVG, "image/svg+xml", len(INKSCAPE_SVG) // 2)
+    assert result["skipped"] is False
+    assert "output_ext" not in result
+    assert result["size"] <= len(INKSCAPE_SVG) // 2
+
+
+def test_compress_svg_rasterizes_below_minified_size(monkeypatch):
+    shapes = "".join(
+        f'<circle cx="{i * 7.123456 % 400}" cy="{i * 3.654321 % 300}" r="4.5" fill="#336699"/>'
+        for i in range(2000)
+    )
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300">{shapes}</svg>'.encode()
+    result = compress_image(svg, "image/svg+xml", 20 * 1024)
+    assert result["output_ext"] in (".png", ".webp", ".jpg")
+    assert Image.open(io.BytesIO(result["data"])).size == (400, 300)
+
+    monkeypatch.setenv("SQUISHFILE_SVG_RASTERIZE", "0")
+    result = compress_image(svg, "image/svg+xml", 20 * 1024)
+    assert "output_ext" not in result
+    assert result["data"].startswith(b"<svg")
+
+
+def test_svg_ladder_minifies_and_renders_once(monkeypatch):
+    import fitz
+
+    from squishfile.compressor import svg
+    from squishfile.compressor.image import compress_image_ladder
+
+    shapes = "".join(
+        f'<circle cx="{i * 7.123456 % 400}" cy="{i * 3.654321 % 300}" r="4.5" fill="#336699"/>'
+        for i in range(2000)
+    )
+    data = f'<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300">{shapes}</svg>'.encode()
+    minified, rendered = [], []
+    real_minify, real_open = svg.minify_svg, fitz.open
+    monkeypatch.setattr(svg, "minify_svg", lambda *args: minified.append(args) or real_minify(*args))
+    monkeypatch.setattr(fitz, "open", lambda *args, **kwargs: rendered.append(1) or real_open(*args, **kwargs))
+
+    targets = [len(data) * 2 // 3, 20 * 1024, 10 * 1024]
+    results = compress_image_ladder(data, "image/svg+xml", targets)
+    assert len(minified) == len(svg.PRECISIONS)
+    assert len(rendered) == 1
+    assert results[0]["data"].startswith(b"<svg")
+    assert results[2]["output_ext"] in (".png", ".webp", ".jpg")
+    assert results[2]["size"] <= targets[2] * 1.05
+
+
+def test_minify_keeps_small_transform_factors():
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 200 200">'
+        b'<g transform="translate(10.123, 20.456) scale(0.04)">'
+        b'<rect width="10" height="10" transform="matrix(0.04 0 0 0.04 10.126 10)"/></g></svg>'
+    )
+    out = minify_svg(svg, precision=1)
+    assert b'transform="translate(10.1 20.5) scale(.04)"' in out
+    assert b'transform="matrix(.04 0 0 .04 10.1 10)"' in out
+
+
+def test_minify_keeps_url_references_that_look_like_colors():
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg"><style>#aabbcc{fill:#ffeedd}</style>'
+        b'<linearGradient id="aabbcc"/>'
+        b'<rect fill="url(#aabbcc)" stroke="#ffffff" style="fill:url(\'#aabbcc\')"/></svg>'
+    )
+    out = minify_svg(svg)
+    assert b"<style>#aabbcc{fill:#fed}</style>" in out
+    assert b'fill="url(#aabbcc)" stroke="#fff"' in out
+    assert b"style=\"fill:url('#aabbcc')\"" in out
@@ -60,3 +60,89 @@ def test_upload_video_returns_duration(tmp_path):
     assert data["category"] == "video"
     assert "duration" in data
     assert data["duration"] > 0
+
+
+def test_resumable_upload(monkeypatch, tmp_path):
+    import hashlib
+    import os
+    from squishfile.store import get_store
+
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    data = _make_jpeg_file().getvalue()
+    upload = client.post("/api/uploads", json={"filename": "a.jpg", "size": len(data)}).json()
+    url = f"/api/uploads/{upload['upload_id']}"
+
+    assert client.put(f"{url}?offset=0", content=data[:500]).json()["offset"] == 500
+    # A chunk sent again after a dropped response is refused with the offset
+    resp = client.put(f"{url}?offset=0", content=data[:500])
+    assert resp.status_code == 409
+    assert resp.headers["Upload-Offset"] == "500"
+    assert client.post(f"{url}/finish").status_code == 400  # Incomplete
+
+    assert client.get(url).json()["offset"] == 500
+    client.put(f"{url}?offset=500", content=data[500:])
+    resp = client.post(f"{url}/finish", json={"sha256": hashlib.sha256(data).hexdigest()})
+    assert resp.status_code == 200
+    info = resp.json()
+    assert info["mime"] == "image/jpeg"
+    assert info["size"] == len(data)
+    assert info["width"] == 200
+
+    entry = get_store().get(info["id"])
+    with open(entry["path"], "rb") as f:
+        assert f.read() == data
+    assert not any(name.endswith(".json") for name in os.listdir(tmp_path / "uploads"))
+    assert client.get(url).status_code == 404
+
+
+def test_resumable_upload_checksum_mismatch():
+    data = _make_jpeg_file().getvalue()
+    upload = client.post("/api/uploads", json={"filename": "a.jpg"}).json()
+    url = f"/api/uploads/{upload['upload_id']}"
+    client.put(f"{url}?offset=0", content=data)
+
+    resp = client.post(f"{url}/finish", json={"sha256": "0" * 64})
+    assert resp.status_code == 400
+    assert client.delete(url).json()["deleted"]
+    assert client.get(url).status_code == 404
+
+
+def test_same_chunk_from_two_processes_is_appended_once(monkeypatch, tmp_path):
+    import os
+    import threading
+    import time
+
+    from squishfile import uploads
+
+    monkeypatch.setenv("SQUISHFILE_STORE_DIR", str(tmp_path))
+    upload = uploads.create("a.bin")
+    # Another process shares no thread locks, and reads the offset
+    # just as slowly
+    monkeypatch.setattr(uploads, "_session_lock", lambda upload_id: threading.Lock())
+    real_status = uploads.status
+
+    def slow_status(upload_id):
+        info = real_status(upload_id)
+        time.sleep(0.2)
+        return info
+
+    monkeypatch.setattr(uploads, "status", slow_status)
+    outcomes = []
+
+    def send():
+        try:
+            outcomes.append(uploads.append(upload["upload_id"], 0, b"x" * 100))
+        except uploads.OffsetMismatch as exc:
+            outcomes.append(exc)
+
+    threads = [threading.Thread(target=send) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 100 in outcomes
+    assert any(isinstance(outcome, uploads.OffsetMismatch) for outcome in outcomes)
+    assert real_status(upload["upload_id"])["offset"] == 100
+    uploads.abort(upload["upload_id"])
+    assert os.listdir(tmp_path / "uploads") == []
@@ -44,3 +44,78 @@ def test_skip_small_video():
     target = len(video_data) * 2
     result = compress_video(video_data, "video/mp4", target)
     assert result["skipped"] is True
+
+
+def test_ladder_encodes_every_target():
+    from squishfile.compressor.video import compress_video_ladder
+
+    video_data = _make_test_video(duration=2)
+    targets = [len(video_data) // 2, len(video_data) // 4, len(video_data) * 2]
+    results = compress_video_ladder(video_data, "video/mp4", targets)
+    for result in results[:2]:
+        assert result["skipped"] is False
+        assert result["size"] < len(video_data)
+        assert result["data"][4:8] == b"ftyp"
+    assert results[2]["skipped"] is True
+
+
+def test_retry_reuses_first_pass(monkeypatch, tmp_path):
+    from squishfile.compressor import passlogs
+
+    monkeypatch.setattr(passlogs, "cache_dir", lambda: str(tmp_path))
+    video_data = _make_test_video(duration=2)
+    first = compress_video(video_data, "video/mp4", len(video_data) // 2)
+    assert first["iterations"] == 2
+    assert any(name.endswith(".log.mbtree") for name in os.listdir(tmp_path))
+
+    retry = compress_video(video_data, "video/mp4", len(video_data) // 3)
+    assert retry["iterations"] == 1
+    assert retry["skipped"] is False
+    assert retry["size"] < len(video_data)
+
+
+def test_low_target_plans_smaller_frames_without_padding(monkeypatch, tmp_path):
+    from squishfile.compressor import passlogs
+    from squishfile.compressor.ffmpeg_utils import get_ffmpeg, probe_media
+
+    monkeypatch.setattr(passlogs, "cache_dir", lambda: str(tmp_path))
+    noise = str(tmp_path / "noise.mp4")
+    subprocess.run([
+        get_ffmpeg(), "-y", "-f", "lavfi",
+        "-i", "nullsrc=s=640x480:r=30:d=2,geq=random(1)*255:128:128",
+        "-c:v", "libx264", "-preset", "ultrafast", noise,
+    ], capture_output=True, timeout=30, check=True)
+    with open(noise, "rb") as f:
+        video_data = f.read()
+
+    result = compress_video(video_data, "video/mp4", 100_000)
+    assert result["size"] <= 100_000 * 1.1
+    video = probe_media(result["data"])["streams"][0]
+    assert video["width"] < 640
+    assert video["width"] * 3 == video["height"] * 4
+    assert passlogs.complexity(passlogs.content_key(video_data))
+
+
+def test_sample_encode_caps_every_clip_decoder(monkeypatch, tmp_path):
+    from squishfile.compressor import video
+    from squishfile.compressor.ffmpeg_utils import probe_media
+
+    monkeypatch.setenv("SQUISHFILE_PASSLOG_CACHE_MB", "0")
+    monkeypatch.setenv("SQUISHFILE_CPUS", "2")
+    path = tmp_path / "in.mp4"
+    path.write_bytes(_make_test_video(duration=6))
+    commands = []
+    real_popen = subprocess.Popen
+
+    def popen(cmd, **kwargs):
+        commands.append(cmd)
+        return real_popen(cmd, **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", popen)
+    planner = video._Planner(str(path), probe_media(path.read_bytes()), 6, "test")
+    assert planner._sampled((160, 120, 24))
+
+    cmd = commands[-1]
+    inputs = [k for k, arg in enumerate(cmd) if arg == "-i"]
+    assert len(inputs) == 3
+    assert all(cmd[k - 2:k] == ["-threads", "2"] for k in inputs)
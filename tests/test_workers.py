@@ -0,0 +1,49 @@
+# tests/test_workers.py
+import io
+from PIL import Image
+from fastapi.testclient import TestClient
+from squishfile import metrics, workers
+from squishfile.main import app
+
+
+def _jpeg_upload(client):
+    img = Image.new("RGB", (400, 300))
+    img.putdata([((i * 7) % 256, (i * 3) % 256, 128) for i in range(400 * 300)])
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=95)
+    buf.seek(0)
+    return client.post("/api/upload", files={"file": ("w.jpg", buf, "image/jpeg")}).json()
+
+
+def test_compress_in_process_pool(monkeypatch):
+    monkeypatch.setenv("SQUISHFILE_WORKERS", "1")
+    metrics.reset()
+    with TestClient(app) as client:
+        assert workers._pool is not None
+        uploaded = _jpeg_upload(client)
+        target_kb = max(1, uploaded["size"] // 1024 // 3)
+        resp = client.post("/api/compress", json={
+            "file_id": uploaded["id"],
+            "target_size_kb": target_kb,
+        })
+        assert resp.status_code == 200
+        assert resp.json()["compressed_size"] <= target_kb * 1024 * 1.05
+    assert workers._pool is None
+
+    # Observations made in the worker process are merged into the parent
+    text = metrics.render_prometheus()
+    assert 'stage="image.search"' in text
+    assert "squishfile_queue_wait_seconds_count 1" in text
+
+
+def test_drain_and_merge_roundtrip():
+    metrics.reset()
+    metrics.inc("squishfile_bytes_in_total", 10, category="pdf")
+    metrics.observe("squishfile_encode_iterations", 2, category="pdf")
+    drained = metrics.drain()
+    assert metrics.render_prometheus().count("category=") == 0
+    metrics.merge(drained)
+    metrics.merge(drained)
+    text = metrics.render_prometheus()
+    assert 'squishfile_bytes_in_total{category="pdf"} 20' in text
+    assert 'squishfile_encode_iterations_count{category="pdf"} 2' in text